@@ -131,6 +131,45 @@ API_KEY = "<API_KEY>"
 BASE_URL = "<BASE_URL>"
 MODEL = "<MODEL>"
 
+# AI 客户端连接池与超时（秒）
+AI_POOL_SIZE = 20
+AI_TIMEOUT = 60
+AI_CONNECT_TIMEOUT = 10
+AI_MAX_RETRIES = 2
+
+# 大模型响应缓存（键为 模型+消息+参数 的哈希）
+LLM_CACHE_ENABLED = True
+LLM_CACHE_SIZE = 2048  # 内存层条目数
+LLM_CACHE_TTL = 24 * 3600  # 过期时间（秒），None 为不过期
+LLM_CACHE_PATH = None  # SQLite 磁盘层文件路径，None 为不启用，如 os.path.join(BASE_DIR, 'data/llm_cache.sqlite3')
+LLM_CACHE_MAX_TEMPERATURE = 1.0  # 显式指定的 temperature 高于此值的请求不缓存（未指定时按接口默认值 1.0 计，可缓存）
+
+# 关联表 / 先验概率表版本号（存于数据库）的检查间隔（秒）：其他进程（如 load_kb）修改后，各进程至多延迟这么久重新加载
+KB_VERSION_CHECK_INTERVAL = 5
+
+# 每轮保存的 IEG 项数（按 IEG 降序取前 k 个，None 为全部保存）
+SESSION_IEG_TOP_K = 20
+
+# 历史会话列表每页条数（按最后更新时间倒序，游标分页）
+HISTORY_PAGE_SIZE = 50
+
+# 问诊推测执行：症状分类请求进行的同时，为“是/否”两种结果提前生成下一个问题（最多多一次模型调用）
+PIM_SPECULATIVE = False
+
+# 问题预取：IEG 算出后在后台为前 k 个症状提前生成问题，下一轮命中时无需等待模型（0 为关闭）
+PIM_PREFETCH_TOP_K = 0
+PIM_PREFETCH_WORKERS = 4
+
+# 候选疾病剪枝：每轮更新后按概率从小到大丢弃疾病，整个会话累计丢弃的概率质量不超过 PIM_PRUNE_MASS（0 为关闭），
+# 至少保留 PIM_PRUNE_MIN_DISEASES 种；丢弃的疾病及概率记录在各轮的 SessionTurn.pruned
+PIM_PRUNE_MASS = 0.0
+PIM_PRUNE_MIN_DISEASES = 3
+
+# 本地候选疾病：按症状倒排索引从患者描述中匹配症状，补充前 k 个候选疾病（与模型给出的疾病合并，0 为关闭）
+PIM_LOCAL_CANDIDATES = 5
+# 描述中匹配到的症状不少于该数目时只使用本地候选，不再调用模型猜测疾病（0 为始终调用模型）
+PIM_LOCAL_ONLY_MIN_SYMPTOMS = 0
+
 try:
     from .local_settings import *
 except ImportError:
@@ -0,0 +1,82 @@
+"""
+疾病名称模糊搜索基准：索引筛选 vs 线性扫描
+用法: python benchmarks/bench_fuzzy_search.py [--data data/medical.json] [--queries 50] [--threshold 90]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import django
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "AIMGD.settings")
+django.setup()
+
+from core.utils.knowledge_graph import KnowledgeGraph, DEFAULT_DATA_PATH
+
+
+def make_queries(names, n, seed=0):
+    """从疾病名称构造查询：原名、删字、加后缀、换字"""
+    rng = random.Random(seed)
+    queries = ['运动性晕厥', '低血糖', '中暑', '贫血', '体位性低血压', '过度换气综合征', '心肌缺血', '脑供血不足', '脱水',
+               '心律失常']
+    pool = list(names)
+    while len(queries) < n:
+        name = rng.choice(pool)
+        op = rng.randrange(4)
+        if op == 1 and len(name) > 2:
+            i = rng.randrange(len(name))
+            name = name[:i] + name[i + 1:]
+        elif op == 2:
+            name = name + rng.choice(['病', '症', '综合征'])
+        elif op == 3:
+            i = rng.randrange(len(name))
+            name = name[:i] + rng.choice(pool)[0] + name[i + 1:]
+        queries.append(name)
+    return queries
+
+
+def timed(fn, queries, threshold):
+    start = time.perf_counter()
+    results = [fn(q, threshold) for q in queries]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=DEFAULT_DATA_PATH)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--threshold', type=int, default=90)
+    args = parser.parse_args()
+
+    kg = KnowledgeGraph(args.data)
+    start = time.perf_counter()
+    index = kg.name_index
+    build = time.perf_counter() - start
+
+    queries = make_queries(kg.info.keys(), args.queries)
+    t_scan, scan = timed(kg._fuzzy_search_scan, queries, args.threshold)
+    t_index, indexed = timed(kg._fuzzy_search, queries, args.threshold)
+
+    start = time.perf_counter()
+    batched = kg.search_many(queries, args.threshold)
+    t_batch = time.perf_counter() - start
+
+    shortlist = sum(len(rows) for rows in index.candidates([q.lower().strip() for q in queries], args.threshold)
+                    if rows is not None) / len(queries)
+    mismatches = sum(a != b for a, b in zip(scan, indexed)) + sum(batched[q] != r for q, r in zip(queries, scan))
+
+    print(f"疾病数量: {len(index.names)}, 查询数量: {len(queries)}, 阈值: {args.threshold}")
+    print(f"索引构建: {build * 1000:.1f} ms, 平均候选数: {shortlist:.1f}")
+    print(f"线性扫描: {t_scan * 1000 / len(queries):.2f} ms/查询")
+    print(f"索引搜索: {t_index * 1000 / len(queries):.2f} ms/查询 (加速 {t_scan / max(t_index, 1e-9):.1f}x)")
+    print(f"批量搜索: {t_batch * 1000 / len(queries):.2f} ms/查询 (加速 {t_scan / max(t_batch, 1e-9):.1f}x)")
+    print(f"结果不一致: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
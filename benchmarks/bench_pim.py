@@ -0,0 +1,82 @@
+"""
+PIM 问诊引擎离线基准：模拟患者 + 离线模型，统计每轮耗时、查询数、结束轮数与 top-k 准确率
+可作为回归门槛：指标超出 --max-* / 低于 --min-* 时返回非零退出码
+用法: python benchmarks/bench_pim.py [--sessions 100] [--seed 0] [--data data/medical.json] [--json result.json]
+模拟会话写入的数据在结束时回滚
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import django
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "AIMGD.settings")
+django.setup()
+
+from django.db import transaction
+
+from core.services.pim_simulator import ConsultationSimulator, summarize
+from core.utils.knowledge_graph import KnowledgeGraph, DEFAULT_DATA_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=DEFAULT_DATA_PATH)
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=10, help="最大问诊轮次")
+    parser.add_argument('--related', type=int, default=6, help="候选中与真实疾病有共同症状的疾病数")
+    parser.add_argument('--noise', type=int, default=3, help="候选中随机疾病数")
+    parser.add_argument('--recall', type=float, default=1.0, help="候选包含真实疾病的概率")
+    parser.add_argument('--local-candidates', type=int, default=0,
+                        help="本地候选疾病数（描述取自真实症状，开启后准确率不再受 --recall 控制）")
+    parser.add_argument('--json', default=None, help="结果写入 JSON 文件")
+    parser.add_argument('--max-p90-ms', type=float, default=None)
+    parser.add_argument('--max-queries', type=int, default=None, help="单轮查询数上限")
+    parser.add_argument('--min-top1', type=float, default=None)
+    args = parser.parse_args()
+
+    simulator = ConsultationSimulator(kg=KnowledgeGraph(args.data), N_limit=args.limit, related=args.related,
+                                      noise=args.noise, recall=args.recall,
+                                      local_candidates=args.local_candidates, seed=args.seed)
+    simulator.service.ec.warm()  # 预先加载，不计入第一轮
+
+    start = time.perf_counter()
+    with transaction.atomic():
+        results = simulator.run(args.sessions)
+        transaction.set_rollback(True)
+    elapsed = time.perf_counter() - start
+    report = summarize(results)
+    report['seconds'] = elapsed
+
+    latency, turns, queries = report['latency_ms'], report['turns'], report['queries_per_turn']
+    print(f"会话数: {report['sessions']}, 总耗时: {elapsed:.2f}s ({report['sessions'] / elapsed:.1f} 会话/秒)")
+    print(f"每轮耗时: p50 {latency['p50']:.2f} ms, p90 {latency['p90']:.2f} ms, "
+          f"p99 {latency['p99']:.2f} ms, max {latency['max']:.2f} ms")
+    print(f"每轮查询: 平均 {queries['mean']:.1f}, 最多 {queries['max']}")
+    print(f"结束轮数: 平均 {turns['mean']:.2f}, p90 {turns['p90']:.0f}, 最多 {turns['max']:.0f}")
+    print(f"模型调用: {report['llm_calls_per_session']:.1f} 次/会话")
+    print("准确率: " + ", ".join(f"top-{k} {acc:.1%}" for k, acc in report['top_k_accuracy'].items()))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.max_p90_ms is not None and latency['p90'] > args.max_p90_ms:
+        failures.append(f"p90 {latency['p90']:.2f} ms > {args.max_p90_ms} ms")
+    if args.max_queries is not None and queries['max'] > args.max_queries:
+        failures.append(f"单轮查询 {queries['max']} > {args.max_queries}")
+    if args.min_top1 is not None and report['top_k_accuracy'][1] < args.min_top1:
+        failures.append(f"top-1 {report['top_k_accuracy'][1]:.3f} < {args.min_top1}")
+    for failure in failures:
+        print(f"未达标: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from core.models import DiseaseProb, RelationDiseaseSymptom, SymptomProb
+        from core.utils.incidence import invalidate_incidence_matrix
+        from core.utils.prior_tables import invalidate_prior_tables
+
+        # 关联表、先验概率表经 ORM 修改后递增版本号，各进程的缓存随之失效
+        # （bulk_create / bulk_update 不发送信号，批量加载需自行调用，见 load_kb）
+        for model, receiver in ((DiseaseProb, invalidate_prior_tables), (SymptomProb, invalidate_prior_tables),
+                                (RelationDiseaseSymptom, invalidate_incidence_matrix)):
+            post_save.connect(receiver, sender=model, dispatch_uid=f'invalidate_{model.__name__}')
+            post_delete.connect(receiver, sender=model, dispatch_uid=f'invalidate_{model.__name__}')
@@ -0,0 +1,76 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import DiagnosisSession
+from core.utils import EntropyCalculator, SessionBatch
+
+
+class Command(BaseCommand):
+    help = "批量计算已保存会话的疾病概率排名与下一步最优症状（所有会话堆叠后一次向量化计算）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="结果输出路径（JSON Lines），默认输出到标准输出")
+        parser.add_argument('--batch-size', type=int, default=1000, help="每批堆叠的会话数")
+        parser.add_argument('--limit', type=int, default=None, help="最多处理的会话数（按创建顺序）")
+        parser.add_argument('--top-k', type=int, default=3, help="输出的疾病与症状数")
+        parser.add_argument('--replay', action='store_true',
+                            help="不使用保存的概率，从先验概率开始按顺序重放症状回答")
+        parser.add_argument('--prune-mass', type=float, default=settings.PIM_PRUNE_MASS,
+                            help="重放时候选疾病剪枝允许丢弃的概率质量，默认同 PIM_PRUNE_MASS（0 为不剪枝）")
+        parser.add_argument('--prune-min-diseases', type=int, default=settings.PIM_PRUNE_MIN_DISEASES,
+                            help="剪枝时至少保留的疾病数，默认同 PIM_PRUNE_MIN_DISEASES")
+
+    def handle(self, *args, **options):
+        ec = EntropyCalculator().warm()  # 预先加载，不计入耗时
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else self.stdout
+        top_k = options['top_k']
+
+        start = time.perf_counter()
+        count = 0
+        try:
+            for sessions in self._batches(options['batch_size'], options['limit']):
+                if options['replay']:
+                    batch = SessionBatch.from_priors(ec, [s.disease_names for s in sessions])
+                    batch.replay([list(s.ans_to_symptom.items()) for s in sessions],
+                                 options['prune_mass'], options['prune_min_diseases'])
+                else:
+                    batch = SessionBatch(ec, [s.diseases[-1] for s in sessions],
+                                         [list(s.ans_to_symptom) for s in sessions])
+                next_symptoms = batch.top_symptoms(batch.ieg(), top_k)
+
+                for session, probs, symptoms in zip(sessions, batch.disease_prob(), next_symptoms):
+                    top_diseases = sorted(probs.items(), key=lambda item: -item[1])[:top_k]
+                    out.write(json.dumps({
+                        'session_id': str(session.session_id),
+                        'turns': session.turn_count,
+                        'top_diseases': top_diseases,
+                        'next_symptoms': symptoms,
+                    }, ensure_ascii=False) + '\n')
+                count += len(sessions)
+        finally:
+            if out is not self.stdout:
+                out.close()
+
+        elapsed = time.perf_counter() - start
+        self.stderr.write(self.style.SUCCESS(
+            f"已处理 {count} 个会话，耗时 {elapsed:.2f}s（{count / max(elapsed, 1e-9):.0f} 会话/秒）"
+        ))
+
+    @staticmethod
+    def _batches(size: int, limit=None):
+        """按主键顺序分批读取会话（连同各轮记录），跳过还没有疾病概率的会话"""
+        sessions = DiagnosisSession.objects.with_turns().order_by('pk')
+        last_pk, remaining = 0, limit
+        while remaining is None or remaining > 0:
+            page = list(sessions.filter(pk__gt=last_pk)[:size if remaining is None else min(size, remaining)])
+            if not page:
+                return
+            last_pk = page[-1].pk
+            if remaining is not None:
+                remaining -= len(page)
+            batch = [s for s in page if s.diseases]
+            if batch:
+                yield batch
@@ -0,0 +1,29 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.utils.knowledge_graph import KnowledgeGraph, DEFAULT_DATA_PATH
+from core.utils.kg_snapshot import snapshot_path_for
+
+
+class Command(BaseCommand):
+    help = "将 data/medical.json 编译为可 mmap 加载的知识图谱二进制快照"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data', default=DEFAULT_DATA_PATH, help="medical.json 路径")
+        parser.add_argument('--output', default=None, help="快照输出路径（默认与 JSON 同名，后缀 .kgsnap）")
+
+    def handle(self, *args, **options):
+        data_path = options['data']
+        output = options['output'] or snapshot_path_for(data_path)
+
+        start = time.perf_counter()
+        kg = KnowledgeGraph(data_path, use_snapshot=False)
+        kg.build_snapshot(output)
+        elapsed = time.perf_counter() - start
+
+        size_mb = os.path.getsize(output) / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"已写入 {len(kg.info)} 种疾病到 {output} ({size_mb:.2f} MB, {elapsed:.2f}s)"
+        ))
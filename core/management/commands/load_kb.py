@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from core.models import DiseaseProb, RelationDiseaseSymptom, SymptomProb
+from core.utils.kb_version import PRIORS, RELATION, bump_kb_version
+from core.utils.kb_loader import ensure_table, ensure_unique_constraints, read_prob_csv, relation_rows, sync_table
+from core.utils.knowledge_graph import KnowledgeGraph, DEFAULT_DATA_PATH
+from core.utils.kg_snapshot import snapshot_path_for
+
+DATA_DIR = os.path.join(Path(settings.BASE_DIR), 'data')
+TABLES = ('disease_prob', 'symptom_prob', 'relation')
+
+
+class Command(BaseCommand):
+    help = "将疾病/症状概率 CSV 与知识图谱的疾病-症状关系批量同步到当前数据库（可重复执行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--disease-prob', default=os.path.join(DATA_DIR, 'disease_prob_processed.csv'),
+                            help="疾病概率 CSV（疾病名称,概率）")
+        parser.add_argument('--symptom-prob', default=os.path.join(DATA_DIR, 'symptom_prob_processed.csv'),
+                            help="症状概率 CSV（症状名称,概率）")
+        parser.add_argument('--data', default=DEFAULT_DATA_PATH, help="medical.json 路径（疾病-症状关系）")
+        parser.add_argument('--only', nargs='+', choices=TABLES, default=list(TABLES), help="只同步指定的表")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="每批写入的行数")
+        parser.add_argument('--replace', action='store_true', help="删除数据源中没有的行")
+        parser.add_argument('--create-tables', action='store_true', help="表不存在时按模型建表（如本地 SQLite）")
+
+    def handle(self, *args, **options):
+        sources = {
+            'disease_prob': (DiseaseProb, 'disease_name', 'probability',
+                             lambda: read_prob_csv(options['disease_prob'])),
+            'symptom_prob': (SymptomProb, 'symptom_name', 'probability',
+                             lambda: read_prob_csv(options['symptom_prob'])),
+            'relation': (RelationDiseaseSymptom, 'disease_name', 'symptom_list',
+                         lambda: relation_rows(KnowledgeGraph(options['data']))),
+        }
+        tables = [t for t in TABLES if t in options['only']]
+        for table in tables:
+            paths = [options['data'], snapshot_path_for(options['data'])] if table == 'relation' else [options[table]]
+            if not any(os.path.exists(p) for p in paths):
+                raise CommandError(f"数据文件不存在: {paths[0]}")
+
+        if options['create_tables']:
+            for table in tables:
+                if ensure_table(sources[table][0]):
+                    self.stdout.write(f"已创建表 {sources[table][0]._meta.db_table}")
+
+        results = {}
+        with transaction.atomic():
+            for table in tables:
+                model, key_field, value_field, rows = sources[table]
+                results[table] = sync_table(model, key_field, value_field, rows(),
+                                            chunk_size=options['chunk_size'], replace=options['replace'])
+
+            # 批量写入不发送信号：随数据一起提交新版本号，正在运行的 web 进程据此重新加载
+            changed = {t for t, r in results.items() if r['created'] or r['updated'] or r['deleted']}
+            versions = [RELATION] if 'relation' in changed else []
+            if changed & {'disease_prob', 'symptom_prob'}:
+                versions.append(PRIORS)
+            if versions:
+                bump_kb_version(*versions)
+
+        # 修改表结构不能放在上面的事务中（SQLite 的限制）
+        for table in tables:
+            model = sources[table][0]
+            try:
+                for name in ensure_unique_constraints(model):
+                    self.stdout.write(f"已创建唯一索引 {model._meta.db_table}.{name}")
+            except IntegrityError as e:
+                raise CommandError(f"{model._meta.db_table} 存在重复名称，无法建立唯一索引，请使用 --replace 去重: {e}")
+
+        for table, r in results.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{sources[table][0]._meta.db_table}: {r['rows']} 行，新增 {r['created']}，更新 {r['updated']}，"
+                f"未变 {r['unchanged']}，删除 {r['deleted']}（{r['seconds']:.2f}s, {r['rows_per_sec']:.0f} 行/秒）"
+            ))
@@ -0,0 +1,94 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.models import DiagnosisSession
+from core.services import PIMService
+from core.services.session_replay import ReplayResult, ReplayTrace, init_worker, replay_in_worker, \
+    replay_traces, summarize_replay
+from core.utils import EntropyCalculator
+from core.utils.kb_loader import read_prob_csv
+from core.utils.shared_arrays import share_knowledge
+
+
+class Command(BaseCommand):
+    help = "用当前（或指定的）先验概率与阈值重放所有历史会话的症状回答，并与保存的结果比较"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="进程数，1 为不使用进程池")
+        parser.add_argument('--chunk-size', type=int, default=500, help="每个任务包含的会话数")
+        parser.add_argument('--disease-prob', default=None, help="替换疾病先验的 CSV（疾病名称,概率），只影响本次重放")
+        parser.add_argument('--symptom-prob', default=None, help="替换症状先验的 CSV（症状名称,概率），只影响本次重放")
+        parser.add_argument('--min-prob', type=float, default=None, help="替换 EntropyCalculator.MIN_PROB_THRESHOLD")
+        parser.add_argument('--n-limit', type=int, default=10, help="最大问诊轮次（判断结束轮数）")
+        parser.add_argument('--prune-mass', type=float, default=settings.PIM_PRUNE_MASS,
+                            help="候选疾病剪枝允许丢弃的概率质量，默认同 PIM_PRUNE_MASS（0 为不剪枝）")
+        parser.add_argument('--prune-min-diseases', type=int, default=settings.PIM_PRUNE_MIN_DISEASES,
+                            help="剪枝时至少保留的疾病数，默认同 PIM_PRUNE_MIN_DISEASES")
+        parser.add_argument('--output', default=None, help="逐个会话的对比结果（JSON Lines）")
+        parser.add_argument('--report', default=None, help="汇总报告（JSON）")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        ec = EntropyCalculator()
+        priors = ec.priors.with_overrides(
+            read_prob_csv(options['disease_prob']) if options['disease_prob'] else (),
+            read_prob_csv(options['symptom_prob']) if options['symptom_prob'] else (),
+        )
+        ec = EntropyCalculator(ec.incidence, priors)
+        if options['min_prob'] is not None:
+            ec.MIN_PROB_THRESHOLD = options['min_prob']
+
+        traces = [ReplayTrace.from_session(s) for s in DiagnosisSession.objects.with_turns().order_by('pk')
+                  .iterator(chunk_size=options['chunk_size']) if s.diseases]
+        load_seconds = time.perf_counter() - start
+
+        size = options['chunk_size']
+        chunks = [traces[i:i + size] for i in range(0, len(traces), size)]
+        start = time.perf_counter()
+        if options['workers'] <= 1 or len(chunks) <= 1:
+            pim = PIMService(N_limit=options['n_limit'], ec=ec)
+            prune = (options['prune_mass'], options['prune_min_diseases'])
+            results = [r for chunk in chunks for r in replay_traces(ec, pim, chunk, *prune)]
+        else:
+            connections.close_all()  # 子进程不使用数据库连接
+            shared, meta = share_knowledge(ec.incidence, priors)
+            try:
+                with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker,
+                                         initargs=(meta, options['min_prob'], options['n_limit'],
+                                                   options['prune_mass'], options['prune_min_diseases'])) as pool:
+                    results = [ReplayResult(**row) for rows in pool.map(replay_in_worker, chunks) for row in rows]
+            finally:
+                shared.close()
+        replay_seconds = time.perf_counter() - start
+
+        report = summarize_replay(results)
+        report.update({
+            'workers': options['workers'],
+            'load_seconds': load_seconds,
+            'replay_seconds': replay_seconds,
+            'sessions_per_sec': len(results) / replay_seconds if replay_seconds > 0 else 0.0,
+        })
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                for r in results:
+                    f.write(json.dumps(asdict(r), ensure_ascii=False) + '\n')
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        drift, stop = report['drift'], report['stop_turn']
+        self.stdout.write(self.style.SUCCESS(
+            f"重放 {report['sessions']} 个会话：读取 {load_seconds:.2f}s，重放 {replay_seconds:.2f}s"
+            f"（{report['sessions_per_sec']:.0f} 会话/秒，{options['workers']} 进程）"
+        ))
+        self.stdout.write(f"概率漂移（总变差）: 平均 {drift['mean']:.4f}, p95 {drift['p95']:.4f}, 最大 {drift['max']:.4f}")
+        self.stdout.write(f"top-1 变化: {report['top1_changed']} ({report['top1_changed_rate']:.1%})")
+        self.stdout.write(f"结束轮数: 相同 {stop['same']}, 提前 {stop['earlier']}, 推后或未知 {stop['later_or_unknown']}")
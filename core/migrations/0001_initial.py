@@ -0,0 +1,115 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:42
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiseaseProb',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disease_name', models.CharField(max_length=255, verbose_name='疾病名称')),
+                ('probability', models.DecimalField(decimal_places=10, max_digits=20, verbose_name='概率')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '疾病概率',
+                'verbose_name_plural': '疾病概率',
+                'db_table': 'disease_prob',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RelationDiseaseSymptom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disease_name', models.CharField(max_length=255, verbose_name='疾病名称')),
+                ('symptom_list', models.JSONField(default=list, help_text="格式: ['S1', 'S2', 'S3', 'S4', 'S5', ...]", verbose_name='病征列表')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '疾病-病征对照表',
+                'verbose_name_plural': '疾病-病征对照表',
+                'db_table': 'relation_disease_symptom',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SymptomProb',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symptom_name', models.CharField(max_length=255, verbose_name='病征名称')),
+                ('probability', models.DecimalField(decimal_places=10, max_digits=20, verbose_name='概率')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '病征概率',
+                'verbose_name_plural': '病征概率',
+                'db_table': 'symptom_prob',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DiagnosisSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(default=uuid.uuid4, max_length=100, unique=True, verbose_name='会话ID')),
+                ('patient_response', models.JSONField(default=list, help_text="格式: ['response1', 'response2', 'response3', 'response4', ...]", verbose_name='患者回答记录')),
+                ('ai_response', models.JSONField(default=list, help_text="格式: ['question1', 'question2', 'question3', 'question4', ...]", verbose_name='AI提问记录')),
+                ('diseases', models.JSONField(default=list, help_text="格式: [{'D1':0.5, 'D2':0.3, ...}, {'D1': 0.6, 'D2': 0.2, ...}, ...]", verbose_name='疾病概率分布')),
+                ('IEG', models.JSONField(default=list, help_text="格式: [{'S1':0.8, 'S2':0.6, ...}, {'S1':0.8, 'S3':0.6, ...}, ...]", verbose_name='信息熵增益')),
+                ('ans_to_symptom', models.JSONField(default=dict, help_text="格式: {'S1':True, 'S2':False, ...}", verbose_name='症状回答记录')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '诊断会话',
+                'verbose_name_plural': '诊断会话',
+                'db_table': 'diagnosis_session',
+            },
+        ),
+        migrations.CreateModel(
+            name='PSGReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('concise', models.TextField(max_length=10000, verbose_name='简单易懂报告')),
+                ('final', models.TextField(max_length=10000, verbose_name='最终报告')),
+                ('disease_name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('session', models.OneToOneField(db_column='session_id', on_delete=django.db.models.deletion.CASCADE, related_name='report', to='core.diagnosissession', to_field='session_id', verbose_name='关联会话')),
+            ],
+            options={
+                'verbose_name': '患者报告',
+                'verbose_name_plural': '患者报告',
+                'db_table': 'psg_report',
+            },
+        ),
+        migrations.CreateModel(
+            name='SOAPNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('initial', models.TextField(max_length=10000, verbose_name='初始记录')),
+                ('soap', models.TextField(max_length=10000, verbose_name='soap记录')),
+                ('final', models.TextField(max_length=10000, verbose_name='最终记录')),
+                ('disease_name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('session', models.OneToOneField(db_column='session_id', on_delete=django.db.models.deletion.CASCADE, related_name='soap_note', to='core.diagnosissession', to_field='session_id', verbose_name='关联会话')),
+            ],
+            options={
+                'verbose_name': 'SOAP记录',
+                'verbose_name_plural': 'SOAP记录',
+                'db_table': 'soap_note',
+            },
+        ),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:45
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+IEG_TOP_K = 20  # 迁移时固定使用，不随 settings 变化
+
+
+def _encode(disease_data):
+    values = [v if v is not None else np.nan for v in disease_data.values()]
+    return np.asarray(values, dtype='<f8').tobytes()
+
+
+def _decode(posterior, names):
+    values = np.frombuffer(bytes(posterior), dtype='<f8')
+    return {d: None if np.isnan(v) else float(v) for d, v in zip(names, values)}
+
+
+def split_turns(apps, schema_editor):
+    """把 DiagnosisSession 上的 JSON 历史拆成按轮记录"""
+    DiagnosisSession = apps.get_model('core', 'DiagnosisSession')
+    SessionTurn = apps.get_model('core', 'SessionTurn')
+
+    for session in DiagnosisSession.objects.iterator():
+        patient = session.patient_response or []
+        ai = session.ai_response or []
+        diseases = session.diseases or []
+        ieg = session.IEG or []
+        answers = list((session.ans_to_symptom or {}).items())
+        names = list(diseases[0]) if diseases else []
+        count = max(len(patient), len(ai), len(diseases), len(ieg), len(answers) + 1 if answers else 0)
+
+        turns = []
+        for i in range(count):
+            turn = SessionTurn(
+                session_id=session.session_id,
+                index=i,
+                patient_response=patient[i] if i < len(patient) else None,
+                ai_response=ai[i] if i < len(ai) else None,
+            )
+            if i < len(diseases):
+                turn.posterior = _encode(diseases[i])
+                turn.disease_names = None if list(diseases[i]) == names else list(diseases[i])
+            if i < len(ieg):
+                turn.ieg = dict(sorted(ieg[i].items(), key=lambda item: -item[1])[:IEG_TOP_K])
+            if 1 <= i <= len(answers):
+                turn.symptom, turn.symptom_answer = answers[i - 1]
+            turns.append(turn)
+        SessionTurn.objects.bulk_create(turns)
+
+        session.disease_names = names
+        session.save(update_fields=['disease_names'])
+
+
+def join_turns(apps, schema_editor):
+    """回滚：由按轮记录重新组装 JSON 历史"""
+    DiagnosisSession = apps.get_model('core', 'DiagnosisSession')
+    SessionTurn = apps.get_model('core', 'SessionTurn')
+
+    for session in DiagnosisSession.objects.iterator():
+        turns = list(SessionTurn.objects.filter(session_id=session.session_id).order_by('index'))
+        session.patient_response = [t.patient_response for t in turns if t.patient_response is not None]
+        session.ai_response = [t.ai_response for t in turns if t.ai_response is not None]
+        session.diseases = [_decode(t.posterior, t.disease_names if t.disease_names is not None
+                                    else session.disease_names) for t in turns if t.posterior is not None]
+        session.IEG = [t.ieg for t in turns if t.ieg is not None]
+        session.ans_to_symptom = {t.symptom: t.symptom_answer for t in turns if t.symptom is not None}
+        session.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosissession',
+            name='disease_names',
+            field=models.JSONField(default=list, help_text="格式: ['D1', 'D2', ...]", verbose_name='候选疾病'),
+        ),
+        migrations.CreateModel(
+            name='SessionTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='轮次')),
+                ('patient_response', models.TextField(null=True, verbose_name='患者回答')),
+                ('ai_response', models.TextField(null=True, verbose_name='AI提问')),
+                ('posterior', models.BinaryField(null=True, verbose_name='疾病概率')),
+                ('disease_names', models.JSONField(null=True, verbose_name='疾病名称')),
+                ('ieg', models.JSONField(null=True, verbose_name='信息熵增益')),
+                ('symptom', models.CharField(max_length=255, null=True, verbose_name='回答的症状')),
+                ('symptom_answer', models.BooleanField(null=True, verbose_name='症状是否出现')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('session', models.ForeignKey(db_column='session_id', on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='core.diagnosissession', to_field='session_id', verbose_name='关联会话')),
+            ],
+            options={
+                'verbose_name': '问诊轮次',
+                'verbose_name_plural': '问诊轮次',
+                'db_table': 'session_turn',
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('session', 'index'), name='uniq_session_turn_index')],
+            },
+        ),
+        migrations.RunPython(split_turns, join_turns),
+        migrations.RemoveField(
+            model_name='diagnosissession',
+            name='IEG',
+        ),
+        migrations.RemoveField(
+            model_name='diagnosissession',
+            name='ai_response',
+        ),
+        migrations.RemoveField(
+            model_name='diagnosissession',
+            name='ans_to_symptom',
+        ),
+        migrations.RemoveField(
+            model_name='diagnosissession',
+            name='diseases',
+        ),
+        migrations.RemoveField(
+            model_name='diagnosissession',
+            name='patient_response',
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:49
+
+import numpy as np
+from django.db import migrations, models
+
+
+def fill_summary(apps, schema_editor):
+    """按已有的各轮记录填充摘要列（用 update 写入，不改变 updated_at）"""
+    DiagnosisSession = apps.get_model('core', 'DiagnosisSession')
+    SessionTurn = apps.get_model('core', 'SessionTurn')
+
+    for session in DiagnosisSession.objects.only('session_id', 'disease_names').iterator():
+        turns = SessionTurn.objects.filter(session_id=session.session_id)
+        top_disease = ''
+        last = turns.exclude(posterior=None).order_by('-index').only('posterior', 'disease_names').first()
+        if last is not None:
+            names = last.disease_names if last.disease_names is not None else session.disease_names
+            values = np.nan_to_num(np.frombuffer(bytes(last.posterior), dtype='<f8'), nan=0.0)
+            if len(values):
+                top_disease = names[int(np.argmax(values))]
+        DiagnosisSession.objects.filter(pk=session.pk).update(turn_count=turns.count(), top_disease=top_disease)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_session_turn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosissession',
+            name='top_disease',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='最可能疾病'),
+        ),
+        migrations.AddField(
+            model_name='diagnosissession',
+            name='turn_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='轮数'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosissession',
+            index=models.Index(fields=['-updated_at', '-id'], name='session_updated_idx'),
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
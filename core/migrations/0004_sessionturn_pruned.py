@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_session_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessionturn',
+            name='pruned',
+            field=models.JSONField(null=True, verbose_name='剪枝丢弃的疾病'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_sessionturn_pruned'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeBaseVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='数据名称')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='版本号')),
+            ],
+            options={
+                'verbose_name': '知识库版本',
+                'verbose_name_plural': '知识库版本',
+                'db_table': 'kb_version',
+            },
+        ),
+    ]
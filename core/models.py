@@ -1,22 +1,36 @@
 import uuid
-from django.db import models
-from typing import List, Dict, Optional
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import models, transaction
+from typing import List, Dict, Optional, Tuple
 from decimal import Decimal
 from django.core.exceptions import ObjectDoesNotExist
 
 
+class DiagnosisSessionQuerySet(models.QuerySet):
+    def with_turns(self):
+        """同时读取各轮记录（异步视图中无法延迟加载，需预先读取）"""
+        return self.prefetch_related('turns')
+
+    def summaries(self):
+        """历史列表只读取会话标识、时间与摘要列，按最后更新时间倒序"""
+        return self.only('session_id', 'created_at', 'updated_at', 'top_disease', 'turn_count') \
+            .order_by('-updated_at', '-pk')
+
+
 class DiagnosisSession(models.Model):
     """
     整合后的诊断会话表，包含完整问诊流程数据
     字段说明：
     - session_id: 唯一会话标识（自动生成）
-    - patient_response: 患者每次的回答（JSON格式存储历史）
-    - ai_response: AI每次的提问（JSON格式存储历史）
-    - diseases: 当前疾病概率分布（JSON格式）
-    - IEG: 当前信息熵增益值（JSON格式）
-    - ans_to_symptom: 患者对症状的回答记录（JSON格式）
+    - disease_names: 候选疾病名称（疾病概率的存储顺序，首轮写入）
+    - top_disease / turn_count: 摘要（最新概率最高的疾病、轮数），写入各轮时同步更新，供历史列表使用
     - created_at: 创建时间
     - updated_at: 最后更新时间
+    每轮的回答、提问、疾病概率、IEG 与症状回答按轮追加到 SessionTurn，
+    patient_response / ai_response / diseases / IEG / ans_to_symptom 保持原有格式，由各轮记录组装
     """
     session_id = models.CharField(
         max_length=100,
@@ -24,81 +38,224 @@ class DiagnosisSession(models.Model):
         verbose_name="会话ID",
         default=uuid.uuid4
     )
-    patient_response = models.JSONField(
+    disease_names = models.JSONField(
         default=list,
-        verbose_name="患者回答记录",
-        help_text="格式: ['response1', 'response2', 'response3', 'response4', ...]"
-    )
-    ai_response = models.JSONField(
-        default=list,
-        verbose_name="AI提问记录",
-        help_text="格式: ['question1', 'question2', 'question3', 'question4', ...]"
-    )
-    diseases = models.JSONField(
-        default=list,
-        verbose_name="疾病概率分布",
-        help_text="格式: [{'D1':0.5, 'D2':0.3, ...}, {'D1': 0.6, 'D2': 0.2, ...}, ...]"
-    )
-    IEG = models.JSONField(
-        default=list,
-        verbose_name="信息熵增益",
-        help_text="格式: [{'S1':0.8, 'S2':0.6, ...}, {'S1':0.8, 'S3':0.6, ...}, ...]"
-    )
-    ans_to_symptom = models.JSONField(
-        default=dict,
-        verbose_name="症状回答记录",
-        help_text="格式: {'S1':True, 'S2':False, ...}"
+        verbose_name="候选疾病",
+        help_text="格式: ['D1', 'D2', ...]"
     )
+    top_disease = models.CharField(max_length=100, blank=True, default='', verbose_name="最可能疾病")
+    turn_count = models.PositiveIntegerField(default=0, verbose_name="轮数")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
 
+    objects = DiagnosisSessionQuerySet.as_manager()
+
     class Meta:
         db_table = 'diagnosis_session'
         verbose_name = "诊断会话"
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['-updated_at', '-id'], name='session_updated_idx'),
+        ]
+
+    # -------- 按轮记录组装的历史（兼容原 JSON 字段格式）
+    def _turn_rows(self) -> List['SessionTurn']:
+        """本会话的各轮记录（首次访问时读取，支持 prefetch_related('turns')）"""
+        rows = getattr(self, '_turns_cache', None)
+        if rows is None:
+            rows = [] if self._state.adding else list(self.turns.all())
+            self._turns_cache = rows
+        return rows
+
+    def _column(self, field: str) -> list:
+        return [getattr(t, field) for t in self._turn_rows() if getattr(t, field) is not None]
+
+    @property
+    def patient_response(self) -> List[str]:
+        """患者回答记录，格式: ['response1', 'response2', ...]"""
+        return self._column('patient_response')
+
+    @property
+    def ai_response(self) -> List[str]:
+        """AI提问记录，格式: ['question1', 'question2', ...]"""
+        return self._column('ai_response')
+
+    @property
+    def diseases(self) -> List[Dict[str, Optional[float]]]:
+        """疾病概率分布，格式: [{'D1':0.5, 'D2':0.3, ...}, {'D1': 0.6, 'D2': 0.2, ...}, ...]"""
+        return [t.disease_prob(self.disease_names) for t in self._turn_rows() if t.posterior is not None]
+
+    @property
+    def IEG(self) -> List[Dict[str, float]]:
+        """信息熵增益（每轮保存最大的前 k 项，按 IEG 降序），格式: [{'S1':0.8, 'S2':0.6, ...}, ...]"""
+        return self._column('ieg')
+
+    @property
+    def pruned(self) -> Dict[str, float]:
+        """剪枝丢弃的疾病及其丢弃前的概率，格式: {'D3': 0.002, ...}"""
+        return {d: p for t in self._turn_rows() if t.pruned for d, p in t.pruned.items()}
+
+    @property
+    def discarded_mass(self) -> float:
+        """剪枝累计丢弃的概率质量"""
+        return float(sum(p for t in self._turn_rows() if t.pruned for p in t.pruned.values()))
+
+    @property
+    def ans_to_symptom(self) -> Dict[str, bool]:
+        """症状回答记录，格式: {'S1':True, 'S2':False, ...}"""
+        return {t.symptom: t.symptom_answer for t in self._turn_rows() if t.symptom is not None}
+
+    def refresh_from_db(self, *args, **kwargs):
+        self._turns_cache = None
+        super().refresh_from_db(*args, **kwargs)
+
+    # -------- 追加记录
+    def _slot(self, field: str, offset: int = 0) -> 'SessionTurn':
+        """某一列的下一个空位所在的轮次，不存在时新建"""
+        rows = self._turn_rows()
+        pos = offset + sum(getattr(t, field) is not None for t in rows)
+        while len(rows) <= pos:
+            rows.append(SessionTurn(session=self, index=len(rows)))
+        return rows[pos]
 
     def append_patient_response(self, response: str):
         """向patient_response追加新的回答"""
-        if not isinstance(self.patient_response, list):
-            self.patient_response = []
-        self.patient_response.append(response)
-        self.save()
+        turn = self._slot('patient_response')
+        turn.patient_response = response
+        self._changed(turn)
 
     def append_ai_response(self, response: str):
         """向ai_response追加新的提问"""
-        if not isinstance(self.ai_response, list):
-            self.ai_response = []
-        self.ai_response.append(response)
-        self.save()
-
-    def append_disease(self, disease_data: dict):
-        """向diseases追加新的疾病概率分布"""
-        if not isinstance(self.diseases, list):
-            self.diseases = []
-        self.diseases.append(disease_data)
-        self.save()
+        turn = self._slot('ai_response')
+        turn.ai_response = response
+        self._changed(turn)
+
+    def append_disease(self, disease_data: dict, pruned: Optional[Dict[str, float]] = None):
+        """
+        向diseases追加新的疾病概率分布
+        :param pruned: 本轮剪枝丢弃的疾病及其概率
+        """
+        names = list(disease_data)
+        if not self.disease_names:
+            self.disease_names = names
+            self._changed(field='disease_names')
+        turn = self._slot('posterior')
+        turn.set_disease_prob(disease_data, self.disease_names)
+        turn.pruned = pruned or None
+        self._changed(turn)
 
     def append_IEG(self, ieg_data: dict):
-        """向IEG追加新的信息熵增益数据"""
-        if not isinstance(self.IEG, list):
-            self.IEG = []
-        self.IEG.append(ieg_data)
-        self.save()
+        """向IEG追加新的信息熵增益数据（只保存最大的前 settings.SESSION_IEG_TOP_K 项）"""
+        turn = self._slot('ieg')
+        turn.ieg = top_k_ieg(ieg_data, settings.SESSION_IEG_TOP_K)
+        self._changed(turn)
 
     def update_symptom_answer(self, symptom: str, answer: bool):
-        """更新症状回答记录"""
-        self.ans_to_symptom[symptom] = answer
-        self.save()
+        """更新症状回答记录（记在给出该回答的轮次上）"""
+        turn = next((t for t in self._turn_rows() if t.symptom == symptom), None)
+        if turn is None:
+            turn = self._slot('symptom', offset=1)  # 第 i 轮的回答针对第 i-1 轮的提问，首轮没有症状回答
+            turn.symptom = symptom
+        turn.symptom_answer = answer
+        self._changed(turn)
+
+    # -------- 按轮批量写入
+    def _changed(self, turn: Optional['SessionTurn'] = None, field: Optional[str] = None):
+        """记录修改：批量模式下延迟到 batch() 结束时统一保存，否则立即保存"""
+        pending = getattr(self, '_pending', None)
+        if pending is None:
+            self._flush([turn] if turn is not None else [], {field} if field else set())
+            return
+        turns, fields = pending
+        if turn is not None and not any(t is turn for t in turns):
+            turns.append(turn)
+        if field:
+            fields.add(field)
+
+    def _update_summary(self) -> set:
+        """按内存中的各轮记录刷新摘要列，返回需要保存的字段"""
+        rows = self._turn_rows()
+        self.turn_count = len(rows)
+        last = next((t for t in reversed(rows) if t.posterior is not None), None)
+        if last is not None:
+            probs = last.disease_prob(self.disease_names)
+            self.top_disease = max(probs, key=lambda d: probs[d] or 0.0) if probs else ''
+        return {'turn_count', 'top_disease'}
+
+    def _flush(self, turns: List['SessionTurn'], fields: set):
+        if turns:
+            fields = fields | self._update_summary()
+        with transaction.atomic():
+            if self._state.adding:
+                self.save()
+            else:
+                self.save(update_fields=[*sorted(fields), 'updated_at'])
+            for turn in turns:
+                turn.session = self
+                turn.save()
+
+    @contextmanager
+    def batch(self):
+        """
+        批量修改：块内的 append_* / update_symptom_answer 只修改内存中的对象，
+        退出时在一个事务中统一写入（会话一次 UPDATE，新一轮一次 INSERT）；块内抛出异常时不保存
+        """
+        if getattr(self, '_pending', None) is not None:  # 已在批量模式中，由外层统一保存
+            yield self
+            return
+
+        self._pending = ([], set())
+        try:
+            yield self
+            turns, fields = self._pending
+        except BaseException:
+            self._turns_cache = None  # 丢弃未保存的修改
+            raise
+        finally:
+            self._pending = None
+
+        if turns or fields:
+            self._flush(turns, fields)
+
+    def apply_turn(self,
+                   patient_response: Optional[str] = None,
+                   disease: Optional[dict] = None,
+                   ieg: Optional[dict] = None,
+                   ai_response: Optional[str] = None,
+                   symptom_answer: Optional[Tuple[str, bool]] = None,
+                   pruned: Optional[Dict[str, float]] = None):
+        """
+        写入一轮对话的全部数据：追加一行 SessionTurn，会话只更新一次
+        :param patient_response: 患者回答
+        :param disease: 新的疾病概率分布
+        :param pruned: 本轮剪枝丢弃的疾病及其概率
+        :param ieg: 新的信息熵增益
+        :param ai_response: AI 的提问
+        :param symptom_answer: 本轮症状回答 (症状, 是否出现)
+        """
+        with self.batch():
+            if symptom_answer is not None:
+                self.update_symptom_answer(*symptom_answer)
+            if patient_response is not None:
+                self.append_patient_response(patient_response)
+            if disease is not None:
+                self.append_disease(disease, pruned=pruned)
+            if ieg is not None:
+                self.append_IEG(ieg)
+            if ai_response is not None:
+                self.append_ai_response(ai_response)
 
     @property
     def last_ai_question(self) -> Optional[str]:
         """获取最后一条AI提问"""
-        return self.ai_response[-1] if self.ai_response else None
+        ai_response = self.ai_response
+        return ai_response[-1] if ai_response else None
 
     @property
     def last_patient_question(self) -> Optional[str]:
         """获取最后一条患者回答"""
-        return self.patient_response[-1] if self.patient_response else None
+        patient_response = self.patient_response
+        return patient_response[-1] if patient_response else None
 
     def save(self, *args, **kwargs):
         """重写save方法确保session_id存在"""
@@ -110,6 +267,75 @@ class DiagnosisSession(models.Model):
         return f"会话 {self.session_id} ({self.updated_at})"
 
 
+def top_k_ieg(ieg: Dict[str, float], k: Optional[int]) -> Dict[str, float]:
+    """IEG 按值降序取前 k 项（同值保持原顺序，因此第一项仍是 max(ieg, key=ieg.get)）；k 为 None 时保留全部"""
+    items = sorted(ieg.items(), key=lambda item: -item[1])
+    return dict(items[:k] if k is not None else items)
+
+
+class SessionTurn(models.Model):
+    """
+    会话的单轮记录（只追加，每轮一行）
+    字段说明：
+    - index: 轮次（从 0 开始）
+    - patient_response: 患者本轮的回答
+    - ai_response: AI 本轮的提问
+    - posterior: 本轮疾病概率，float64 小端字节串，顺序同会话的 disease_names
+    - disease_names: 仅当本轮疾病顺序与会话不同时记录
+    - pruned: 本轮剪枝丢弃的疾病及其丢弃前的概率（未剪枝为空）
+    - ieg: 本轮 IEG 最大的前 k 项
+    - symptom / symptom_answer: 本轮回答所针对的症状及是否出现
+    """
+    session = models.ForeignKey(
+        DiagnosisSession,
+        on_delete=models.CASCADE,
+        verbose_name="关联会话",
+        db_column='session_id',
+        to_field='session_id',
+        related_name='turns'
+    )
+    index = models.PositiveIntegerField(verbose_name="轮次")
+    patient_response = models.TextField(null=True, verbose_name="患者回答")
+    ai_response = models.TextField(null=True, verbose_name="AI提问")
+    posterior = models.BinaryField(null=True, verbose_name="疾病概率")
+    disease_names = models.JSONField(null=True, verbose_name="疾病名称")
+    pruned = models.JSONField(null=True, verbose_name="剪枝丢弃的疾病")
+    ieg = models.JSONField(null=True, verbose_name="信息熵增益")
+    symptom = models.CharField(max_length=255, null=True, verbose_name="回答的症状")
+    symptom_answer = models.BooleanField(null=True, verbose_name="症状是否出现")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        db_table = 'session_turn'
+        ordering = ['index']
+        verbose_name = "问诊轮次"
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='uniq_session_turn_index'),
+        ]
+
+    def set_disease_prob(self, disease_data: Dict[str, Optional[float]], session_names: List[str]):
+        """编码疾病概率（None 记为 nan）"""
+        names = list(disease_data)
+        self.disease_names = None if names == list(session_names) else names
+        values = [v if v is not None else np.nan for v in disease_data.values()]
+        self.posterior = np.asarray(values, dtype='<f8').tobytes()
+        self._decoded = None
+
+    def disease_prob(self, session_names: List[str]) -> Dict[str, Optional[float]]:
+        """解码疾病概率 {'D1': 0.5, ...}"""
+        decoded = getattr(self, '_decoded', None)
+        if decoded is None:
+            names = self.disease_names if self.disease_names is not None else session_names
+            values = np.frombuffer(bytes(self.posterior), dtype='<f8')
+            decoded = {d: None if np.isnan(v) else float(v) for d, v in zip(names, values)}
+            self._decoded = decoded
+        return dict(decoded)
+
+    def __str__(self):
+        return f"会话 {self.session_id} 第 {self.index} 轮"
+
+
 class SOAPNote(models.Model):
     session = models.OneToOneField(  # 改为一对一关系更合理
         DiagnosisSession,
@@ -187,6 +413,9 @@ class RelationDiseaseSymptom(models.Model):
         managed = False
         verbose_name = '疾病-病征对照表'
         verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['disease_name'], name='uniq_relation_disease_name'),  # 按名称查询走索引
+        ]
 
     def __str__(self):
         return f"Disease: {self.disease_name}, Symptom: {self.symptom_list}"
@@ -219,6 +448,9 @@ class DiseaseProb(models.Model):
         managed = False  # 关键设置：Django 不管理此表的迁移
         verbose_name = '疾病概率'
         verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['disease_name'], name='uniq_disease_prob_name'),  # 按名称查询走索引
+        ]
 
     def __str__(self):
         return f"{self.disease_name} (P={self.probability})"
@@ -261,6 +493,9 @@ class SymptomProb(models.Model):
         managed = False  # 关键设置：Django 不管理此表的迁移
         verbose_name = '病征概率'
         verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['symptom_name'], name='uniq_symptom_prob_name'),  # 按名称查询走索引
+        ]
 
     def __str__(self):
         return f"{self.symptom_name} (P={self.probability})"
@@ -290,3 +525,32 @@ class SymptomProb(models.Model):
     def get_prob(cls, symptom_names: List[str]) -> Dict[str, Optional[float]]:
         prob_dict = cls._get_probabilities_Decimal(symptom_names)
         return {k: float(v) if v is not None else None for k, v in prob_dict.items()}
+
+
+class KnowledgeBaseVersion(models.Model):
+    """
+    知识库数据版本：关联表、先验概率表重新加载后递增
+    存于数据库而非进程内，load_kb 等其他进程的修改也能被各 web 进程发现
+    """
+    name = models.CharField(max_length=50, unique=True, verbose_name="数据名称")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="版本号")
+
+    class Meta:
+        db_table = 'kb_version'
+        verbose_name = '知识库版本'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.name} (v{self.version})"
+
+    @classmethod
+    def current(cls) -> Dict[str, int]:
+        """{数据名称: 版本号}，从未递增过的为 0（不在字典中）"""
+        return dict(cls.objects.values_list('name', 'version'))
+
+    @classmethod
+    def bump(cls, *names: str):
+        """递增指定数据的版本号（在调用方的事务中，提交后其他进程可见）"""
+        for name in names:
+            cls.objects.get_or_create(name=name)
+            cls.objects.filter(name=name).update(version=models.F('version') + 1)
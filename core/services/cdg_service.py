@@ -1,24 +1,33 @@
 import heapq
 
-from core.utils import KnowledgeGraph, EntropyCalculator, AIGenerator
+from core.utils import get_knowledge_graph, EntropyCalculator, AIGenerator
 from core.models import DiagnosisSession, SOAPNote
 
 from typing import Dict, List, Tuple, Optional
 
 
 class CDGService:
-    def __init__(self, session: DiagnosisSession, N_disease: int = 3):
+    def __init__(self, session: DiagnosisSession, N_disease: int = 3, refresh: bool = False):
+        """
+        :param refresh: 重新生成已有内容时为 True，不使用缓存的旧结果
+        """
         self.session = session
         self.session_id = session.session_id
         self.N_disease = N_disease
-        self.ai = AIGenerator()
-        self.kg = KnowledgeGraph()
+        self.ai = AIGenerator(refresh=refresh)
+        self.kg = get_knowledge_graph()
 
     def generate_initial(self) -> Tuple[str, str]:
         """
         生成初始记录
         :return ("Disease", "initial note")
         """
+        return self.ai.generate_initial_note(info_dict=self._initial_info())
+
+    async def agenerate_initial(self) -> Tuple[str, str]:
+        return await self.ai.agenerate_initial_note(info_dict=self._initial_info())
+
+    def _initial_info(self) -> Dict:
         disease_prob = self.session.diseases[-1]  # {'D1':0.6, ...}
         if len(disease_prob) > self.N_disease:
             top_diseases = heapq.nlargest(
@@ -27,30 +36,50 @@ class CDGService:
                 key=lambda item: item[1]
             )
             disease_prob = dict(top_diseases)
-
-        qa = self._qa()
-        info_dict = {
+        return {
             'disease': disease_prob,
-            'qa': qa
+            'qa': self._qa()
         }
 
-        return self.ai.generate_initial_note(info_dict=info_dict)
-
     def generate_soap(self):
         """生成soap格式"""
         initial_note = SOAPNote.objects.get(session_id=self.session_id).initial
+        return self.ai.generate_soap_note(info=self._soap_info(initial_note), step=2)
+
+    async def agenerate_soap(self):
+        initial_note = (await SOAPNote.objects.aget(session_id=self.session_id)).initial
+        return await self.ai.agenerate_soap_note(info=self._soap_info(initial_note), step=2)
+
+    async def astream_soap(self):
+        """流式生成 soap 格式"""
+        initial_note = (await SOAPNote.objects.aget(session_id=self.session_id)).initial
+        async for delta in self.ai.astream_soap_note(info=self._soap_info(initial_note), step=2):
+            yield delta
 
+    def _soap_info(self, initial_note: str) -> str:
         qa = self._qa()
         combined_info = {
             '初始临床记录': initial_note,
             '医患问诊对话内容': qa
         }
-        return self.ai.generate_soap_note(info=str(combined_info), step=2)
+        return str(combined_info)
 
     def generate_final(self, disease):
         """补充信息，生成最终记录"""
         soap_note = SOAPNote.objects.get(session_id=self.session_id).soap
+        return self.ai.generate_soap_note(info=self._final_info(soap_note, disease), step=3)
+
+    async def agenerate_final(self, disease):
+        soap_note = (await SOAPNote.objects.aget(session_id=self.session_id)).soap
+        return await self.ai.agenerate_soap_note(info=self._final_info(soap_note, disease), step=3)
+
+    async def astream_final(self, disease):
+        """流式生成最终记录"""
+        soap_note = (await SOAPNote.objects.aget(session_id=self.session_id)).soap
+        async for delta in self.ai.astream_soap_note(info=self._final_info(soap_note, disease), step=3):
+            yield delta
 
+    def _final_info(self, soap_note: str, disease) -> str:
         # 补充信息
         additional_info = self.kg.info[disease]
         additional_info = additional_info.to_dict()
@@ -59,7 +88,7 @@ class CDGService:
             'soap格式临床记录': soap_note,
             '补充信息': additional_info
         }
-        return self.ai.generate_soap_note(info=str(combined_info), step=3)
+        return str(combined_info)
 
     # -------- 对话
     def _qa(self):
@@ -1,47 +1,87 @@
-from core.utils import KnowledgeGraph, EntropyCalculator, AIGenerator
-from core.models import DiagnosisSession, DiseaseProb, SymptomProb, RelationDiseaseSymptom
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from core.utils import get_knowledge_graph, EntropyCalculator, AIGenerator, SessionPosterior, posterior_cache, \
+    question_prefetcher
+from core.models import DiagnosisSession
 
 from typing import Dict, List, Tuple, Optional
 
 
 class PIMService:
-    def __init__(self, N_limit: int = 10):
+    def __init__(self, N_limit: int = 10, ec: Optional[EntropyCalculator] = None, kg=None,
+                 local_candidates: Optional[int] = None):
         """
         初始化PIM服务
         :param N_limit: 最大问诊轮次限制
+        :param ec: 熵计算工具，默认使用共享关联矩阵与先验概率表
+        :param kg: 知识图谱，默认使用进程内共享的图谱（首次使用时获取）
+        :param local_candidates: 本地候选疾病数，默认 settings.PIM_LOCAL_CANDIDATES
         """
-        self.kg = KnowledgeGraph()  # 知识图谱
-        self.ec = EntropyCalculator()  # 熵计算工具
+        self._kg = kg
+        self.local_candidates = local_candidates
+        self.ec = ec or EntropyCalculator()  # 熵计算工具
+        self.ai = AIGenerator()  # AI 调用（共享连接池）
         self.N_limit = N_limit  # 最大问诊轮次
         self.EPSILON = 1e-10
 
+    @property
+    def kg(self):
+        if self._kg is None:
+            self._kg = get_knowledge_graph()
+        return self._kg
+
     # ====================== 调用 ai ======================
     def _call_ai_get_diseases(self, text: str) -> List[str]:
         """调用 AI 获取初始疾病列表"""
-        ai = AIGenerator()
         # prompt = f"列出疾病：根据患者描述【{text}】，列出最可能的几种疾病名称（JSON格式），不可超过 10 种"
-        response = ai.generate_json_response(text, key="diseases")
+        response = self.ai.generate_json_response(text, key="diseases")
         return response["diseases"]
 
     def _call_ai_generate_question(self, symptom: str, diseases: Dict[str, float]) -> str:
         """调用 AI 生成症状询问问题"""
-        ai = AIGenerator()
         d_name = "、".join(list(diseases.keys()))
         # prompt = (
         #     "直接生成问题，不要生成其他多余的语句：\n"
         #     f"针对相关疾病【{d_name}】，将症状【{symptom}】转化为患者能理解的口语化问题（与这些疾病要紧密相关）。"
         #     f"询问患者是否有出现【{symptom}】相关的症状。"
         # )
-        return ai.generate_text_response(d_name, symptom)
+        prefetched = question_prefetcher.pop(d_name, symptom)
+        if prefetched is not None:
+            try:
+                return prefetched.result()
+            except Exception:
+                pass  # 预取失败时重新生成
+        return self.ai.generate_text_response(d_name, symptom)
 
     def _call_ai_yes_or_no(self, text: str, symptom: str, question: str) -> Dict[str, bool]:
         """
         调用AI分析患者‘是否’偏向
         :return {'Symptom': True}
         """
-        ai = AIGenerator()
         # prompt = f"针对问题【{question}】分析患者的回答【{text}】，提取病状【{symptom}】是否出现，是: 则 'True' 否: 则 'False'"
-        is_symptom = ai.generate_bool_response(question, text, symptom, key=symptom)
+        is_symptom = self.ai.generate_bool_response(question, text, symptom, key=symptom)
+        return {k: bool(is_symptom[k]) for k in is_symptom}
+
+    # -------- 异步版本（ASGI 视图使用，等待模型时不占用线程）
+    async def _acall_ai_get_diseases(self, text: str) -> List[str]:
+        response = await self.ai.agenerate_json_response(text, key="diseases")
+        return response["diseases"]
+
+    async def _acall_ai_generate_question(self, symptom: str, diseases: Dict[str, float]) -> str:
+        d_name = "、".join(list(diseases.keys()))
+        prefetched = question_prefetcher.pop(d_name, symptom)
+        if prefetched is not None:
+            try:
+                return await asyncio.wrap_future(prefetched)
+            except Exception:
+                pass  # 预取失败时重新生成
+        return await self.ai.agenerate_text_response(d_name, symptom)
+
+    async def _acall_ai_yes_or_no(self, text: str, symptom: str, question: str) -> Dict[str, bool]:
+        is_symptom = await self.ai.agenerate_bool_response(question, text, symptom, key=symptom)
         return {k: bool(is_symptom[k]) for k in is_symptom}
 
     # ====================== 核心功能 ======================
@@ -52,18 +92,54 @@ class PIMService:
         :param patient_desc: 患者初始症状描述
         :return: 初始会话数据 {'patient_response':..., 'diseases':..., 'IEG':...}
         """
-        # 1. 获取初始疾病列表
-        diseases = self._call_ai_get_diseases(patient_desc)
-        matched_diseases = self.kg.search_precise(diseases)
+        # 1. 获取初始疾病列表（本地倒排索引候选 + AI 猜测）
+        symptoms, local = self._local_candidates(patient_desc)
+        diseases = [] if self._local_only(symptoms, local) else self._call_ai_get_diseases(patient_desc)
+        return self._start_from_candidates(patient_desc, diseases, session_id, local=local)
+
+    async def astart_new_session(self, patient_desc: str, session_id: str) -> Dict:
+        """start_new_session 的异步版本"""
+        symptoms, local = await sync_to_async(self._local_candidates)(patient_desc)
+        diseases = [] if self._local_only(symptoms, local) else await self._acall_ai_get_diseases(patient_desc)
+        return await sync_to_async(self._start_from_candidates)(patient_desc, diseases, session_id, local=local)
+
+    def _local_candidates(self, patient_desc: str) -> Tuple[List[str], List[str]]:
+        """
+        用症状倒排索引从描述中匹配症状并给出候选疾病，候选数由 local_candidates（默认 settings.PIM_LOCAL_CANDIDATES）控制
+        :return: (匹配到的症状, 按得分降序的候选疾病)
+        """
+        k = self.local_candidates if self.local_candidates is not None else settings.PIM_LOCAL_CANDIDATES
+        if k <= 0:
+            return [], []
+        index = self.kg.symptom_index
+        symptoms = index.match(patient_desc)
+        return symptoms, [d for d, _ in index.rank(symptoms, k)]
+
+    @staticmethod
+    def _local_only(symptoms: List[str], local: List[str]) -> bool:
+        """描述中的症状足够多时只用本地候选，省去一次模型调用"""
+        n = settings.PIM_LOCAL_ONLY_MIN_SYMPTOMS
+        return bool(local) and 0 < n <= len(symptoms)
+
+    def _start_from_candidates(self, patient_desc: str, diseases: List[str], session_id: str,
+                               local: Optional[List[str]] = None) -> Dict:
+        """
+        由 AI 给出的疾病列表建立会话初始状态
+        :param diseases: AI 返回的疾病名称
+        :param local: 症状倒排索引给出的候选疾病，与 AI 的结果合并
+        """
+        matched_diseases = self.kg.search_precise(diseases) | self.kg.search_precise(local or [])
 
         # 2. 获得 sd_relation 疾病-症状关系 dict
-        sd_relation = RelationDiseaseSymptom.sd_relation(disease_list=matched_diseases)
+        sd_relation = self.ec.incidence.sd_relation(matched_diseases)
 
-        # 3. 计算初始IEG
-        ieg_init = self.ec.calculate_ieg(sd_relation=sd_relation, session_id=session_id)
+        # 3. 建立会话的增量后验状态，计算初始IEG
+        state = SessionPosterior.from_priors(self.ec, list(sd_relation))
+        ieg_init = state.ieg()
 
         # 4. 疾病更新
-        diseases = self.ec.get_disease_prob(sd_relation=sd_relation, session_id=session_id)
+        diseases = state.disease_prob()
+        posterior_cache.put(session_id, state)
 
         session_init = {
             'patient_response': patient_desc,
@@ -73,49 +149,158 @@ class PIMService:
 
         return session_init
 
-    def next_round(self, patient_ans: str, session_id: str, symptom_response: bool, symptom: str) -> Dict:
-        """下一轮对话"""
-        query_dict = DiagnosisSession.objects.get(session_id=session_id)
-        old_disease_prob = query_dict.diseases[-1]
-
-        sd_relation = RelationDiseaseSymptom.sd_relation(disease_list=list(old_disease_prob.keys()))
-        new_ieg = self.ec.calculate_ieg(sd_relation=sd_relation, session_id=session_id)
+    def next_round(self, patient_ans: str, session_id: str, symptom_response: bool, symptom: str,
+                   session: Optional[DiagnosisSession] = None) -> Dict:
+        """
+        下一轮对话（增量更新：缓存失效时才从会话记录重建状态）
+        :param session: 已读取的会话（传入时不再按 session_id 查询）
+        """
+        if session is None:
+            session = DiagnosisSession.objects.get(session_id=session_id)
+        state = self._load_state(session, symptom)
 
-        # 新概率
-        new_diseases_prob = self.ec.updated_disease_prob(session_id, symptom_response, symptom)
+        # 新IEG与新概率
+        new_ieg, new_diseases_prob, pruned = self._answer(state, symptom, symptom_response)
+        posterior_cache.put(session_id, state)
 
         session_data = {
             'patient_response': patient_ans,
             'diseases': new_diseases_prob,
-            'IEG': new_ieg
+            'IEG': new_ieg,
+            'pruned': pruned
         }
         return session_data
 
+    @staticmethod
+    def _answer(state: SessionPosterior, symptom: str, symptom_response: bool) -> Tuple[Dict, Dict, Dict]:
+        """
+        记录症状回答，并按 settings.PIM_PRUNE_MASS 剪枝候选疾病（被剪掉的症状不再出现在 IEG 中）
+        :return: (新IEG, 新概率, 本轮丢弃的疾病及其概率)
+        """
+        ieg, diseases = state.answer(symptom, symptom_response)
+        pruned = state.prune(settings.PIM_PRUNE_MASS, settings.PIM_PRUNE_MIN_DISEASES)
+        if pruned:
+            ieg = {s: v for s, v in ieg.items() if s in state.symptom_col}
+            diseases = state.disease_prob()
+        return ieg, diseases, pruned
+
+    def _load_state(self, session: DiagnosisSession, symptom: str) -> SessionPosterior:
+        """取会话的增量状态，缓存失效时从会话记录重建"""
+        state = posterior_cache.get(session, pending_symptom=symptom, data_version=self.ec.data_version)
+        if state is None:
+            state = SessionPosterior.from_session(self.ec, session, pending_symptom=symptom)
+        return state
+
+    def _speculate(self, session: DiagnosisSession,
+                   symptom: str) -> Dict[bool, Tuple[SessionPosterior, Dict, Dict, Dict]]:
+        """
+        对症状的两种回答分别做一次更新
+        :return: {回答: (更新后的状态, 新IEG, 新概率, 丢弃的疾病)}
+        """
+        state = self._load_state(session, symptom)
+        branches = {}
+        for response in (True, False):
+            branch = state.fork()
+            branches[response] = (branch, *self._answer(branch, symptom, response))
+        return branches
+
+    async def anext_round_speculative(self, session: DiagnosisSession, patient_ans: str,
+                                      symptom: str, question: str) -> Tuple[Dict[str, bool], Dict, str]:
+        """
+        推测执行的下一轮：等待症状分类的同时，对“是/否”两个分支分别更新概率并并发生成问题，
+        分类返回后保留匹配的分支。结果与 is_symptom_occurrence -> next_round -> generate_question 相同
+        :param session: 当前会话（尚未记录本轮症状回答）
+        :param symptom: 本轮询问的症状
+        :param question: 本轮的提问
+        :return: (症状回答 {'S1': True}, 会话数据, 下一个问题)；没有可问的症状时问题为 None
+        """
+        classify = asyncio.ensure_future(self.ais_symptom_occurrence(patient_ans, symptom, question))
+        # (候选疾病, 最优症状) -> 生成问题的任务，两个分支相同时只调用一次模型；剪枝后两个分支的候选疾病可能不同
+        questions = {}
+        try:
+            branches = await sync_to_async(self._speculate)(session, symptom)
+            for _, ieg, diseases, _ in branches.values():
+                if ieg:
+                    key = ("、".join(diseases), max(ieg, key=ieg.get))
+                    if key not in questions:
+                        questions[key] = asyncio.ensure_future(
+                            self._acall_ai_generate_question(symptom=key[1], diseases=diseases))
+
+            symptom_response = await classify
+            state, ieg, diseases, pruned = branches[bool(symptom_response[symptom])]
+            self.prefetch_questions(ieg, diseases)
+            # 没有可问的症状（如剪枝后症状全部回答过）时不再提问，由调用方结束问诊
+            ai_response = await questions[("、".join(diseases), max(ieg, key=ieg.get))] if ieg else None
+        finally:
+            for task in [classify, *questions.values()]:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # 未采用分支的异常不再抛出
+
+        posterior_cache.put(session.session_id, state)
+        session_data = {
+            'patient_response': patient_ans,
+            'diseases': diseases,
+            'IEG': ieg,
+            'pruned': pruned
+        }
+        return symptom_response, session_data, ai_response
+
+    def prefetch_questions(self, IEG: Dict[str, float], diseases: Dict[str, float]):
+        """
+        后台为 IEG 排名靠前的症状预先生成问题（不含本轮的最优症状），下一轮的最优症状多在其中
+        预取数量由 settings.PIM_PREFETCH_TOP_K 控制，0 为关闭
+        """
+        k = settings.PIM_PREFETCH_TOP_K
+        if k <= 0 or not IEG:
+            return
+        symptom_opt = max(IEG, key=IEG.get)
+        symptoms = question_prefetcher.top_symptoms(IEG, k, exclude=[symptom_opt])
+        d_name = "、".join(list(diseases.keys()))
+        question_prefetcher.prefetch(self.ai.generate_text_response, d_name, symptoms)
+
     def generate_question(self, IEG: Dict[str, float], diseases: Dict[str, float]) -> str:
         symptom_opt = max(IEG, key=IEG.get)
+        self.prefetch_questions(IEG, diseases)
         return self._call_ai_generate_question(symptom=symptom_opt, diseases=diseases)
 
+    async def agenerate_question(self, IEG: Dict[str, float], diseases: Dict[str, float]) -> str:
+        symptom_opt = max(IEG, key=IEG.get)
+        self.prefetch_questions(IEG, diseases)
+        return await self._acall_ai_generate_question(symptom=symptom_opt, diseases=diseases)
+
     def is_symptom_occurrence(self, patient_ans: str, symptom: str, question: str) -> Dict[str, bool]:
         return self._call_ai_yes_or_no(text=patient_ans, symptom=symptom, question=question)
 
+    async def ais_symptom_occurrence(self, patient_ans: str, symptom: str, question: str) -> Dict[str, bool]:
+        return await self._acall_ai_yes_or_no(text=patient_ans, symptom=symptom, question=question)
+
     # ====================== 停止询问 ======================
-    def should_stop(self, session_id: str) -> bool:
+    def should_stop(self, session_id: Optional[str] = None, session: Optional[DiagnosisSession] = None) -> bool:
         """
         判断是否终止问诊
         :param session_id: 当前会话 id
+        :param session: 已读取的会话（传入时不再按 session_id 查询）
         :return: 是否终止
         """
-        session = DiagnosisSession.objects.get(session_id=session_id)
+        if session is None:
+            session = DiagnosisSession.objects.get(session_id=session_id)
         ieg = session.IEG
+        return self.should_stop_on(len(ieg), [max(x.values(), default=0.0) for x in ieg[-3:]])
 
-        if len(ieg) >= self.N_limit:
+    def should_stop_on(self, turns: int, ieg_max: List[float]) -> bool:
+        """
+        按轮数与每轮最大 IEG 判断是否终止（不读取会话，供离线重放使用）
+        :param turns: 已进行的轮数
+        :param ieg_max: 各轮 IEG 的最大值（至少包含最后三轮）
+        """
+        if turns >= self.N_limit:
             return True
 
         # 2. IEG 收敛 (最后两个症状的 IEG 变化小于阈值)
-        if len(ieg) >= 3:
-            last = max(ieg[-1].values())
-            mid = max(ieg[-2].values())
-            pre = max(ieg[-3].values())
+        if len(ieg_max) >= 3:
+            pre, mid, last = ieg_max[-3:]
 
             diff2 = abs(last - mid) / (mid + self.EPSILON)
             diff1 = abs(mid - pre) / (pre + self.EPSILON)
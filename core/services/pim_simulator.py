@@ -0,0 +1,215 @@
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from django.db import connection
+
+from core.models import DiagnosisSession
+from core.utils import EntropyCalculator
+from .pim_service import PIMService
+
+
+@dataclass
+class SyntheticPatient:
+    """模拟患者：真实疾病、该疾病的症状（据此回答）以及模型会给出的候选疾病"""
+    disease: str
+    symptoms: Set[str]
+    candidates: List[str]
+
+
+@dataclass
+class SimulatedSession:
+    """单个模拟会话的结果"""
+    patient: SyntheticPatient
+    turns: int = 0
+    latencies: List[float] = field(default_factory=list)  # 每轮耗时（秒）
+    queries: List[int] = field(default_factory=list)  # 每轮数据库查询数
+    llm_calls: int = 0
+    ranking: List[str] = field(default_factory=list)  # 结束时按概率降序的疾病
+
+    def rank(self) -> Optional[int]:
+        """真实疾病在最终排名中的位置（从 1 开始），不在候选中为 None"""
+        try:
+            return self.ranking.index(self.patient.disease) + 1
+        except ValueError:
+            return None
+
+
+class QueryCounter:
+    """数据库执行包装（connection.execute_wrapper），统计执行的语句数"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class StubAIGenerator:
+    """
+    替代 AIGenerator 的离线模型：候选疾病来自模拟患者，问题为症状名称，
+    症状回答按真实疾病的症状列表给出；只实现 PIMService 同步流程用到的方法
+    """
+
+    def __init__(self):
+        self.patient: Optional[SyntheticPatient] = None
+        self.calls = 0
+
+    def generate_json_response(self, text: str, key: str) -> Dict[str, List[str]]:
+        self.calls += 1
+        return {key: list(self.patient.candidates)}
+
+    def generate_text_response(self, d_name: str, symptom: str) -> str:
+        self.calls += 1
+        return f"您是否有{symptom}？"
+
+    def generate_bool_response(self, question: str, text: str, symptom: str, key: str) -> Dict[str, bool]:
+        self.calls += 1
+        return {key: symptom in self.patient.symptoms}
+
+
+class ConsultationSimulator:
+    """
+    离线问诊模拟：按 DiseaseProb 先验抽取真实疾病，按 RelationDiseaseSymptom 的症状列表回答，
+    以与 patient_chat 相同的步骤驱动 PIMService（start_new_session / next_round / generate_question / should_stop），
+    记录每轮耗时、数据库查询数、结束轮数与真实疾病的排名
+    """
+
+    def __init__(self,
+                 ec: Optional[EntropyCalculator] = None,
+                 kg=None,
+                 N_limit: int = 10,
+                 related: int = 6,
+                 noise: int = 3,
+                 recall: float = 1.0,
+                 local_candidates: int = 0,
+                 seed: int = 0):
+        """
+        :param ec: 熵计算工具，默认使用共享关联矩阵与先验概率表
+        :param kg: 知识图谱，默认使用进程内共享的图谱
+        :param N_limit: 最大问诊轮次
+        :param related: 候选中与真实疾病有共同症状的疾病数
+        :param noise: 候选中随机疾病数
+        :param recall: 模型候选包含真实疾病的概率
+        :param local_candidates: 本地候选疾病数；患者描述取自真实疾病的症状，开启后真实疾病几乎总在候选中，
+            准确率不再受 recall 控制，因此默认关闭（不使用 settings.PIM_LOCAL_CANDIDATES）
+        :param seed: 随机种子
+        """
+        self.ai = StubAIGenerator()
+        self.service = PIMService(N_limit=N_limit, ec=ec, kg=kg, local_candidates=local_candidates)
+        self.service.ai = self.ai
+        self.related = related
+        self.noise = noise
+        self.recall = recall
+        self.rng = random.Random(seed)
+
+        inc = self.service.ec.incidence
+        prior = np.nan_to_num(self.service.ec.priors.disease[:len(inc.disease_names)], nan=0.0)
+        self._weights = prior if prior.sum() > 0 else np.ones(len(inc.disease_names))
+
+    def sample_patient(self) -> SyntheticPatient:
+        inc = self.service.ec.incidence
+        disease = self.rng.choices(inc.disease_names, weights=self._weights)[0]
+        symptoms = set(inc.sd_relation([disease])[disease])
+
+        # 与真实疾病有共同症状的疾病
+        d_idx = inc.disease_index([disease])
+        s_idx = inc.symptoms_of(d_idx)
+        rows = np.flatnonzero(inc.submatrix(np.arange(len(inc.disease_names)), s_idx).any(axis=1))
+        related = [inc.disease_names[i] for i in rows if inc.disease_names[i] != disease]
+
+        candidates = self.rng.sample(related, min(self.related, len(related)))
+        candidates += self.rng.sample(inc.disease_names, min(self.noise, len(inc.disease_names)))
+        if self.rng.random() < self.recall:
+            candidates.append(disease)
+        candidates = list(dict.fromkeys(candidates))
+        self.rng.shuffle(candidates)
+        return SyntheticPatient(disease, symptoms, candidates)
+
+    def _turn(self, result: SimulatedSession, session_id: str, first: bool) -> bool:
+        """与 patient_chat 相同的一轮，返回是否结束"""
+        service = self.service
+        patient = result.patient
+        session = DiagnosisSession.objects.with_turns().get(session_id=session_id)
+
+        if first:
+            desc = "、".join(sorted(patient.symptoms)[:3])
+            data = service.start_new_session(patient_desc=desc, session_id=session_id)
+            if not data['IEG']:
+                session.apply_turn(patient_response=desc, disease=data['diseases'], ieg=data['IEG'])
+                return True
+            question = service.generate_question(data['IEG'], data['diseases'])
+            session.apply_turn(patient_response=desc, disease=data['diseases'], ieg=data['IEG'],
+                               ai_response=question)
+        else:
+            ieg = session.IEG[-1]
+            symptom = max(ieg, key=ieg.get)
+            answer = '有' if symptom in patient.symptoms else '没有'
+            response = service.is_symptom_occurrence(answer, symptom, session.ai_response[-1])
+            data = service.next_round(answer, session_id, response[symptom], symptom, session=session)
+            question = service.generate_question(data['IEG'], data['diseases']) if data['IEG'] else None
+            session.apply_turn(patient_response=answer, disease=data['diseases'], ieg=data['IEG'],
+                               ai_response=question, symptom_answer=(symptom, response[symptom]),
+                               pruned=data['pruned'])
+            if not data['IEG']:
+                return True
+
+        return service.should_stop(session=session)
+
+    def run_one(self, patient: Optional[SyntheticPatient] = None) -> SimulatedSession:
+        """模拟一个完整会话（直到 should_stop 或没有可问的症状）"""
+        patient = patient or self.sample_patient()
+        self.ai.patient = patient
+        result = SimulatedSession(patient)
+        calls = self.ai.calls
+        session_id = DiagnosisSession.objects.create().session_id
+
+        stop = False
+        while not stop:
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                stop = self._turn(result, session_id, first=result.turns == 0)
+                result.latencies.append(time.perf_counter() - start)
+            result.queries.append(counter.count)
+            result.turns += 1
+
+        last = DiagnosisSession.objects.with_turns().get(session_id=session_id).diseases[-1]
+        result.ranking = sorted(last, key=lambda d: -(last[d] or 0.0))
+        result.llm_calls = self.ai.calls - calls
+        return result
+
+    def run(self, n: int) -> List[SimulatedSession]:
+        return [self.run_one() for _ in range(n)]
+
+
+def summarize(results: List[SimulatedSession], top_k=(1, 3, 5)) -> Dict:
+    """
+    汇总模拟结果
+    :return: {'sessions', 'turns': {...}, 'latency_ms': {...}, 'queries_per_turn': {...},
+              'llm_calls_per_session', 'top_k_accuracy': {k: 准确率}}
+    """
+    latencies = np.array([t for r in results for t in r.latencies]) * 1000
+    queries = np.array([q for r in results for q in r.queries])
+    turns = np.array([r.turns for r in results])
+    ranks = [r.rank() for r in results]
+
+    def percentiles(values):
+        if not len(values):
+            return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(values.max())}
+
+    return {
+        'sessions': len(results),
+        'turns': {'mean': float(turns.mean()) if len(turns) else 0.0, **percentiles(turns)},
+        'latency_ms': percentiles(latencies),
+        'queries_per_turn': {'mean': float(queries.mean()) if len(queries) else 0.0,
+                             'max': int(queries.max()) if len(queries) else 0},
+        'llm_calls_per_session': float(np.mean([r.llm_calls for r in results])) if results else 0.0,
+        'top_k_accuracy': {k: sum(rank is not None and rank <= k for rank in ranks) / max(len(results), 1)
+                           for k in top_k},
+    }
@@ -1,24 +1,37 @@
-from core.utils import KnowledgeGraph, EntropyCalculator, AIGenerator
+from core.utils import get_knowledge_graph, EntropyCalculator, AIGenerator
 from core.models import DiagnosisSession, SOAPNote, PSGReport
 
 from typing import Dict, List, Tuple, Optional
 
 
 class PSGService:
-    def __init__(self, session: DiagnosisSession):
+    def __init__(self, session: DiagnosisSession, refresh: bool = False):
+        """
+        :param refresh: 重新生成已有内容时为 True，不使用缓存的旧结果
+        """
         self.session = session
         self.session_id = session.session_id
         # self.disease_name = PSGReport.objects.get(session_id=self.session_id).disease_name
         disease_dict = session.diseases[-1]
         self.disease_name = max(disease_dict, key=disease_dict.get)
-        self.ai = AIGenerator()
-        self.kg = KnowledgeGraph()
+        self.ai = AIGenerator(refresh=refresh)
+        self.kg = get_knowledge_graph()
 
     def generate_concise(self):
         info_dict = self._basic_info()
         return self.ai.generate_report(info_dict=info_dict)
 
     def generate_final(self):
+        return self.ai.generate_report(info_dict=self._final_info())
+
+    async def agenerate_final(self):
+        return await self.ai.agenerate_report(info_dict=self._final_info())
+
+    def astream_final(self):
+        """流式生成最终报告"""
+        return self.ai.astream_report(info_dict=self._final_info())
+
+    def _final_info(self):
         additional_info = self.kg.info[self.disease_name]
         additional_info = additional_info.to_dict()
 
@@ -28,7 +41,7 @@ class PSGService:
             # 'concise': PSGReport.objects.get(session_id=self.session_id).concise,
             'addition': additional_info
         }
-        return self.ai.generate_report(info_dict=info_dict)
+        return info_dict
 
     def _basic_info(self):
         qa = self._qa()
@@ -0,0 +1,117 @@
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.models import DiagnosisSession
+from core.utils import EntropyCalculator, SessionBatch
+from core.utils.shared_arrays import attach_knowledge
+from .pim_service import PIMService
+
+
+@dataclass
+class ReplayTrace:
+    """重放所需的会话数据（不含数据库对象，可发送到子进程）"""
+    session_id: str
+    candidates: List[str]  # 首轮候选疾病
+    answers: List[Tuple[str, bool]]  # 按顺序的症状回答
+    posterior: Dict[str, Optional[float]]  # 保存的最终疾病概率
+    turns: int  # 保存的轮数
+
+    @classmethod
+    def from_session(cls, session: DiagnosisSession) -> 'ReplayTrace':
+        return cls(str(session.session_id), list(session.disease_names), list(session.ans_to_symptom.items()),
+                   session.diseases[-1], session.turn_count)
+
+
+@dataclass
+class ReplayResult:
+    """单个会话的重放对比"""
+    session_id: str
+    drift: float  # 保存与重放的最终疾病概率的总变差距离（0~1）
+    top1_before: str
+    top1_after: str
+    stop_before: int  # 保存的结束轮数
+    stop_after: Optional[int]  # 重放时 should_stop 触发的轮数，在已有回答内未触发为 None
+
+    @property
+    def top1_changed(self) -> bool:
+        return self.top1_before != self.top1_after
+
+
+def _top1(probs: Dict[str, Optional[float]]) -> str:
+    return max(probs, key=lambda d: probs[d] or 0.0) if probs else ''
+
+
+def _row_max(ieg: np.ndarray) -> np.ndarray:
+    """各会话本轮的最大 IEG，没有可问症状时为 0"""
+    m = np.max(np.where(np.isnan(ieg), -np.inf, ieg), axis=1, initial=-np.inf)
+    return np.where(np.isinf(m), 0.0, m)
+
+
+def replay_traces(ec: EntropyCalculator, pim: PIMService, traces: Sequence[ReplayTrace],
+                  prune_mass: float = 0.0, min_diseases: int = 1) -> List[ReplayResult]:
+    """
+    用 ec 的关联矩阵、先验概率与阈值重放一批会话（按轮同时更新整批会话），与保存的结果比较
+    回答序列固定为历史记录，因此结束轮数只能判断在已有回答范围内是否提前结束
+    :param prune_mass: 剪枝允许丢弃的概率质量（同 settings.PIM_PRUNE_MASS），记录时启用了剪枝的会话需用相同参数重放
+    :param min_diseases: 剪枝时至少保留的疾病数（同 settings.PIM_PRUNE_MIN_DISEASES）
+    """
+    batch = SessionBatch.from_priors(ec, [t.candidates for t in traces])
+    iegs = [batch.ieg()] + batch.replay([t.answers for t in traces], prune_mass, min_diseases)
+    ieg_max = np.stack([_row_max(ieg) for ieg in iegs], axis=1)  # (会话数, 轮数)
+    exhausted = np.stack([np.isnan(ieg).all(axis=1) for ieg in iegs], axis=1)  # 该轮没有可问的症状，问诊结束
+
+    results = []
+    for i, (trace, probs) in enumerate(zip(traces, batch.disease_prob())):
+        names = set(trace.posterior) | set(probs)
+        drift = 0.5 * sum(abs((trace.posterior.get(d) or 0.0) - probs.get(d, 0.0)) for d in names)
+
+        steps = len(trace.answers) + 1
+        stop_after = next((t for t in range(1, steps + 1)
+                           if exhausted[i, t - 1] or pim.should_stop_on(t, list(ieg_max[i, :t]))), None)
+        results.append(ReplayResult(trace.session_id, float(drift), _top1(trace.posterior), _top1(probs),
+                                    trace.turns, stop_after))
+    return results
+
+
+# ====================== 进程池 ======================
+_worker = {}
+
+
+def init_worker(meta: dict, min_prob_threshold: Optional[float], N_limit: int,
+                prune_mass: float = 0.0, min_diseases: int = 1):
+    """子进程初始化：挂载共享内存中的关联矩阵与先验概率表"""
+    import django
+    django.setup()  # spawn 方式启动的子进程需要初始化
+
+    shared, incidence, priors = attach_knowledge(meta)
+    ec = EntropyCalculator(incidence, priors)
+    if min_prob_threshold is not None:
+        ec.MIN_PROB_THRESHOLD = min_prob_threshold
+    _worker.update(shared=shared, ec=ec, pim=PIMService(N_limit=N_limit, ec=ec),
+                   prune=(prune_mass, min_diseases))
+
+
+def replay_in_worker(traces: Sequence[ReplayTrace]) -> List[dict]:
+    return [asdict(r) for r in replay_traces(_worker['ec'], _worker['pim'], traces, *_worker['prune'])]
+
+
+def summarize_replay(results: Sequence[ReplayResult]) -> Dict:
+    """汇总：概率漂移分布、top-1 变化、结束轮数变化"""
+    drift = np.array([r.drift for r in results])
+    earlier = sum(r.stop_after is not None and r.stop_after < r.stop_before for r in results)
+    same = sum(r.stop_after == r.stop_before for r in results)
+    n = max(len(results), 1)
+    return {
+        'sessions': len(results),
+        'drift': {
+            'mean': float(drift.mean()) if len(drift) else 0.0,
+            'p50': float(np.percentile(drift, 50)) if len(drift) else 0.0,
+            'p95': float(np.percentile(drift, 95)) if len(drift) else 0.0,
+            'max': float(drift.max()) if len(drift) else 0.0,
+        },
+        'top1_changed': sum(r.top1_changed for r in results),
+        'top1_changed_rate': sum(r.top1_changed for r in results) / n,
+        'stop_turn': {'same': same, 'earlier': earlier, 'later_or_unknown': len(results) - same - earlier},
+    }
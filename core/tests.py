@@ -1,3 +1,1153 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import threading
+import weakref
+from dataclasses import asdict
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import os
+import random
+import tempfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+
+from core.models import DiagnosisSession, DiseaseProb, KnowledgeBaseVersion, RelationDiseaseSymptom, SOAPNote, \
+    SymptomProb
+from core.services import PIMService
+from core.services.pim_simulator import ConsultationSimulator, summarize
+from core.services.session_replay import ReplayTrace, replay_traces, summarize_replay
+from core.views.history import session_page
+from core.views.streaming import STREAM_ERROR_MESSAGE, event_stream_response
+from core.utils import EntropyCalculator, IncidenceMatrix, KnowledgeGraph, PosteriorCache, PriorTables, \
+    QuestionPrefetcher, SessionBatch, SessionPosterior, posterior_cache
+from core.utils import ai_integration, get_incidence_matrix, get_knowledge_graph, get_prior_tables
+from core.utils import incidence as incidence_module, knowledge_graph as knowledge_graph_module, \
+    prior_tables as prior_tables_module
+from core.utils import kb_version as kb_version_module, llm_cache as llm_cache_module
+from core.utils.ai_integration import AIGenerator
+from core.utils.llm_cache import LLMCache, MemoryCache, SQLiteCache
+from core.utils.shared_arrays import attach_knowledge, share_knowledge
+
+
+class _StubOpenAIHandler(BaseHTTPRequestHandler):
+    """模拟 /v1/chat/completions，记录每个请求来自哪个客户端连接"""
+    protocol_version = 'HTTP/1.1'  # 支持长连接
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length))
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(payload)
+
+        body = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': payload['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': '您最近有咳嗽吗？'}}],
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOpenAIServerTestCase(SimpleTestCase):
+    """在本地线程中启动模拟的 OpenAI 接口"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubOpenAIHandler)
+        cls.server.connections, cls.server.requests = set(), []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/v1'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+
+class AIGeneratorClientTests(StubOpenAIServerTestCase):
+    def test_generators_share_one_pooled_connection(self):
+        with override_settings(BASE_URL=self.base_url, API_KEY='test', MODEL='stub-model', LLM_CACHE_ENABLED=False):
+            generators = [AIGenerator() for _ in range(3)]
+            answers = [ai.generate_text_response('感冒', '咳嗽') for ai in generators]
+
+        self.assertEqual(answers, ['您最近有咳嗽吗？'] * 3)
+        self.assertTrue(all(ai.client is generators[0].client for ai in generators))
+        self.assertIs(generators[0].prompt, ai_integration.get_prompts())
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.connections), 1)  # 三次调用复用同一个长连接
+
+    def test_client_rebuilt_when_settings_change(self):
+        with override_settings(BASE_URL=self.base_url, API_KEY='test'):
+            first = ai_integration.get_openai_client()
+        with override_settings(BASE_URL=self.base_url, API_KEY='test', AI_POOL_SIZE=5):
+            second = ai_integration.get_openai_client()
+        self.assertIsNot(first, second)
+
+
+async def _ask_model_view(request):
+    """只调用一次异步模型接口的视图，用于检查每个请求的事件循环结束后客户端是否释放"""
+    return HttpResponse(await AIGenerator(use_cache=False).agenerate_text_response('感冒', '咳嗽'))
+
+
+urlpatterns = [path('ask-model/', _ask_model_view)]
+
+
+@override_settings(ROOT_URLCONF='core.tests')
+class AsyncClientLifecycleTests(StubOpenAIServerTestCase):
+    def test_async_client_closed_with_request_loop(self):
+        created = []
+        get_client = ai_integration.get_async_openai_client
+
+        def tracked():
+            client = get_client()
+            created.append(weakref.ref(client))
+            return client
+
+        with override_settings(BASE_URL=self.base_url, API_KEY='test', MODEL='stub-model'), \
+                mock.patch.object(ai_integration, 'get_async_openai_client', side_effect=tracked):
+            for _ in range(2):  # WSGI 下每个异步视图在新的事件循环中运行
+                self.assertEqual(self.client.get('/ask-model/').content.decode(), '您最近有咳嗽吗？')
+
+        gc.collect()
+        self.assertEqual(len(created), 2)
+        self.assertEqual(ai_integration._async_clients, {})
+        self.assertEqual([ref for ref in created if ref() is not None], [])  # 客户端与连接池均已释放
+
+
+class LLMCacheTests(StubOpenAIServerTestCase):
+    def setUp(self):
+        self.server.requests.clear()
+
+    def test_identical_requests_served_from_cache(self):
+        cache = LLMCache([MemoryCache(8)], max_temperature=1.0)
+        with override_settings(BASE_URL=self.base_url, API_KEY='test', MODEL='stub-model'):
+            ai = AIGenerator(cache=cache)
+            answers = [ai.generate_text_response('感冒', '咳嗽') for _ in range(3)]
+            ai.generate_text_response('感冒', '发热')
+
+        self.assertEqual(answers, ['您最近有咳嗽吗？'] * 3)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def _default_cache(self):
+        """按默认配置新建进程内共享缓存（不受其他测试写入的条目影响）"""
+        for name in ('_cache', '_cache_key'):
+            patcher = mock.patch.object(llm_cache_module, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return override_settings(BASE_URL=self.base_url, API_KEY='test', MODEL='stub-model',
+                                 LLM_CACHE_ENABLED=True, LLM_CACHE_PATH=None)
+
+    def test_default_settings_cache_calls_without_temperature(self):
+        with self._default_cache():
+            answers = [AIGenerator().generate_text_response('感冒', '咳嗽') for _ in range(2)]
+            answers.append(async_to_sync(AIGenerator().agenerate_text_response)('感冒', '咳嗽'))
+
+        self.assertEqual(answers, ['您最近有咳嗽吗？'] * 3)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertNotIn('temperature', self.server.requests[0])
+
+    def test_refresh_skips_cached_result(self):
+        with self._default_cache():
+            AIGenerator().generate_soap_note('病历', step=2)
+            AIGenerator(refresh=True).generate_soap_note('病历', step=2)
+            self.assertEqual(len(self.server.requests), 2)
+            AIGenerator().generate_soap_note('病历', step=2)  # 重新生成的结果写回缓存
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_sqlite_tier_ttl_and_temperature_bypass(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            disk = SQLiteCache(os.path.join(tmp, 'llm.sqlite3'))
+            cache = LLMCache([MemoryCache(8), disk], ttl=60, max_temperature=0.5)
+            request = {'model': 'm', 'messages': [{'role': 'user', 'content': '你好'}], 'temperature': 0.3}
+            key = cache.key(request)
+            cache.set(key, '回复')
+
+            cache.tiers[0].clear()
+            self.assertEqual(cache.get(key), '回复')  # 内存层清空后由磁盘层命中
+            self.assertEqual(cache.stats()['tier1_hits'], 1)
+            self.assertIsNone(cache.key(dict(request, temperature=0.9)))
+            self.assertIsNone(cache.key({'model': 'm', 'messages': []}))  # 未指定按默认 1.0
+            self.assertEqual(cache.stats()['bypass'], 2)
+
+            disk.set('expired', '旧回复', ttl=-1)
+            self.assertIsNone(disk.get('expired'))
+            disk.close()
+
+
+class NoteRegenerateTests(StubOpenAIServerTestCase, TestCase):
+    _default_cache = LLMCacheTests._default_cache
+
+    def setUp(self):
+        self.server.requests.clear()
+
+    def test_regenerating_note_requests_model_again(self):
+        session = DiagnosisSession.objects.create()
+        session.apply_turn(patient_response='咳嗽', disease={'感冒': 0.7, '肺炎': 0.3})
+        SOAPNote.objects.create(session=session, initial='初步诊断：感冒', soap='', final='')
+
+        with self._default_cache(), mock.patch('core.services.cdg_service.get_knowledge_graph'):
+            url = reverse('doctor_note', args=[session.session_id])
+            for _ in range(2):  # 首次生成，之后点击“重新生成”
+                response = self.client.post(url, {'step': 'soap'})
+                self.assertEqual(response.json()['content'], '您最近有咳嗽吗？')
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class EventStreamTests(SimpleTestCase):
+    async def _stream(self, chunks):
+        saved = []
+
+        async def save(text):
+            saved.append(text)
+
+        response = event_stream_response(chunks, save)
+        body = b''.join([part async for part in response.streaming_content]).decode()
+        return body, saved
+
+    async def test_assembled_text_saved_on_completion(self):
+        async def chunks():
+            yield '注意'
+            yield '休息'
+
+        body, saved = await self._stream(chunks())
+        self.assertEqual(saved, ['注意休息'])
+        self.assertIn('data: {"delta": "注意"}', body)
+        self.assertTrue(body.endswith('event: done\ndata: {"status": "success"}\n\n'))
+
+    async def test_error_event_without_saving(self):
+        async def chunks():
+            yield '注意'
+            raise RuntimeError('upstream 502: secret-token')
+
+        with self.assertLogs('core.views.streaming', 'ERROR'):
+            body, saved = await self._stream(chunks())
+        self.assertEqual(saved, [])
+        self.assertIn(f'event: error\ndata: {{"error": "{STREAM_ERROR_MESSAGE}"}}', body)
+        self.assertNotIn('secret-token', body)
+        self.assertNotIn('event: done', body)
+
+
+class DiagnosisSessionTurnTests(TestCase):
+    def _session(self):
+        session = DiagnosisSession.objects.create()
+        session.apply_turn(
+            patient_response='头晕', disease={'贫血': 0.6, '低血糖': 0.4},
+            ieg={'乏力': 0.3}, ai_response='您是否乏力？'
+        )
+        return DiagnosisSession.objects.get(pk=session.pk)
+
+    def test_apply_turn_writes_once(self):
+        session = self._session()
+        session.IEG  # 读取已有轮次
+        # 事务在测试用例内表现为 SAVEPOINT / RELEASE；会话一次 UPDATE，新一轮一次 INSERT
+        with self.assertNumQueries(4) as ctx:
+            session.apply_turn(
+                patient_response='有一点',
+                disease={'贫血': 0.7, '低血糖': 0.3},
+                ieg={'心悸': 0.1, '面色苍白': 0.2},
+                ai_response='您是否面色苍白？',
+                symptom_answer=('乏力', True)
+            )
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        self.assertEqual(sorted(s for s in statements if s in ('INSERT', 'UPDATE', 'DELETE')), ['INSERT', 'UPDATE'])
+
+        session = DiagnosisSession.objects.get(pk=session.pk)
+        self.assertEqual(session.patient_response, ['头晕', '有一点'])
+        self.assertEqual(session.ai_response, ['您是否乏力？', '您是否面色苍白？'])
+        self.assertEqual(session.diseases, [{'贫血': 0.6, '低血糖': 0.4}, {'贫血': 0.7, '低血糖': 0.3}])
+        self.assertEqual(list(session.IEG[-1]), ['面色苍白', '心悸'])  # 按 IEG 降序保存
+        self.assertEqual(session.ans_to_symptom, {'乏力': True})
+        self.assertEqual(session.turns.count(), 2)
+
+    @override_settings(SESSION_IEG_TOP_K=2)
+    def test_ieg_keeps_top_k(self):
+        session = self._session()
+        session.append_IEG({'a': 0.1, 'b': 0.3, 'c': 0.3, 'd': 0.2})
+        self.assertEqual(DiagnosisSession.objects.get(pk=session.pk).IEG[-1], {'b': 0.3, 'c': 0.3})
+
+    def test_batch_discards_changes_on_error(self):
+        session = self._session()
+        with self.assertRaises(RuntimeError), self.assertNumQueries(0):
+            with session.batch():
+                session.append_patient_response('有一点')
+                raise RuntimeError
+        self.assertEqual(session.patient_response, ['头晕'])
+        self.assertEqual(DiagnosisSession.objects.get(pk=session.pk).patient_response, ['头晕'])
+
+
+class HistoryPageTests(TestCase):
+    def test_summary_and_keyset_pages(self):
+        sessions = []
+        for i in range(5):
+            session = DiagnosisSession.objects.create()
+            session.apply_turn(patient_response='头晕', disease={'贫血': 0.4, '低血糖': 0.6 - i / 10})
+            sessions.append(session)
+        # 更新时间相同的会话按主键区分
+        DiagnosisSession.objects.filter(pk__in=[s.pk for s in sessions[:3]]).update(updated_at=sessions[0].updated_at)
+
+        seen, cursor = [], None
+        with CaptureQueriesContext(connection) as ctx:
+            while True:
+                page, cursor = session_page(cursor, size=2)
+                seen.extend(page)
+                if cursor is None:
+                    break
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertNotIn('disease_names', ctx.captured_queries[0]['sql'])
+        self.assertEqual(sorted(s.pk for s in seen), sorted(s.pk for s in sessions))
+        self.assertEqual([(s.updated_at, s.pk) for s in seen],
+                         sorted(((s.updated_at, s.pk) for s in seen), reverse=True))
+        latest = seen[0]
+        self.assertEqual((latest.top_disease, latest.turn_count), ('贫血', 1))
+        self.assertEqual(seen[-1].top_disease, '低血糖')
+
+    def test_out_of_range_cursor_falls_back_to_first_page(self):
+        for _ in range(3):
+            DiagnosisSession.objects.create()
+        first, _ = session_page(None, size=2)
+        for cursor in ('99999999999999999999-1', '1-99999999999999999999', '-1-1', 'abc'):
+            page, _ = session_page(cursor, size=2)
+            self.assertEqual(page, first, cursor)
+        response = self.client.get(reverse('history_list'), {'cursor': '99999999999999999999-1'})
+        self.assertEqual(response.status_code, 200)
+
+
+class PriorTablesTests(SimpleTestCase):
+    def setUp(self):
+        self.incidence = IncidenceMatrix({'贫血': ['乏力', '心悸'], '低血糖': ['乏力', '出汗']})
+        self.priors = PriorTables(self.incidence, [('贫血', 0.3), ('低血糖', None), ('中暑', 0.1)],
+                                  [('乏力', 0.4), ('心悸', 0.1)], version=3)
+
+    def test_lookups(self):
+        self.assertEqual(self.priors.disease_prob_dict(['低血糖', '贫血', '中暑', '未知']),
+                         {'低血糖': None, '贫血': 0.3, '中暑': 0.1, '未知': None})  # 中暑不在关联矩阵中
+        self.assertEqual(self.priors.symptom_prob_dict(['出汗', '心悸', '乏力']), {'出汗': None, '心悸': 0.1, '乏力': 0.4})
+        np.testing.assert_array_equal(self.priors.disease_prob(self.incidence.disease_index(['贫血', '未知'])),
+                                      [0.3, np.nan])
+
+    def test_with_overrides_copies(self):
+        adjusted = self.priors.with_overrides([('贫血', 0.5), ('中暑', None), ('感冒', 0.2)], [('出汗', 0.3)])
+        self.assertEqual(adjusted.disease_prob_dict(['贫血', '中暑', '感冒']), {'贫血': 0.5, '中暑': None, '感冒': 0.2})
+        self.assertEqual(adjusted.symptom_prob_dict(['出汗', '乏力']), {'出汗': 0.3, '乏力': 0.4})
+        self.assertEqual(adjusted.version, 3)
+        self.assertEqual(self.priors.disease_prob_dict(['贫血', '中暑', '感冒']), {'贫血': 0.3, '中暑': 0.1, '感冒': None})
+        self.assertEqual(self.priors.symptom_prob_dict(['出汗']), {'出汗': None})
+
+
+class PIMTurnQueryTests(TestCase):
+    def setUp(self):
+        incidence = IncidenceMatrix({'贫血': ['乏力', '面色苍白', '心悸'], '低血糖': ['乏力', '出汗']})
+        priors = PriorTables(incidence, [('贫血', 0.3), ('低血糖', 0.2)],
+                             [('乏力', 0.4), ('面色苍白', 0.2), ('心悸', 0.1), ('出汗', 0.3)])
+        self.service = PIMService(ec=EntropyCalculator(incidence, priors))
+
+        state = SessionPosterior.from_priors(self.service.ec, ['贫血', '低血糖'])
+        session = DiagnosisSession.objects.create()
+        session.apply_turn(patient_response='头晕', disease=state.disease_prob(), ieg=state.ieg(),
+                           ai_response='您是否乏力？')
+        self.session_id = session.session_id
+
+    def test_follow_up_turn_reads_and_writes_session_once(self):
+        posterior_cache.discard(self.session_id)  # 从会话记录重建状态也不应再查询
+        with CaptureQueriesContext(connection) as ctx:
+            session = DiagnosisSession.objects.with_turns().get(session_id=self.session_id)
+            symptom = max(session.IEG[-1], key=session.IEG[-1].get)
+            data = self.service.next_round('有一点', self.session_id, True, symptom, session=session)
+            session.apply_turn(patient_response='有一点', disease=data['diseases'], ieg=data['IEG'],
+                               ai_response='您是否心悸？', symptom_answer=(symptom, True))
+            self.service.should_stop(session=session)
+
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        # 读取：会话一行 + 各轮记录；写入：新一轮 INSERT + 会话 UPDATE（SAVEPOINT 为测试事务所致）
+        self.assertEqual(statements.count('SELECT'), 2)
+        self.assertEqual(sorted(s for s in statements if s in ('INSERT', 'UPDATE', 'DELETE')), ['INSERT', 'UPDATE'])
+        self.assertEqual(len(DiagnosisSession.objects.get(session_id=self.session_id).diseases), 2)
+
+
+class QuestionPrefetcherTests(SimpleTestCase):
+    class StubGenerator:
+        """同步问题生成：记录调用，fail 中的症状抛出异常"""
+
+        def __init__(self, fail=()):
+            self.fail = set(fail)
+            self.calls = []
+            self._lock = threading.Lock()
+
+        def generate_text_response(self, d_name, symptom):
+            with self._lock:
+                self.calls.append((d_name, symptom))
+            if symptom in self.fail:
+                raise RuntimeError('upstream error')
+            return f"{d_name}|{symptom}"
+
+    def setUp(self):
+        self.prefetcher = QuestionPrefetcher()
+        self.addCleanup(lambda: self.prefetcher.executor.shutdown(wait=True))
+        patcher = mock.patch('core.services.pim_service.question_prefetcher', self.prefetcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        incidence = IncidenceMatrix({'贫血': ['乏力', '心悸'], '低血糖': ['乏力', '出汗']})
+        self.service = PIMService(ec=EntropyCalculator(incidence, PriorTables(
+            incidence, [('贫血', 0.3), ('低血糖', 0.2)], [('乏力', 0.4), ('心悸', 0.1), ('出汗', 0.3)])))
+        self.diseases = {'贫血': 0.6, '低血糖': 0.4}
+        self.ieg = {'乏力': 0.9, '心悸': 0.5, '出汗': 0.3, '头晕': 0.1}
+
+    def _wait(self, *symptoms):
+        for symptom in symptoms:
+            future = self.prefetcher._data[('贫血、低血糖', symptom)]
+            future.exception(timeout=5)
+
+    def test_pop_takes_result_once_and_evicts_oldest(self):
+        ai = self.StubGenerator()
+        prefetcher = QuestionPrefetcher(maxsize=2)
+        prefetcher.prefetch(ai.generate_text_response, '贫血', ['乏力', '心悸', '出汗'])
+        prefetcher.prefetch(ai.generate_text_response, '贫血', ['出汗'])  # 已在预取中，不重复生成
+
+        self.assertIsNone(prefetcher.pop('贫血', '乏力'))  # 超出容量，最早的被淘汰
+        self.assertEqual(prefetcher.pop('贫血', '心悸').result(timeout=5), '贫血|心悸')
+        self.assertIsNone(prefetcher.pop('贫血', '心悸'))
+        self.assertEqual(prefetcher.pop('贫血', '出汗').result(timeout=5), '贫血|出汗')
+        prefetcher.executor.shutdown(wait=True)
+        self.assertEqual(sorted(ai.calls), [('贫血', '乏力'), ('贫血', '出汗'), ('贫血', '心悸')])
+
+    @override_settings(PIM_PREFETCH_TOP_K=2)
+    def test_chosen_symptom_generated_now_and_runners_up_prefetched(self):
+        self.service.ai = ai = self.StubGenerator()
+        self.assertEqual(self.service.generate_question(self.ieg, self.diseases), '贫血、低血糖|乏力')
+        self._wait('心悸', '出汗')
+
+        self.assertEqual(list(self.prefetcher._data), [('贫血、低血糖', '心悸'), ('贫血、低血糖', '出汗')])
+        self.assertEqual(ai.calls.count(('贫血、低血糖', '乏力')), 1)
+
+        # 下一轮的最优症状命中预取，不再调用模型
+        self.assertEqual(self.service.generate_question({'心悸': 0.8, '出汗': 0.2}, self.diseases),
+                         '贫血、低血糖|心悸')
+        self.assertEqual(ai.calls.count(('贫血、低血糖', '心悸')), 1)
+
+    @override_settings(PIM_PREFETCH_TOP_K=2)
+    def test_failed_prefetch_falls_back_to_fresh_call(self):
+        self.service.ai = ai = self.StubGenerator(fail={'心悸'})
+        self.service.prefetch_questions(self.ieg, self.diseases)
+        self._wait('心悸', '出汗')
+
+        ai.fail.clear()
+        self.assertEqual(self.service._call_ai_generate_question('心悸', self.diseases), '贫血、低血糖|心悸')
+        self.assertEqual(ai.calls.count(('贫血、低血糖', '心悸')), 2)
+        self.assertNotIn(('贫血、低血糖', '心悸'), self.prefetcher._data)
+
+
+class KnowledgeGraphSnapshotTests(SimpleTestCase):
+    RECORDS = [
+        {'_id': {'$oid': 'a1'}, 'name': '贫血', 'desc': '血红蛋白降低', 'category': ['内科', '血液科'],
+         'symptom': ['乏力', '面色苍白'], 'acompany': ['心衰'], 'check': ['血常规'], 'cure_way': ['药物治疗'],
+         'recommand_drug': ['硫酸亚铁片'], 'not_eat': ['浓茶'], 'recommand_eat': ['猪肝'], 'prevent': '均衡饮食'},
+        {'_id': 'b2', 'name': '低血糖', 'desc': '', 'check': [], 'cost_money': '约 100 元'},  # 没有 symptom 字段
+        {'_id': 'c3', 'name': 'Ménière 病', 'desc': '内耳疾病', 'symptom': ['眩晕', '耳鸣', '眩晕']},
+    ]
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data = os.path.join(tmp, 'medical.json')
+            with open(data, 'w', encoding='utf-8') as f:
+                for record in self.RECORDS:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            expected = KnowledgeGraph(data, use_snapshot=False)
+            expected.build_snapshot()
+
+            kg = KnowledgeGraph(data)
+            self.assertIsNotNone(kg.snapshot)
+            self.assertEqual(list(kg.info), list(expected.info))
+            for name, disease in expected.info.items():
+                self.assertEqual(kg.info[name].to_dict(), disease.to_dict())
+                self.assertEqual(asdict(kg.info[name]), asdict(disease))
+            self.assertEqual(kg.info['低血糖'].symptom, [])
+            self.assertEqual(kg.info['贫血']._id, 'a1')
+            self.assertNotIn('不存在', kg.info)
+
+    def test_shared_instance_reloads_on_change(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data = os.path.join(tmp, 'medical.json')
+            with open(data, 'w', encoding='utf-8') as f:
+                for record in self.RECORDS:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            os.utime(data, (1000, 1000))
+            self.addCleanup(knowledge_graph_module._kg_registry.pop, data, None)
+            self.addCleanup(knowledge_graph_module._kg_mtime.pop, data, None)
+
+            kg = get_knowledge_graph(data)
+            self.assertIsNone(kg.snapshot)
+            self.assertIs(get_knowledge_graph(data), kg)  # 文件未变化时复用
+
+            os.utime(data, (2000, 2000))  # 数据文件更新
+            touched = get_knowledge_graph(data)
+            self.assertIsNot(touched, kg)
+            self.assertIs(get_knowledge_graph(data), touched)
+
+            snapshot = touched.build_snapshot()
+            os.utime(snapshot, (3000, 3000))  # 快照更新
+            snapshotted = get_knowledge_graph(data)
+            self.assertIsNot(snapshotted, touched)
+            self.assertIsNotNone(snapshotted.snapshot)
+            self.assertIs(get_knowledge_graph(data), snapshotted)
+            self.assertEqual(list(snapshotted.info), list(kg.info))
+
+
+class FuzzyNameIndexTests(SimpleTestCase):
+    THRESHOLDS = (50, 75, 90, 100)
+
+    def setUp(self):
+        rng = random.Random(0)
+        chars = '头痛眩晕贫血性心脏病肺炎胃溃疡综合征急慢'
+        names = {''.join(rng.choice(chars) for _ in range(rng.randint(2, 8))) for _ in range(200)}
+        names |= {'Type 2 Diabetes', 'diabetes insipidus', 'Ménière 病', 'A', 'COVID-19 肺炎'}
+        self.names = sorted(names)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        data = os.path.join(tmp.name, 'medical.json')
+        with open(data, 'w', encoding='utf-8') as f:
+            for i, name in enumerate(self.names):
+                f.write(json.dumps({'_id': str(i), 'name': name}, ensure_ascii=False) + '\n')
+        self.kg = KnowledgeGraph(data, use_snapshot=False)
+
+        self.queries = ['', '   ', '!!', 'a', 'DIABETES type 2', 'covid', '肺炎', '偏头痛性眩晕']
+        self.queries += [name for name in rng.sample(self.names, 10)]
+        self.queries += [name[1:] + rng.choice(chars) for name in rng.sample(self.names, 10)]
+
+    def test_index_search_matches_linear_scan(self):
+        for threshold in self.THRESHOLDS:
+            batch = self.kg.search_many(self.queries, threshold)
+            self.assertTrue(any(batch.values()), threshold)
+            for query in self.queries:
+                expected = self.kg._fuzzy_search_scan(query, threshold)
+                self.assertEqual(self.kg._fuzzy_search(query, threshold), expected, (query, threshold))
+                self.assertEqual(batch[query], expected, (query, threshold))
+
+    def test_candidates_prune_names(self):
+        rows = self.kg.name_index.candidates(['偏头痛性眩晕'], 90)[0]
+        self.assertLess(len(rows), len(self.names))
+        self.assertEqual(self.kg.name_index.candidates([''], 90), [None])  # 空查询不剪枝
+
+
+class SmallKnowledgeBaseMixin:
+    """四种疾病的小型知识库：关联矩阵、先验概率与知识图谱"""
+    RELATION = {
+        '贫血': ['乏力', '面色苍白', '心悸', '头晕'],
+        '低血糖': ['乏力', '出汗', '头晕', '饥饿感'],
+        '中暑': ['头晕', '出汗', '发热', '恶心'],
+        '偏头痛': ['头痛', '恶心', '畏光'],
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.incidence = IncidenceMatrix(self.RELATION)
+        self.symptoms = sorted({s for symptoms in self.RELATION.values() for s in symptoms})
+        self.ec = EntropyCalculator(self.incidence, PriorTables(
+            self.incidence, [(d, 0.25) for d in self.RELATION], [(s, 0.2) for s in self.symptoms]))
+
+    def graded_calculator(self) -> EntropyCalculator:
+        """先验各不相同的熵计算工具，先验或归一化用错时结果才会不同"""
+        return EntropyCalculator(self.incidence, PriorTables(
+            self.incidence, [(d, 0.1 * (i + 1)) for i, d in enumerate(self.RELATION)],
+            [(s, 0.05 * (i % 5 + 1)) for i, s in enumerate(self.symptoms)]))
+
+    def knowledge_graph(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        data = os.path.join(tmp.name, 'medical.json')
+        with open(data, 'w', encoding='utf-8') as f:
+            for i, (name, symptoms) in enumerate(self.RELATION.items()):
+                f.write(json.dumps({'_id': str(i), 'name': name, 'symptom': symptoms}, ensure_ascii=False) + '\n')
+        return KnowledgeGraph(data, use_snapshot=False)
+
+
+class IncidenceMatrixTests(SmallKnowledgeBaseMixin, SimpleTestCase):
+    CANDIDATES = ['中暑', '未知病', '贫血', '低血糖']
+
+    @staticmethod
+    def reference_sd_matrix(sd_relation, symptoms):
+        """原 EntropyCalculator._sd_matrix 的逐元素构建（按给定症状顺序排列列）"""
+        symptom_to_idx = {s: idx for idx, s in enumerate(symptoms)}
+        sd_matrix = np.zeros((len(sd_relation), len(symptoms)), dtype=int)
+        for i, (disease, disease_symptoms) in enumerate(sd_relation.items()):
+            for s in disease_symptoms:
+                if s in symptom_to_idx:
+                    sd_matrix[i, symptom_to_idx[s]] = 1
+        return sd_matrix
+
+    def test_matches_knowledge_graph(self):
+        kg = self.knowledge_graph()
+        known = [d for d in self.CANDIDATES if d in self.RELATION]
+        expected = kg.symptom_disease_relation(known)
+        self.assertEqual(self.incidence.sd_relation(self.CANDIDATES), expected)  # 未知疾病被跳过
+        self.assertEqual(IncidenceMatrix.from_knowledge_graph(kg).sd_relation(known), expected)
+
+        d_idx = self.incidence.disease_index(self.CANDIDATES)
+        symptoms = [self.incidence.symptom_names[s] for s in self.incidence.symptoms_of(d_idx)]
+        self.assertEqual(sorted(symptoms), sorted({s for ss in expected.values() for s in ss}))
+        self.assertNotIn('头痛', symptoms)  # 只有偏头痛（不在候选中）才有的症状
+
+        columns = symptoms + ['头痛', '畏光', '不存在的症状']
+        submatrix = self.incidence.submatrix(d_idx, self.incidence.symptom_index(columns))
+        reference = self.reference_sd_matrix(expected, columns)
+        known_rows = [i for i, d in enumerate(self.CANDIDATES) if d in self.RELATION]
+        np.testing.assert_array_equal(submatrix[known_rows], reference)
+        np.testing.assert_array_equal(submatrix[self.CANDIDATES.index('未知病')], 0)
+        np.testing.assert_array_equal(submatrix[:, len(symptoms):], 0)
+
+        # 原实现的列即候选疾病的症状并集，去掉已问症状
+        drop = ['乏力', '出汗']
+        kept = [s for s in symptoms if s not in drop]
+        np.testing.assert_array_equal(
+            self.incidence.submatrix(d_idx[known_rows], self.incidence.symptom_index(kept)),
+            self.reference_sd_matrix(expected, kept))
+
+
+class StubAsyncAI:
+    """异步接口的离线模型：候选疾病固定，问题由候选疾病与症状拼成，症状回答按 answers 给出（默认都为“是”）"""
+
+    def __init__(self, diseases, answers=None):
+        self.diseases = list(diseases)
+        self.answers = answers or {}
+        self.questions = []
+
+    async def agenerate_json_response(self, text, key):
+        return {key: list(self.diseases)}
+
+    async def agenerate_text_response(self, d_name, symptom):
+        self.questions.append((d_name, symptom))
+        return f"{d_name}|{symptom}"
+
+    async def agenerate_bool_response(self, question, text, symptom, key):
+        return {key: self.answers.get(symptom, True)}
+
+
+class PatientChatTests(SmallKnowledgeBaseMixin, TestCase):
+    def _chat(self, ai, max_posts=12):
+        """按聊天页面的流程提交回答，直到跳转到报告页面；返回 (提交次数, 会话)"""
+        service = PIMService(ec=self.ec, kg=self.knowledge_graph())
+        service.ai = ai
+        session_id = DiagnosisSession.objects.create().session_id
+        url = reverse('patient_chat', kwargs={'session_id': session_id})
+        with mock.patch('core.views.patient_api.PIMService', return_value=service), \
+                mock.patch.object(service, 'should_stop_on', return_value=False):  # 只在没有可问的症状时结束
+            for posts in range(1, max_posts + 1):
+                response = self.client.post(url, {'patient_input': '头晕，出汗' if posts == 1 else '是的'})
+                if response.status_code == 302:
+                    self.assertEqual(response.url, reverse('report_generate', kwargs={'session_id': session_id}))
+                    break
+        return posts, DiagnosisSession.objects.with_turns().get(session_id=session_id)
+
+    def test_pruning_until_no_symptoms_left_ends_the_consultation(self):
+        for speculative in (False, True):
+            with self.subTest(speculative=speculative), override_settings(
+                    PIM_SPECULATIVE=speculative, PIM_PRUNE_MASS=0.9, PIM_PRUNE_MIN_DISEASES=1):
+                posts, session = self._chat(StubAsyncAI(self.RELATION))
+                self.assertLess(posts, 12)
+                self.assertEqual(len(session.diseases[-1]), 1)  # 剪枝至只剩一种疾病
+                self.assertEqual(len(session.ai_response), posts - 1)  # 最后一轮没有提问
+                # 每个问题都针对提问时该轮保留的候选疾病
+                for diseases, ieg, question in zip(session.diseases, session.IEG, session.ai_response):
+                    self.assertEqual(question, f"{'、'.join(diseases)}|{max(ieg, key=ieg.get)}")
+
+
+class SpeculativeTurnTests(SmallKnowledgeBaseMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = PIMService(ec=self.ec, kg=self.knowledge_graph())
+        state = SessionPosterior.from_priors(self.ec, list(self.RELATION))
+        ieg = state.ieg()
+        self.symptom = max(ieg, key=ieg.get)
+        self.session = DiagnosisSession.objects.create()
+        self.session.apply_turn(patient_response='头晕，出汗', disease=state.disease_prob(), ieg=ieg,
+                                ai_response=f"{'、'.join(state.disease_prob())}|{self.symptom}")
+
+    def _turn(self, speculative: bool, answer: bool):
+        """按聊天页面的流程提交一次回答，返回保存的会话"""
+        session = DiagnosisSession.objects.create()
+        session.apply_turn(patient_response=self.session.patient_response[0], disease=self.session.diseases[0],
+                           ieg=self.session.IEG[0], ai_response=self.session.ai_response[0])
+        self.service.ai = StubAsyncAI(self.RELATION, answers={self.symptom: answer})
+        with override_settings(PIM_SPECULATIVE=speculative), \
+                mock.patch('core.views.patient_api.PIMService', return_value=self.service), \
+                mock.patch.object(self.service, 'should_stop_on', return_value=False):
+            self.client.post(reverse('patient_chat', kwargs={'session_id': session.session_id}),
+                             {'patient_input': '是的' if answer else '没有'})
+        return DiagnosisSession.objects.with_turns().get(pk=session.pk)
+
+    def test_speculative_turn_matches_sequential_turn(self):
+        for answer in (True, False):
+            with self.subTest(answer=answer):
+                sequential, speculative = self._turn(False, answer), self._turn(True, answer)
+                self.assertEqual(len(speculative.diseases), 2)
+                self.assertEqual(speculative.diseases, sequential.diseases)
+                self.assertEqual(speculative.IEG, sequential.IEG)
+                self.assertEqual(speculative.ai_response, sequential.ai_response)
+                self.assertEqual(speculative.ans_to_symptom, sequential.ans_to_symptom)
+
+    @override_settings(PIM_PRUNE_MASS=0.5, PIM_PRUNE_MIN_DISEASES=1)
+    async def test_losing_branch_question_is_cancelled(self):
+        # 剪枝后“是/否”两个分支保留的疾病不同，问题按各自的候选疾病生成
+        symptom = '头痛'
+        branches = await sync_to_async(self.service._speculate)(self.session, symptom)
+        keys = {response: ("、".join(diseases), max(ieg, key=ieg.get))
+                for response, (_, ieg, diseases, _) in branches.items()}
+        self.assertEqual(keys[True][0], '偏头痛')
+        self.assertNotEqual(keys[True][0], keys[False][0])
+
+        tasks = {}
+        ai = StubAsyncAI(self.RELATION, answers={symptom: True})
+        generate = ai.agenerate_text_response
+
+        async def agenerate_text_response(d_name, symptom):
+            tasks[(d_name, symptom)] = asyncio.current_task()
+            if (d_name, symptom) != keys[True]:
+                await asyncio.sleep(60)  # 未采用的分支一直等待，应被取消
+            return await generate(d_name, symptom)
+
+        ai.agenerate_text_response = agenerate_text_response
+        self.service.ai = ai
+        session = await DiagnosisSession.objects.with_turns().aget(pk=self.session.pk)
+        response, data, question = await self.service.anext_round_speculative(
+            session, '是的', symptom, session.ai_response[-1])
+
+        await asyncio.sleep(0)
+        self.assertEqual(response, {symptom: True})
+        self.assertEqual(list(data['diseases']), ['偏头痛'])
+        self.assertEqual(question, "|".join(keys[True]))
+        self.assertEqual(set(tasks), set(keys.values()))
+        self.assertTrue(tasks[keys[False]].cancelled())
+
+
+class ConsultationSimulatorTests(SmallKnowledgeBaseMixin, TestCase):
+    def test_simulated_sessions(self):
+        simulator = ConsultationSimulator(ec=self.ec, kg=self.knowledge_graph(), related=2, noise=1, seed=1)
+        results = simulator.run(5)
+        report = summarize(results)
+
+        self.assertEqual(report['sessions'], 5)
+        self.assertTrue(all(1 < r.turns <= 10 for r in results))
+        # 每轮：读取会话一行 + 各轮记录（2 次 SELECT），写入会话 UPDATE + 新一轮 INSERT，
+        # 外加 apply_turn 的事务在测试事务内产生的 SAVEPOINT / RELEASE
+        self.assertEqual(report['queries_per_turn'], {'mean': 6.0, 'max': 6})
+        self.assertLessEqual(report['llm_calls_per_session'], np.mean([2 * r.turns for r in results]))  # 每轮至多两次
+        self.assertEqual(report['top_k_accuracy'][5], 1.0)  # 候选不超过 4 种且包含真实疾病
+
+    @override_settings(PIM_LOCAL_CANDIDATES=5)
+    def test_recall_not_masked_by_local_candidates(self):
+        kg = self.knowledge_graph()
+        missed = ConsultationSimulator(ec=self.ec, kg=kg, related=2, noise=0, recall=0.0, seed=1).run(5)
+        self.assertTrue(all(r.rank() is None for r in missed))  # 不受 settings.PIM_LOCAL_CANDIDATES 影响
+
+        local = ConsultationSimulator(ec=self.ec, kg=kg, related=2, noise=0, recall=0.0, local_candidates=5, seed=1)
+        self.assertTrue(all(r.rank() is not None for r in local.run(5)))  # 显式开启时描述中的症状补回真实疾病
+
+
+class IEGEquivalenceTests(SmallKnowledgeBaseMixin, SimpleTestCase):
+    """矩阵形式的 IEG 与原先逐个症状计算的结果一致"""
+
+    def reference_ieg(self, diseases, p_l, dropped=()):
+        """逐列计算（原 calculate_one_ieg 的循环）"""
+        eps = self.ec.epsilon
+        symptoms = [s for s in self.symptoms if s not in dropped and any(s in self.RELATION[d] for d in diseases)]
+        p_l = np.array([p_l[d] for d in diseases], dtype=float)
+        p_l = p_l / p_l.sum()
+        rho = self.ec.priors.symptom_prob_dict(symptoms)
+        total_rho = sum(rho.values())
+        matrix = np.array([[float(s in self.RELATION[d]) for s in symptoms] for d in diseases])
+        matrix = matrix / matrix.sum(axis=1, keepdims=True)
+        H_0 = -np.sum(p_l * np.log(p_l + eps))
+
+        ieg = {}
+        for col, s in enumerate(symptoms):
+            rho_k = np.clip(rho[s] / total_rho, 0.01, 0.99)
+            p_k_l = matrix[:, col]
+            log_p = np.log(p_k_l + eps) + np.log(p_l + eps) - np.log(rho_k)
+            log_pn = np.log(1.0 - p_k_l + eps) + np.log(p_l + eps) - np.log(1.0 - rho_k)
+            p = np.exp(log_p - log_p.max())
+            pn = np.exp(log_pn - log_pn.max())
+            p, pn = p / p.sum(), pn / pn.sum()
+            H_cond = rho_k * -np.sum(p * np.log(p + eps)) + (1.0 - rho_k) * -np.sum(pn * np.log(pn + eps))
+            ieg[s] = abs((H_0 - H_cond) / max(H_0, eps))
+        return ieg
+
+    def assertIEGAlmostEqual(self, got, expected):
+        self.assertEqual(sorted(got), sorted(expected))
+        for s in expected:
+            self.assertAlmostEqual(got[s], expected[s], places=12, msg=s)
+
+    def setUp(self):
+        super().setUp()
+        self.ec = self.graded_calculator()
+
+    def test_matches_per_symptom_loop(self):
+        for diseases in (list(self.RELATION), ['贫血', '偏头痛'], ['中暑']):
+            sd_relation = self.ec.incidence.sd_relation(diseases)
+            priors = self.ec.priors.disease_prob_dict(diseases)
+            self.assertIEGAlmostEqual(self.ec.calculate_ieg(sd_relation), self.reference_ieg(diseases, priors))
+
+    def test_matches_per_symptom_loop_during_session(self):
+        diseases = ['贫血', '低血糖', '中暑']
+        session = SimpleNamespace(diseases=[{'贫血': 0.5, '低血糖': 0.3, '中暑': 0.2}],
+                                  ans_to_symptom={'头晕': True, '出汗': False})
+        got = self.ec.calculate_ieg(self.ec.incidence.sd_relation(diseases), session=session)
+        self.assertIEGAlmostEqual(got, self.reference_ieg(diseases, session.diseases[-1], dropped=session.ans_to_symptom))
+
+    def test_stacked_sessions_match_single_session(self):
+        rng = np.random.default_rng(0)
+        p_k_l = rng.random((2, 4, 5))
+        p_l = rng.dirichlet(np.ones(4), size=2)
+        rho = rng.random((2, 5))
+        eps = self.ec.epsilon
+        logs = (np.log(p_l + eps), np.log(p_k_l + eps), np.log(1.0 - p_k_l + eps))
+        stacked = self.ec.cond_entropy_from_logs(rho, *logs)
+        for i in range(2):
+            for col in range(5):
+                self.assertAlmostEqual(stacked[i, col],
+                                       self.ec.calculate_one_ieg(rho[i, col], p_l[i], p_k_l[i, :, col]), places=12)
+
+
+class SessionBatchTests(SmallKnowledgeBaseMixin, TestCase):
+    CANDIDATES = [['贫血', '低血糖', '中暑'], ['偏头痛'], ['中暑', '偏头痛', '贫血', '低血糖'], []]
+    ANSWERS = [[('头晕', True), ('乏力', False)], [('恶心', True)], [('出汗', True), ('不存在', True), ('心悸', False)], []]
+
+    def setUp(self):
+        super().setUp()
+        self.ec = self.graded_calculator()  # 批量计算中逐行的先验与归一化出错时才能与逐会话结果区分开
+
+    def assertIEGEqual(self, batch, i, ieg, expected):
+        got = {s: ieg[i, c] for s, c in batch.symptom_col[i].items() if not np.isnan(ieg[i, c])}
+        self.assertEqual(list(got), list(expected))
+        np.testing.assert_allclose(list(got.values()), list(expected.values()), rtol=1e-9, atol=1e-12)
+
+    def test_matches_per_session_posterior(self):
+        batch = SessionBatch.from_priors(self.ec, self.CANDIDATES)
+        states = [SessionPosterior.from_priors(self.ec, names) for names in self.CANDIDATES]
+        for i, state in enumerate(states):
+            self.assertIEGEqual(batch, i, batch.ieg(), state.ieg())
+
+        iegs = batch.replay(self.ANSWERS)
+        for i, (state, answers) in enumerate(zip(states, self.ANSWERS)):
+            for t, (symptom, response) in enumerate(answers):
+                self.assertIEGEqual(batch, i, iegs[t], state.answer(symptom, response)[0])
+            expected = state.disease_prob()
+            np.testing.assert_allclose([batch.disease_prob()[i][d] for d in expected], list(expected.values()))
+            self.assertIEGEqual(batch, i, batch.ieg(), state.ieg())
+
+    def test_batch_diagnose_command(self):
+        state = SessionPosterior.from_priors(self.ec, self.CANDIDATES[0])
+        session = DiagnosisSession.objects.create()
+        session.apply_turn(patient_response='头晕', disease=state.disease_prob(), ieg=state.ieg(), ai_response='?')
+        DiagnosisSession.objects.create()  # 没有记录的会话被跳过
+
+        out = StringIO()
+        with mock.patch('core.management.commands.batch_diagnose.EntropyCalculator', return_value=self.ec):
+            call_command('batch_diagnose', '--top-k', '2', stdout=out, stderr=StringIO())
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 1)
+        expected = sorted(state.disease_prob().items(), key=lambda item: -item[1])[:2]
+        self.assertEqual([d for d, _ in rows[0]['top_diseases']], [d for d, _ in expected])
+        ieg = state.ieg()
+        self.assertEqual(rows[0]['next_symptoms'][0][0], max(ieg, key=ieg.get))
+
+
+class SessionPosteriorTests(SmallKnowledgeBaseMixin, TestCase):
+    ANSWERS = [('头晕', True), ('乏力', False), ('出汗', True), ('恶心', False)]
+
+    def setUp(self):
+        super().setUp()
+        self.ec = self.graded_calculator()
+        self.service = PIMService(ec=self.ec)
+        self.cache = PosteriorCache()
+        patcher = mock.patch('core.services.pim_service.posterior_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        state = SessionPosterior.from_priors(self.ec, list(self.RELATION))
+        self.session = DiagnosisSession.objects.create()
+        self.session.apply_turn(patient_response='头晕', disease=state.disease_prob(), ieg=state.ieg(), ai_response='?')
+
+    def rebuild(self, ec, session, symptom, response):
+        """按原先的方式从会话记录整体重算：(本轮 IEG, 更新后的疾病概率)"""
+        view = SimpleNamespace(diseases=session.diseases, ans_to_symptom={**session.ans_to_symptom, symptom: response})
+        ieg = ec.calculate_ieg(ec.incidence.sd_relation(list(session.diseases[-1])), session=view)
+        return ieg, ec.updated_disease_prob(None, response, symptom, session=view)
+
+    def assertDictAlmostEqual(self, got, expected):
+        self.assertEqual(list(got), list(expected))
+        for k in expected:
+            self.assertAlmostEqual(got[k], expected[k], places=12, msg=k)
+
+    def test_incremental_and_cached_states_match_rebuild(self):
+        for turn, (symptom, response) in enumerate(self.ANSWERS):
+            expected_ieg, expected_prob = self.rebuild(self.ec, self.session, symptom, response)
+            fresh = SessionPosterior.from_session(self.ec, self.session, pending_symptom=symptom)
+            self.assertDictAlmostEqual(fresh.answer(symptom, response)[1], expected_prob)
+
+            self.assertEqual(str(self.session.session_id) in self.cache._data, turn > 0)  # 之后各轮取自缓存
+            data = self.service.next_round('嗯', self.session.session_id, response, symptom, session=self.session)
+            self.assertDictAlmostEqual(data['IEG'], expected_ieg)
+            self.assertDictAlmostEqual(data['diseases'], expected_prob)
+            self.session.apply_turn(patient_response='嗯', disease=data['diseases'], ieg=data['IEG'],
+                                    ai_response='?', symptom_answer=(symptom, response))
+
+    def test_stale_cached_state_is_rebuilt(self):
+        symptom, response = self.ANSWERS[0]
+        data = self.service.next_round('嗯', self.session.session_id, response, symptom, session=self.session)
+        self.session.apply_turn(patient_response='嗯', disease=data['diseases'], ieg=data['IEG'],
+                                ai_response='?', symptom_answer=(symptom, response))
+
+        # 先验表重新加载（版本号变化）后，缓存的状态作废，按新的先验从会话记录重建
+        priors = self.ec.priors.with_overrides(symptom_rows=[('乏力', 0.5)])
+        priors.version += 1
+        self.service.ec = ec = EntropyCalculator(self.incidence, priors)
+        symptom, response = self.ANSWERS[1]
+        expected_ieg, expected_prob = self.rebuild(ec, self.session, symptom, response)
+        data = self.service.next_round('嗯', self.session.session_id, response, symptom, session=self.session)
+        self.assertDictAlmostEqual(data['IEG'], expected_ieg)
+        self.assertDictAlmostEqual(data['diseases'], expected_prob)
+
+    def test_cache_rejects_mismatched_state(self):
+        session = SimpleNamespace(session_id='s', diseases=self.session.diseases, ans_to_symptom={})
+        version = self.ec.data_version
+        stale = [
+            (SimpleNamespace(session_id='s', diseases=self.session.diseases * 2, ans_to_symptom={}), None, version),
+            (SimpleNamespace(session_id='s', diseases=self.session.diseases, ans_to_symptom={'头晕': True}), None,
+             version),
+            (session, None, (version[0], version[1] + 1)),
+            (session, None, (version[0] + 1, version[1])),
+        ]
+        for other, pending, data_version in stale:
+            state = SessionPosterior.from_session(self.ec, self.session)
+            self.cache.put('s', state)
+            self.assertIsNone(self.cache.get(other, pending_symptom=pending, data_version=data_version))
+            self.assertIsNone(self.cache.get(session, data_version=version))  # 不一致的状态已被丢弃
+
+        state = SessionPosterior.from_session(self.ec, self.session)
+        self.cache.put('s', state)
+        pending = SimpleNamespace(session_id='s', diseases=self.session.diseases, ans_to_symptom={'头晕': True})
+        self.assertIs(self.cache.get(pending, pending_symptom='头晕', data_version=version), state)
+
+
+class PosteriorPruneTests(SmallKnowledgeBaseMixin, TestCase):
+    def test_prune_drops_low_mass_diseases_and_their_symptoms(self):
+        state = SessionPosterior.from_priors(self.ec, list(self.RELATION))
+        state.answer('头痛', False)
+        pruned = state.prune(0.01, min_diseases=1)
+
+        self.assertEqual(list(pruned), ['偏头痛'])
+        self.assertLessEqual(state.discarded_mass, 0.01)
+        self.assertNotIn('畏光', state.symptom_col)
+        self.assertIn('恶心', state.symptom_col)  # 中暑仍有该症状
+        self.assertAlmostEqual(sum(state.disease_prob().values()), 1.0)
+        self.assertEqual(state.prune(0.01, min_diseases=1), {})  # 预算已用完
+
+        rebuilt = SessionPosterior(self.ec, state.disease_names, state.disease_prob(), answered=['头痛'],
+                                   discarded_mass=state.discarded_mass)
+        self.assertEqual(rebuilt.symptom_names, state.symptom_names)
+        ieg = state.ieg()
+        for symptom, value in rebuilt.ieg().items():
+            self.assertAlmostEqual(value, ieg[symptom], places=9)
+
+    @override_settings(PIM_PRUNE_MASS=0.05, PIM_PRUNE_MIN_DISEASES=1)
+    def test_pruned_mass_is_recorded_per_session(self):
+        simulator = ConsultationSimulator(ec=self.ec, kg=self.knowledge_graph(), related=3, noise=0, seed=3)
+        simulator.run(5)
+        sessions = list(DiagnosisSession.objects.with_turns())
+        self.assertTrue(any(s.pruned for s in sessions))
+        for session in sessions:
+            self.assertLessEqual(session.discarded_mass, 0.05 + 1e-12)
+            self.assertFalse(set(session.pruned) & set(session.diseases[-1]))
+
+
+class SymptomIndexTests(SmallKnowledgeBaseMixin, TestCase):
+    def test_match_and_rank(self):
+        index = self.knowledge_graph().symptom_index
+        self.assertEqual(index.match('最近头晕、出汗，没有发热，有饥饿感'), ['头晕', '出汗', '饥饿感'])
+        self.assertEqual([d for d, _ in index.suggest('头晕出汗，有饥饿感', 2)], ['低血糖', '中暑'])
+        self.assertEqual(index.suggest('没什么不舒服', 3), [])
+
+    def test_local_candidates_merge_with_model(self):
+        service = PIMService(ec=self.ec, kg=self.knowledge_graph())
+        service.ai = mock.Mock()
+        service.ai.generate_json_response.return_value = {'diseases': ['不存在的病', '贫血']}
+
+        data = service.start_new_session('头痛，怕光', str(DiagnosisSession.objects.create().session_id))
+        self.assertEqual(set(data['diseases']), {'贫血', '偏头痛'})  # 模型猜错的疾病由本地候选补上
+        self.assertEqual(service.ai.generate_json_response.call_count, 1)
+
+        with override_settings(PIM_LOCAL_ONLY_MIN_SYMPTOMS=2):
+            data = service.start_new_session('头痛，畏光', str(DiagnosisSession.objects.create().session_id))
+        self.assertEqual(list(data['diseases']), ['偏头痛'])
+        self.assertEqual(service.ai.generate_json_response.call_count, 1)  # 未再调用模型
+
+
+class SessionReplayTests(SmallKnowledgeBaseMixin, TestCase):
+    def _traces(self):
+        simulator = ConsultationSimulator(ec=self.ec, kg=self.knowledge_graph(), related=2, noise=1, seed=2)
+        simulator.run(4)
+        return [ReplayTrace.from_session(s) for s in DiagnosisSession.objects.with_turns()]
+
+    def test_replay_with_same_parameters_reproduces_sessions(self):
+        results = replay_traces(self.ec, PIMService(ec=self.ec), self._traces())
+        report = summarize_replay(results)
+        self.assertEqual(report['sessions'], 4)
+        self.assertLess(report['drift']['max'], 1e-9)
+        self.assertEqual((report['top1_changed'], report['stop_turn']['same']), (0, 4))
+
+    @override_settings(PIM_PRUNE_MASS=0.2, PIM_PRUNE_MIN_DISEASES=1)
+    def test_replay_applies_the_recorded_prune_policy(self):
+        traces = self._traces()
+        pim = PIMService(ec=self.ec)
+        self.assertTrue(any(s.pruned for s in DiagnosisSession.objects.with_turns()))
+
+        report = summarize_replay(replay_traces(self.ec, pim, traces, prune_mass=0.2, min_diseases=1))
+        self.assertLess(report['drift']['max'], 1e-9)
+        self.assertEqual((report['top1_changed'], report['stop_turn']['same']), (0, len(traces)))
+
+        unpruned = summarize_replay(replay_traces(self.ec, pim, traces))
+        self.assertGreater(unpruned['drift']['max'], 0.0)
+
+    def test_replay_over_shared_memory(self):
+        traces = self._traces()
+        priors = self.ec.priors.with_overrides(disease_rows=[('贫血', 0.9)])
+        shared, meta = share_knowledge(self.ec.incidence, priors)
+        try:
+            attached, incidence, attached_priors = attach_knowledge(meta)
+            np.testing.assert_array_equal(attached_priors.disease, priors.disease)
+            self.assertEqual(incidence.sd_relation(['贫血']), {'贫血': self.RELATION['贫血']})
+
+            ec = EntropyCalculator(incidence, attached_priors)
+            results = replay_traces(ec, PIMService(ec=ec), traces)
+            expected = replay_traces(EntropyCalculator(self.ec.incidence, priors), PIMService(ec=self.ec), traces)
+            self.assertEqual(results, expected)
+            self.assertGreater(summarize_replay(results)['drift']['max'], 0.0)
+            attached.close()
+        finally:
+            shared.close()
+
+
+class LoadKBCommandTests(TransactionTestCase):
+    """load_kb 会为未托管的知识表建表，SQLite 不能在事务中修改表结构，因此不使用 TestCase"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.disease_csv = self._write('disease.csv', '贫血,0.3\n低血糖,0.2\n')
+        self.symptom_csv = self._write('symptom.csv', '乏力,0.4\n心悸,0.1\n')
+        self.data = self._write('medical.json', '\n'.join(json.dumps(
+            {'_id': str(i), 'name': name, 'symptom': symptoms}, ensure_ascii=False)
+            for i, (name, symptoms) in enumerate([('贫血', ['乏力', '心悸']), ('低血糖', ['乏力'])])))
+
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            for model in (DiseaseProb, SymptomProb, RelationDiseaseSymptom):
+                if model._meta.db_table in connection.introspection.table_names():
+                    editor.delete_model(model)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def _load(self, *args):
+        out = StringIO()
+        call_command('load_kb', '--disease-prob', self.disease_csv, '--symptom-prob', self.symptom_csv,
+                     '--data', self.data, '--create-tables', *args, stdout=out)
+        return out.getvalue()
+
+    def test_load_is_idempotent(self):
+        self._load()
+        self.assertIn('新增 0，更新 0，未变 2', self._load())
+        self.assertEqual(DiseaseProb.get_prob(['贫血', '低血糖']), {'贫血': 0.3, '低血糖': 0.2})
+        self.assertEqual(RelationDiseaseSymptom.sd_relation(['贫血']), {'贫血': ['乏力', '心悸']})
+
+        self._write('disease.csv', '贫血,0.25\n')
+        self._load('--only', 'disease_prob', '--replace')
+        self.assertEqual(DiseaseProb.get_prob(['贫血', '低血糖']), {'贫血': 0.25, '低血糖': None})
+        self.assertEqual(SymptomProb.objects.count(), 2)
+
+    def _fresh_shared_tables(self):
+        """清空进程内共享的关联矩阵、先验概率表与版本号缓存（测试结束后恢复）"""
+        for target, name in ((incidence_module, '_incidence'), (prior_tables_module, '_priors'),
+                             (kb_version_module, '_checked_at')):
+            patcher = mock.patch.object(target, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(KB_VERSION_CHECK_INTERVAL=60)
+    def test_other_processes_reload_after_load_kb(self):
+        self._load()
+        self._fresh_shared_tables()
+        clock = mock.Mock(return_value=1000.0)
+        with mock.patch.object(kb_version_module.time, 'monotonic', clock):
+            priors, incidence = get_prior_tables(), get_incidence_matrix()
+            self.assertEqual(priors.disease_prob_dict(['贫血']), {'贫血': 0.3})
+
+            # 另一个进程执行 load_kb（批量写入，不发送信号）：本进程只能从数据库中的版本号得知
+            self._write('disease.csv', '贫血,0.25\n低血糖,0.2\n')
+            self._write('medical.json', json.dumps({'_id': '0', 'name': '贫血', 'symptom': ['乏力']}, ensure_ascii=False))
+            with mock.patch.object(kb_version_module, 'expire_kb_versions'):
+                self._load('--replace')
+            self.assertIs(get_prior_tables(), priors)  # 检查间隔内不再查询版本号
+
+            clock.return_value += 60
+            self.assertEqual(get_prior_tables().disease_prob_dict(['贫血']), {'贫血': 0.25})
+            self.assertEqual(get_incidence_matrix().sd_relation(['贫血', '低血糖']), {'贫血': ['乏力']})
+            self.assertIsNot(get_incidence_matrix(), incidence)
+
+    @override_settings(KB_VERSION_CHECK_INTERVAL=60)
+    def test_orm_changes_invalidate_shared_tables(self):
+        self._load()
+        self._fresh_shared_tables()
+        priors, incidence = get_prior_tables(), get_incidence_matrix()
+
+        row = DiseaseProb.objects.get(disease_name='贫血')
+        row.probability = Decimal('0.35')
+        row.save()
+        self.assertEqual(get_prior_tables().disease_prob_dict(['贫血']), {'贫血': 0.35})
+        SymptomProb.objects.filter(symptom_name='心悸').get().delete()
+        self.assertEqual(get_prior_tables().symptom_prob_dict(['心悸', '乏力']), {'心悸': None, '乏力': 0.4})
+        self.assertIs(get_incidence_matrix(), incidence)
+
+        RelationDiseaseSymptom.objects.create(disease_name='中暑', symptom_list=['出汗'])
+        self.assertEqual(get_incidence_matrix().sd_relation(['中暑']), {'中暑': ['出汗']})
+        self.assertIsNot(get_prior_tables(), priors)
+        self.assertEqual(KnowledgeBaseVersion.current(), {'priors': 3, 'relation': 2})  # 首次加载各递增一次
+
+    @skipUnless(connection.vendor == 'sqlite', "按 SQLite 的 EXPLAIN QUERY PLAN 输出判断")
+    def test_name_lookups_use_unique_index(self):
+        self._load()
+        lookups = [
+            RelationDiseaseSymptom.objects.filter(disease_name__in=['贫血']),
+            DiseaseProb.objects.filter(disease_name__in=['贫血', '低血糖']),
+            SymptomProb.objects.filter(symptom_name__in=['乏力']),
+        ]
+        for qs in lookups:
+            plan = qs.explain()
+            self.assertIn('USING INDEX', plan)
+            self.assertNotRegex(plan, r'\bSCAN\b')
@@ -1,3 +1,9 @@
-from .knowledge_graph import KnowledgeGraph
+from .knowledge_graph import KnowledgeGraph, get_knowledge_graph, reload_knowledge_graph
+from .incidence import IncidenceMatrix, get_incidence_matrix, invalidate_incidence_matrix, reload_incidence_matrix
+from .prior_tables import PriorTables, get_prior_tables, invalidate_prior_tables
 from .entropy_calculator import EntropyCalculator
+from .posterior import SessionPosterior, PosteriorCache, posterior_cache
+from .batch_posterior import SessionBatch
+from .question_prefetch import QuestionPrefetcher, question_prefetcher
+from .llm_cache import LLMCache, MemoryCache, SQLiteCache, get_llm_cache
 from .ai_integration import AIGenerator
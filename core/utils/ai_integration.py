@@ -1,27 +1,213 @@
 import os
 import json
-from typing import Tuple
-from openai import OpenAI
+import asyncio
+import threading
+from typing import AsyncGenerator, AsyncIterator, Tuple, Dict, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 
 # from local_settings import settings # 测试用
 from django.conf import settings  # django 设置
 
+from .llm_cache import LLMCache, get_llm_cache
 
-class AIGenerator:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=settings.API_KEY,  # 从配置读取
-            base_url=settings.BASE_URL
+# ====================== 进程级共享的客户端与提示词 ======================
+_client: Optional[OpenAI] = None
+_client_key: Optional[tuple] = None
+# 事件循环 -> (配置, 客户端, 随事件循环关闭客户端的生成器)；客户端的连接池引用事件循环，需在循环结束时显式移除
+_async_clients: Dict[asyncio.AbstractEventLoop, Tuple[tuple, AsyncOpenAI, AsyncGenerator]] = {}
+_prompt: Optional[Dict] = None
+_lock = threading.Lock()
+
+
+def _client_config() -> tuple:
+    """影响客户端创建的配置项，任一项变化都会重建客户端"""
+    return (
+        settings.API_KEY, settings.BASE_URL,
+        settings.AI_POOL_SIZE, settings.AI_TIMEOUT, settings.AI_CONNECT_TIMEOUT, settings.AI_MAX_RETRIES
+    )
+
+
+def get_openai_client() -> OpenAI:
+    """
+    获取进程内共享的 OpenAI 客户端
+    客户端本身是线程安全的，底层 httpx 连接池保持长连接，避免每次调用重新建立 TCP/TLS 连接
+    """
+    global _client, _client_key
+    key = _client_config()
+    if _client is not None and _client_key == key:
+        return _client
+
+    with _lock:
+        if _client is None or _client_key != key:
+            api_key, base_url, pool_size, timeout, connect_timeout, max_retries = key
+            http_client = DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+            _client = OpenAI(
+                api_key=api_key,  # 从配置读取
+                base_url=base_url,
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                max_retries=max_retries,
+                http_client=http_client,
+            )
+            _client_key = key
+        return _client
+
+
+async def _close_with_loop(loop: asyncio.AbstractEventLoop, client: AsyncOpenAI):
+    """
+    在事件循环结束时关闭客户端：asyncio.run（包括 WSGI 下 asgiref 为每个异步视图新建的事件循环）
+    关闭循环前会调用 loop.shutdown_asyncgens()，关闭此生成器并执行 finally
+    """
+    try:
+        yield
+    finally:
+        with _lock:
+            entry = _async_clients.get(loop)
+            if entry is not None and entry[1] is client:
+                del _async_clients[loop]
+        await client.close()
+
+
+def _start(agen: AsyncGenerator):
+    """同步推进到第一个 yield（此前没有 await），生成器由此登记到当前事件循环"""
+    try:
+        agen.asend(None).send(None)
+    except StopIteration:
+        pass
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    获取当前事件循环共享的异步 OpenAI 客户端
+    异步连接池与事件循环绑定，因此每个事件循环各持有一个客户端，事件循环结束时关闭并移除
+    """
+    loop = asyncio.get_running_loop()
+    key = _client_config()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0] != key:
+        api_key, base_url, pool_size, timeout, connect_timeout, max_retries = key
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            max_retries=max_retries,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            ),
         )
-        file_path = os.path.join(settings.BASE_DIR, 'prompt.json')
-        with open(file_path, 'r') as f:
-            self.prompt = json.load(f)
+        guard = _close_with_loop(loop, client)
+        _start(guard)
+        with _lock:
+            # 未经 shutdown_asyncgens 就关闭的事件循环（如直接调用 loop.close()），其客户端在此丢弃
+            for closed in [other for other in _async_clients if other.is_closed()]:
+                del _async_clients[closed]
+            # 配置变化时替换的旧生成器被回收后，事件循环会调用 aclose() 关闭旧客户端
+            entry = _async_clients[loop] = (key, client, guard)
+    return entry[1]
+
+
+def get_prompts() -> Dict:
+    """获取缓存的提示词（prompt.json 只读取一次）"""
+    global _prompt
+    if _prompt is None:
+        with _lock:
+            if _prompt is None:
+                file_path = os.path.join(settings.BASE_DIR, 'prompt.json')
+                with open(file_path, 'r') as f:
+                    _prompt = json.load(f)
+    return _prompt
+
+
+def reload_prompts() -> Dict:
+    """prompt.json 修改后重新读取"""
+    global _prompt
+    with _lock:
+        _prompt = None
+    return get_prompts()
+
+
+class AIGenerator:
+    """
+    大模型调用封装
+    每类请求先由 _xxx_request 构造请求参数，同步方法 generate_xxx 与异步方法 agenerate_xxx 共用同一份参数
+    """
+
+    def __init__(self, cache: Optional[LLMCache] = None, use_cache: bool = True, refresh: bool = False):
+        """
+        :param cache: 响应缓存，默认使用进程内共享的缓存（settings.LLM_CACHE_*）
+        :param use_cache: 为 False 时不使用缓存
+        :param refresh: 为 True 时不读取缓存、总是请求模型，新结果写回缓存（用于“重新生成”）
+        """
+        self.client = get_openai_client()
+        self.prompt = get_prompts()
+        self.cache = (cache if cache is not None else get_llm_cache()) if use_cache else None
+        self.refresh = refresh
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """异步客户端（需在事件循环中访问）"""
+        if self._async_client is None:
+            self._async_client = get_async_openai_client()
+        return self._async_client
+
+    def _cache_key(self, request: dict) -> Optional[str]:
+        return self.cache.key(request) if self.cache is not None else None
+
+    def _chat(self, request: dict) -> str:
+        """同步调用，返回回复文本（相同请求优先取缓存）"""
+        key = self._cache_key(request)
+        if key is not None and not self.refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = self.client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        if key is not None and content is not None:
+            self.cache.set(key, content)
+        return content
+
+    async def _achat(self, request: dict) -> str:
+        """异步调用，返回回复文本（相同请求优先取缓存）"""
+        key = self._cache_key(request)
+        if key is not None and not self.refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = await self.async_client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        if key is not None and content is not None:
+            self.cache.set(key, content)
+        return content
+
+    async def _astream(self, request: dict) -> AsyncIterator[str]:
+        """流式调用，逐段返回回复文本；完整回复写入缓存，缓存命中时一次返回全部文本"""
+        key = self._cache_key(request)
+        if key is not None and not self.refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        stream = await self.async_client.chat.completions.create(**request, stream=True)
+        parts = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        if key is not None:
+            self.cache.set(key, ''.join(parts))
 
     # =============== PIM 生成问题、获取是否、返回 json 格式化 ===============
-    def generate_json_response(self, text: str, key: str) -> dict:
-        """生成结构化 JSON 响应（用于疾病列表提取）"""
+    def _json_request(self, text: str, key: str) -> dict:
         prompt_pim = self.prompt['pim']
-        response = self.client.chat.completions.create(
+        return dict(
             model=settings.MODEL,
             messages=[
                 {"role": "system", "content": prompt_pim['system'] + f"要求：输出JSON，键值为 {key}"},
@@ -29,24 +215,34 @@ class AIGenerator:
             ],
             response_format={"type": "json_object"}
         )
-        return json.loads(response.choices[0].message.content)
 
-    def generate_text_response(self, d_name: str, symptom: str) -> str:
-        """生成自然语言文本（用于问题生成）"""
+    def generate_json_response(self, text: str, key: str) -> dict:
+        """生成结构化 JSON 响应（用于疾病列表提取）"""
+        return json.loads(self._chat(self._json_request(text, key)))
+
+    async def agenerate_json_response(self, text: str, key: str) -> dict:
+        return json.loads(await self._achat(self._json_request(text, key)))
+
+    def _text_request(self, d_name: str, symptom: str) -> dict:
         prompt_pim = self.prompt['pim']
-        response = self.client.chat.completions.create(
+        return dict(
             model=settings.MODEL,
             messages=[
                 {"role": "system", "content": prompt_pim['system']},
                 {"role": "user", "content": prompt_pim['generate_question'].format(d_name=d_name, symptom=symptom)}
             ],
         )
-        return response.choices[0].message.content
 
-    def generate_bool_response(self, question: str, text: str, symptom: str, key: str) -> dict:
-        """分析是否，返回 {'S': 'True'}"""
+    def generate_text_response(self, d_name: str, symptom: str) -> str:
+        """生成自然语言文本（用于问题生成）"""
+        return self._chat(self._text_request(d_name, symptom))
+
+    async def agenerate_text_response(self, d_name: str, symptom: str) -> str:
+        return await self._achat(self._text_request(d_name, symptom))
+
+    def _bool_request(self, question: str, text: str, symptom: str, key: str) -> dict:
         prompt_pim = self.prompt['pim']
-        response = self.client.chat.completions.create(
+        return dict(
             model=settings.MODEL,
             messages=[
                 {"role": "system",
@@ -56,11 +252,16 @@ class AIGenerator:
             ],
             response_format={"type": "json_object"}
         )
-        return json.loads(response.choices[0].message.content)
+
+    def generate_bool_response(self, question: str, text: str, symptom: str, key: str) -> dict:
+        """分析是否，返回 {'S': 'True'}"""
+        return json.loads(self._chat(self._bool_request(question, text, symptom, key)))
+
+    async def agenerate_bool_response(self, question: str, text: str, symptom: str, key: str) -> dict:
+        return json.loads(await self._achat(self._bool_request(question, text, symptom, key)))
 
     # =============== CDG 生成记录 ===============
-    def generate_soap_note(self, info: str, step: int = 2) -> str:
-        """CDG 分阶段生成 SOAP"""
+    def _soap_request(self, info: str, step: int = 2) -> dict:
         prompt = self.prompt['cdg']
 
         if step == 2:
@@ -68,17 +269,25 @@ class AIGenerator:
         else:
             final_prompt = prompt['supplementary'] + info
 
-        response = self.client.chat.completions.create(
+        return dict(
             model=settings.MODEL,
             messages=[
                 {"role": "system", "content": prompt['system']},
                 {"role": "user", "content": final_prompt}
             ],
         )
-        return response.choices[0].message.content
 
-    def generate_initial_note(self, info_dict: dict) -> Tuple[str, str]:
-        """强化版初始记录生成（确保疾病名称严格匹配）"""
+    def generate_soap_note(self, info: str, step: int = 2) -> str:
+        """CDG 分阶段生成 SOAP"""
+        return self._chat(self._soap_request(info, step))
+
+    async def agenerate_soap_note(self, info: str, step: int = 2) -> str:
+        return await self._achat(self._soap_request(info, step))
+
+    def astream_soap_note(self, info: str, step: int = 2) -> AsyncIterator[str]:
+        return self._astream(self._soap_request(info, step))
+
+    def _initial_note_request(self, info_dict: dict) -> dict:
         # 加载提示模板
         prompt = self.prompt['cdg']
 
@@ -99,7 +308,7 @@ class AIGenerator:
         )
 
         # API调用（强制JSON模式）
-        response = self.client.chat.completions.create(
+        return dict(
             model=settings.MODEL,
             messages=[
                 {
@@ -112,9 +321,11 @@ class AIGenerator:
             temperature=0.3  # 降低随机性
         )
 
-        # 解析并验证结果
+    def _parse_initial_note(self, content: str, info_dict: dict) -> Tuple[str, str]:
+        """解析并验证结果"""
+        disease_name = list(info_dict['disease'].keys())
         try:
-            res = json.loads(response.choices[0].message.content)
+            res = json.loads(content)
             selected_disease = res['disease']
 
             # 白名单验证
@@ -128,8 +339,15 @@ class AIGenerator:
             fallback_disease = max(info_dict['disease'].items(), key=lambda x: x[1])[0]
             return fallback_disease, f"自动回退：{str(e)}"
 
+    def generate_initial_note(self, info_dict: dict) -> Tuple[str, str]:
+        """强化版初始记录生成（确保疾病名称严格匹配）"""
+        return self._parse_initial_note(self._chat(self._initial_note_request(info_dict)), info_dict)
+
+    async def agenerate_initial_note(self, info_dict: dict) -> Tuple[str, str]:
+        return self._parse_initial_note(await self._achat(self._initial_note_request(info_dict)), info_dict)
+
     # =============== PSG 生成患者报告 ===============
-    def generate_report(self, info_dict: dict) -> str:
+    def _report_request(self, info_dict: dict) -> dict:
         prompt = self.prompt['psg_new']
         # additional_info = info_dict.get('addition', False)
         # if not additional_info:
@@ -155,14 +373,22 @@ class AIGenerator:
         )
 
         # ai 生成
-        response = self.client.chat.completions.create(
+        return dict(
             model=settings.MODEL,
             messages=[
                 {"role": "system", "content": prompt['system']},
                 {"role": "user", "content": prompt_content}
             ],
         )
-        return response.choices[0].message.content
+
+    def generate_report(self, info_dict: dict) -> str:
+        return self._chat(self._report_request(info_dict))
+
+    async def agenerate_report(self, info_dict: dict) -> str:
+        return await self._achat(self._report_request(info_dict))
+
+    def astream_report(self, info_dict: dict) -> AsyncIterator[str]:
+        return self._astream(self._report_request(info_dict))
 
 
 if __name__ == '__main__':
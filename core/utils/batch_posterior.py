@@ -0,0 +1,206 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .entropy_calculator import EntropyCalculator
+
+
+class SessionBatch:
+    """
+    N 个会话的贝叶斯状态堆叠为数组，一次计算全部会话的 IEG 与概率更新，结果与逐个会话的 SessionPosterior 一致
+    各会话的候选疾病数、症状数不同，按最大值补齐：
+    - matrix: (N, D, S) 0/1 关联矩阵
+    - p_l: (N, D) 疾病概率，补齐的疾病为 0（disease_mask 为 False）
+    - active: (N, S) 尚未回答的症状，补齐的症状为 False
+    - rho: (N, S) 症状先验概率，缺失为 nan
+    """
+
+    def __init__(self,
+                 ec: EntropyCalculator,
+                 disease_probs: Sequence[Dict[str, Optional[float]]],
+                 answered: Optional[Sequence[Iterable[str]]] = None):
+        """
+        :param ec: 熵计算工具
+        :param disease_probs: 各会话当前的疾病概率（未归一化亦可），键为候选疾病
+        :param answered: 各会话已回答的症状
+        """
+        self.ec = ec
+        inc = ec.incidence
+        n = len(disease_probs)
+        answered = answered if answered is not None else [()] * n
+
+        self.disease_names: List[List[str]] = [list(p) for p in disease_probs]
+        d_idx = [inc.disease_index(names) for names in self.disease_names]
+        s_idx = [inc.symptoms_of(idx) for idx in d_idx]
+        self.symptom_names: List[List[str]] = [[inc.symptom_names[i] for i in idx] for idx in s_idx]
+        self.symptom_col: List[Dict[str, int]] = [{s: c for c, s in enumerate(names)} for names in self.symptom_names]
+
+        D = max((len(names) for names in self.disease_names), default=0)
+        S = max((len(names) for names in self.symptom_names), default=0)
+        self.disease_mask = np.zeros((n, D), dtype=bool)
+        self.symptom_mask = np.zeros((n, S), dtype=bool)
+        self.matrix = np.zeros((n, D, S), dtype=float)
+        self.rho = np.full((n, S), np.nan)
+        p_l = np.zeros((n, D))
+        for i in range(n):
+            nd, ns = len(d_idx[i]), len(s_idx[i])
+            self.disease_mask[i, :nd] = True
+            self.symptom_mask[i, :ns] = True
+            self.matrix[i, :nd, :ns] = inc.submatrix(d_idx[i], s_idx[i])
+            self.rho[i, :ns] = ec.priors.symptom_prob(s_idx[i])
+            p_l[i, :nd] = [max(disease_probs[i].get(d) or 0.0, 0.0) for d in self.disease_names[i]]
+
+        self.active = self.symptom_mask.copy()
+        for i, symptoms in enumerate(answered):
+            for s in symptoms:
+                col = self.symptom_col[i].get(s)
+                if col is not None:
+                    self.active[i, col] = False
+
+        self.present = self.matrix > 0
+        self.total_rho = np.nansum(np.where(self.active, self.rho, np.nan), axis=1)
+        self.row_active = np.einsum('nds,ns->nd', self.matrix, self.active.astype(float))
+        self.p_l = self._normalize(p_l / np.maximum(p_l.sum(axis=1, keepdims=True), ec.epsilon))
+        self.discarded_mass = np.zeros(n)  # 各会话剪枝累计丢弃的概率质量
+
+    @classmethod
+    def from_priors(cls, ec: EntropyCalculator, disease_lists: Sequence[List[str]]) -> 'SessionBatch':
+        """新会话：使用 DiseaseProb 的先验概率"""
+        return cls(ec, [ec.priors.disease_prob_dict(names) for names in disease_lists])
+
+    def __len__(self):
+        return len(self.disease_names)
+
+    def _normalize(self, p_l: np.ndarray) -> np.ndarray:
+        """按会话归一化，补齐的疾病保持 0"""
+        return self.ec._safe_normalize(np.where(self.disease_mask, p_l, 0.0), axis=1)
+
+    def ieg(self) -> np.ndarray:
+        """
+        所有会话对尚未回答症状的 IEG
+        :return: (N, S)，已回答或补齐的症状为 nan
+        """
+        ec = self.ec
+        inv = 1.0 / np.maximum(self.row_active, 1.0)
+        log_p_k_l = np.where(self.present, np.log(inv + ec.epsilon)[:, :, None], np.log(ec.epsilon))
+        log_pn_k_l = np.where(self.present, np.log(1.0 - inv + ec.epsilon)[:, :, None], np.log(1.0 + ec.epsilon))
+        log_p_l = np.where(self.disease_mask, np.log(self.p_l + ec.epsilon), -np.inf)
+
+        H_0 = -np.sum(self.p_l * np.log(self.p_l + ec.epsilon), axis=1)
+        with np.errstate(invalid='ignore'):  # 没有候选疾病的会话整行为 nan
+            H_cond = ec.cond_entropy_from_logs(
+                self.rho / np.maximum(self.total_rho, ec.epsilon)[:, None],
+                log_p_l=log_p_l,
+                log_p_k_l=log_p_k_l,
+                log_pn_k_l=log_pn_k_l
+            )
+            ieg = np.abs((H_0[:, None] - H_cond) / np.maximum(H_0, ec.epsilon)[:, None])
+        ieg = np.nan_to_num(ieg, nan=0.0, posinf=0.0, neginf=0.0)
+        return np.where(self.active, ieg, np.nan)
+
+    def top_symptoms(self, ieg: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """各会话 IEG 最大的 k 个症状（同值按症状顺序，与 max(IEG, key=IEG.get) 一致）"""
+        order = np.argsort(-np.nan_to_num(ieg, nan=-np.inf), axis=1, kind='stable')[:, :k]
+        return [[(self.symptom_names[i][c], float(ieg[i, c])) for c in row if self.active[i, c]]
+                for i, row in enumerate(order)]
+
+    def disease_prob(self) -> List[Dict[str, float]]:
+        """各会话的疾病概率（剪枝丢弃的疾病不再列出）"""
+        return [{d: float(p) for d, p, keep in zip(names, row, mask) if keep}
+                for names, row, mask in zip(self.disease_names, self.p_l, self.disease_mask)]
+
+    def answer(self, symptoms: Sequence[Optional[str]], responses: Sequence[bool]) -> np.ndarray:
+        """
+        每个会话记录一个症状的回答（与 SessionPosterior.answer 相同：先移出该症状并计算 IEG，再更新疾病概率）
+        :param symptoms: 各会话回答的症状，None 为本次不更新该会话
+        :param responses: 各会话是否出现该症状
+        :return: 本次的 IEG (N, S)
+        """
+        ec = self.ec
+        n = len(self)
+        update = np.array([s is not None for s in symptoms], dtype=bool)
+        cols = np.array([self.symptom_col[i].get(s, -1) if s is not None else -1 for i, s in enumerate(symptoms)],
+                        dtype=np.int64)
+        rows = np.arange(n)
+        safe_cols = np.where(cols >= 0, cols, 0)
+        known = (cols >= 0) & (self.symptom_mask[rows, safe_cols] if self.symptom_mask.size else False)
+
+        rho_total_before = np.maximum(self.total_rho, ec.epsilon)
+        removed = known & self.active[rows, safe_cols] if self.active.size else known
+        r = rows[removed]
+        self.active[r, cols[removed]] = False
+        self.row_active[r] -= self.matrix[r, :, cols[removed]]
+        rho_col = self.rho[r, cols[removed]]
+        self.total_rho[r] -= np.nan_to_num(rho_col, nan=0.0)
+
+        ieg = self.ieg()
+
+        # 向量化的 bayes_update
+        rho_k = np.zeros(n)
+        p_k_l = np.ones_like(self.p_l)
+        if known.any():
+            k = rows[known]
+            rho_k[k] = np.nan_to_num(self.rho[k, cols[known]], nan=0.0) / rho_total_before[k]
+            p_k_l[k] = self.matrix[k, :, cols[known]]
+        rho_k = np.clip(rho_k, ec.epsilon, 1.0 - ec.epsilon)[:, None]
+        positive = np.asarray(responses, dtype=bool)[:, None]
+        new_probs = np.where(positive, p_k_l * self.p_l / rho_k, (1 - p_k_l) * self.p_l / (1 - rho_k))
+        new_probs = self._normalize(np.clip(new_probs, ec.MIN_PROB_THRESHOLD, None))
+        self.p_l = np.where(update[:, None], new_probs, self.p_l)
+        return ieg
+
+    def prune(self, max_mass: float, min_diseases: int = 1,
+              rows: Optional[Iterable[int]] = None) -> List[Dict[str, float]]:
+        """
+        与 SessionPosterior.prune 相同的剪枝：丢弃的疾病与只属于它们的症状从掩码中移除
+        :param max_mass: 每个会话允许丢弃的概率质量，0 为不剪枝
+        :param min_diseases: 至少保留的疾病数
+        :param rows: 只剪枝这些会话，默认全部
+        :return: 各会话本次丢弃的疾病及其丢弃前的概率
+        """
+        pruned: List[Dict[str, float]] = [{} for _ in range(len(self))]
+        min_diseases = max(min_diseases, 1)
+        for i in range(len(self)) if rows is None else rows:
+            idx = np.flatnonzero(self.disease_mask[i])
+            budget = max_mass - self.discarded_mass[i]
+            if budget <= 0 or len(idx) <= min_diseases:
+                continue
+
+            order = np.argsort(self.p_l[i, idx], kind='stable')
+            mass = np.cumsum(self.p_l[i, idx][order])
+            k = min(int(np.searchsorted(mass, budget, side='right')), len(idx) - min_diseases)
+            if k <= 0:
+                continue
+
+            drop = idx[order[:k]]
+            pruned[i] = {self.disease_names[i][d]: float(self.p_l[i, d]) for d in drop}
+            self.discarded_mass[i] += float(mass[k - 1])
+            self.disease_mask[i, drop] = False
+
+            keep_cols = self.present[i][self.disease_mask[i]].any(axis=0)
+            self.symptom_mask[i] &= keep_cols
+            self.active[i] &= keep_cols
+            self.total_rho[i] = np.nansum(np.where(self.active[i], self.rho[i], np.nan))
+            self.p_l[i] = self.ec._safe_normalize(np.where(self.disease_mask[i], self.p_l[i], 0.0))
+        return pruned
+
+    def replay(self, answers: Sequence[Sequence[Tuple[str, bool]]],
+               prune_mass: float = 0.0, min_diseases: int = 1) -> List[np.ndarray]:
+        """
+        按轮依次重放各会话的症状回答（第 t 步同时更新所有仍有第 t 个回答的会话）
+        :param answers: 各会话按顺序的 [(症状, 是否出现), ...]
+        :param prune_mass: 每步更新后按 SessionPosterior.prune 剪枝（与 PIMService 的问诊流程一致），0 为不剪枝
+        :param min_diseases: 剪枝时至少保留的疾病数
+        :return: 每一步的 IEG（剪枝移出的症状为 nan）
+        """
+        steps = max((len(a) for a in answers), default=0)
+        iegs = []
+        for t in range(steps):
+            symptoms = [a[t][0] if t < len(a) else None for a in answers]
+            responses = [bool(a[t][1]) if t < len(a) else False for a in answers]
+            ieg = self.answer(symptoms, responses)
+            if prune_mass > 0:
+                self.prune(prune_mass, min_diseases, rows=[i for i, s in enumerate(symptoms) if s is not None])
+                ieg = np.where(self.active, ieg, np.nan)
+            iegs.append(ieg)
+        return iegs
@@ -1,28 +1,67 @@
 import numpy as np
-from typing import Dict, List, Tuple
-from core.models import DiagnosisSession, DiseaseProb, SymptomProb, RelationDiseaseSymptom
+from typing import Dict, List, Tuple, Optional
+from core.models import DiagnosisSession
+from .incidence import IncidenceMatrix, get_incidence_matrix
+from .prior_tables import PriorTables, get_prior_tables
 
 
 class EntropyCalculator:
     """改进后的信息熵增益计算工具类"""
 
-    def __init__(self):
+    def __init__(self, incidence: Optional[IncidenceMatrix] = None, priors: Optional[PriorTables] = None):
+        """
+        :param incidence: 疾病-症状关联矩阵，默认使用进程内共享的全局矩阵
+        :param priors: 先验概率表，默认使用进程内共享的表
+        """
         self.epsilon = 1e-10  # 用于数值稳定的小常数
         self.MIN_PROB_THRESHOLD = 0.001  # 最小保留概率
+        self._incidence = incidence
+        self._priors = priors
+
+    @property
+    def incidence(self) -> IncidenceMatrix:
+        if self._incidence is None:
+            self._incidence = get_incidence_matrix()
+        return self._incidence
+
+    @property
+    def priors(self) -> PriorTables:
+        if self._priors is None:
+            self._priors = get_prior_tables()
+        return self._priors
+
+    def warm(self) -> 'EntropyCalculator':
+        """预先加载关联矩阵与先验概率表（否则在首次使用时才从数据库读取）"""
+        _ = self.incidence, self.priors
+        return self
+
+    @property
+    def data_version(self) -> Tuple[int, int]:
+        """(关联矩阵版本, 先验概率表版本)，用于判断依赖它们的缓存是否过期"""
+        return self.incidence.version, self.priors.version
+
+    @staticmethod
+    def _get_session(session: Optional[DiagnosisSession], session_id) -> Optional[DiagnosisSession]:
+        """优先使用调用方已读取的会话，避免同一轮内重复查询"""
+        if session is None and session_id:
+            session = DiagnosisSession.objects.get(session_id=session_id)
+        return session
 
     def calculate_ieg(self,
                       sd_relation: Dict[str, List[str]],
-                      session_id=None) -> Dict[str, float]:
+                      session_id=None,
+                      session: Optional[DiagnosisSession] = None) -> Dict[str, float]:
         """
         计算初始IEG值（改进版）
         :param sd_relation: 疾病-症状关系 {'D1':['S1','S2'], ...}
         :param session_id: 会话 id
+        :param session: 已读取的会话（传入时不再按 session_id 查询）
         :return: IEG字典 {'S1':0.8, ...}
         """
         # 获取需要排除的症状
         drop_symptoms = []
-        if session_id:
-            session = DiagnosisSession.objects.get(session_id=session_id)
+        session = self._get_session(session, session_id)
+        if session is not None:
             drop_symptoms = list(session.ans_to_symptom.keys()) if session.ans_to_symptom else []
 
         # 构建疾病-症状矩阵
@@ -31,13 +70,13 @@ class EntropyCalculator:
             drop_symptoms=drop_symptoms if drop_symptoms else None
         )
 
-        # 获取并归一化疾病概率
-        p_l_dict = self.get_disease_prob(sd_relation, session_id)
-        p_l = self._safe_normalize(np.array(list(p_l_dict.values()), dtype=float))
+        # 获取并归一化疾病概率（按矩阵行顺序对齐）
+        p_l_dict = self.get_disease_prob(sd_relation, session=session)
+        p_l = self._safe_normalize(np.array([p_l_dict.get(d, 0.0) for d in disease_names], dtype=float))
 
-        # 获取症状概率并归一化
-        rho_k = SymptomProb.get_prob(symptoms_names)
-        total_rho = max(np.sum([rho_k[k] for k in rho_k]), self.epsilon)  # 防止除零
+        # 获取症状概率并归一化（缺失概率的症状记为 nan，IEG 取 0）
+        rho = self.priors.symptom_prob(self.incidence.symptom_index(symptoms_names))
+        total_rho = max(np.nansum(rho), self.epsilon)  # 防止除零
 
         # 归一化疾病-症状矩阵（行归一）
         sd_matrix = self._safe_normalize(sd_matrix.astype(float), axis=1)
@@ -45,42 +84,34 @@ class EntropyCalculator:
         # 计算初始熵
         H_0 = -np.sum(p_l * np.log(p_l + self.epsilon))
 
-        # 计算每个症状的IEG
-        ieg_dict = {}
-        for col, s_name in enumerate(symptoms_names):
-            try:
-                H_cond = self.calculate_one_ieg(
-                    rho_k[s_name] / total_rho,
-                    p_l=p_l,
-                    p_k_l=sd_matrix[:, col]
-                )
-                ieg = abs((H_0 - H_cond) / max(H_0, self.epsilon))  # 防止除零
-                ieg_dict[s_name] = ieg
-            except Exception as e:
-                print(f"计算症状 {s_name} 的IEG时出错: {str(e)}")
-                ieg_dict[s_name] = 0.0  # 出错时默认值
-
-        return ieg_dict
+        # 一次性计算所有症状的条件熵和IEG
+        if not symptoms_names:
+            return {}
+        H_cond = self.calculate_cond_entropy(rho / total_rho, p_l=p_l, p_k_l=sd_matrix)
+        ieg = np.abs((H_0 - H_cond) / max(H_0, self.epsilon))  # 防止除零
+        ieg = np.nan_to_num(ieg, nan=0.0, posinf=0.0, neginf=0.0)  # 出错时默认值
+
+        return {s_name: float(ieg[col]) for col, s_name in enumerate(symptoms_names)}
 
     def get_disease_prob(self,
                          sd_relation: Dict[str, list],
-                         session_id=None) -> Dict[str, float]:
+                         session_id=None,
+                         session: Optional[DiagnosisSession] = None) -> Dict[str, float]:
         """
         安全获取疾病概率（改进版）
         :param sd_relation: 疾病-病征对照字典
         :param session_id: 会话id
+        :param session: 已读取的会话（传入时不再按 session_id 查询）
         :return: 归一化的疾病概率字典
         """
-        if not session_id:
-            _, disease_names, _ = self._sd_matrix(sd_relation)
-            p_l = DiseaseProb.get_prob(disease_names)
+        session = self._get_session(session, session_id)
+        if session is None:
+            p_l = self.priors.disease_prob_dict(self._get_diseases(sd_relation))
         else:
-            session = DiagnosisSession.objects.get(session_id=session_id)
             if session.diseases:
                 p_l = session.diseases[-1]
             else:
-                _, disease_names, _ = self._sd_matrix(sd_relation)
-                p_l = DiseaseProb.get_prob(disease_names)
+                p_l = self.priors.disease_prob_dict(self._get_diseases(sd_relation))
 
         # 归一化处理
         prob_sum = max(np.sum(list(p_l.values())), self.epsilon)
@@ -93,24 +124,60 @@ class EntropyCalculator:
         """
         计算单个症状的条件熵（改进版）
         """
+        return float(self.calculate_cond_entropy(np.array([rho_k], dtype=float), p_l, p_k_l[:, None])[0])
+
+    def calculate_cond_entropy(self,
+                               rho_k: np.ndarray,
+                               p_l: np.ndarray,
+                               p_k_l: np.ndarray) -> np.ndarray:
+        """
+        所有症状的条件熵（矩阵形式，按列广播）
+        :param rho_k: 各症状的归一化概率，形状 (S,)
+        :param p_l: 疾病概率，形状 (D,)
+        :param p_k_l: 行归一化的疾病-症状矩阵，形状 (D, S)
+        :return: 各症状的条件熵，形状 (S,)
+        """
+        # 使用对数空间计算避免数值下溢
+        return self.cond_entropy_from_logs(
+            rho_k,
+            log_p_l=np.log(p_l + self.epsilon),
+            log_p_k_l=np.log(p_k_l + self.epsilon),
+            log_pn_k_l=np.log(1.0 - p_k_l + self.epsilon)
+        )
+
+    def cond_entropy_from_logs(self,
+                               rho_k: np.ndarray,
+                               log_p_l: np.ndarray,
+                               log_p_k_l: np.ndarray,
+                               log_pn_k_l: np.ndarray) -> np.ndarray:
+        """
+        由预先计算好的对数项求条件熵，便于会话内缓存与疾病概率无关的部分
+        也可传入多个会话堆叠的数组（前面加一维 N），按疾病维（倒数第二维）归一化
+        :param rho_k: 各症状的归一化概率，形状 (S,) 或 (N, S)
+        :param log_p_l: log(p_l + eps)，形状 (D,) 或 (N, D)；补齐的疾病为 -inf
+        :param log_p_k_l: log(p_k_l + eps)，形状 (D, S) 或 (N, D, S)
+        :param log_pn_k_l: log(1 - p_k_l + eps)，形状 (D, S) 或 (N, D, S)
+        :return: 各症状的条件熵，形状 (S,) 或 (N, S)
+        """
         # 避免无关疾病的概率直接归零，避免过拟合
         rho_k = np.clip(rho_k, 0.01, 0.99)  # 限制极端概率值
+        rho = np.expand_dims(rho_k, -2)
+        log_p_l = log_p_l[..., None]
 
-        # 使用对数空间计算避免数值下溢
-        log_p_l_k = np.log(p_k_l + self.epsilon) + np.log(p_l + self.epsilon) - np.log(rho_k)
-        log_pn_l_k = np.log(1.0 - p_k_l + self.epsilon) + np.log(p_l + self.epsilon) - np.log(1.0 - rho_k)
+        log_p_l_k = log_p_k_l + log_p_l - np.log(rho)
+        log_pn_l_k = log_pn_k_l + log_p_l - np.log(1.0 - rho)
 
-        # 指数归一化
-        p_l_k = np.exp(log_p_l_k - np.max(log_p_l_k))
-        pn_l_k = np.exp(log_pn_l_k - np.max(log_pn_l_k))
+        # 指数归一化（每列减去各自的最大值）
+        p_l_k = np.exp(log_p_l_k - np.max(log_p_l_k, axis=-2, keepdims=True))
+        pn_l_k = np.exp(log_pn_l_k - np.max(log_pn_l_k, axis=-2, keepdims=True))
 
         # 安全归一化
-        p_l_k = self._safe_normalize(p_l_k)
-        pn_l_k = self._safe_normalize(pn_l_k)
+        p_l_k = self._safe_normalize(p_l_k, axis=-2)
+        pn_l_k = self._safe_normalize(pn_l_k, axis=-2)
 
         # 计算条件熵
-        H_occ = -np.sum(p_l_k * np.log(p_l_k + self.epsilon))
-        H_nok = -np.sum(pn_l_k * np.log(pn_l_k + self.epsilon))
+        H_occ = -np.sum(p_l_k * np.log(p_l_k + self.epsilon), axis=-2)
+        H_nok = -np.sum(pn_l_k * np.log(pn_l_k + self.epsilon), axis=-2)
         H_cond = rho_k * H_occ + (1.0 - rho_k) * H_nok
 
         return H_cond
@@ -118,37 +185,51 @@ class EntropyCalculator:
     def updated_disease_prob(self,
                              session_id: str,
                              symptom_response: bool,
-                             symptom: str) -> Dict[str, float]:
+                             symptom: str,
+                             session: Optional[DiagnosisSession] = None) -> Dict[str, float]:
         """
         返回更新后的疾病概率（改进版）
+        :param session: 已读取的会话（传入时不再按 session_id 查询）
         """
-        session = DiagnosisSession.objects.get(session_id=session_id)
+        session = self._get_session(session, session_id)
         old_disease_prob = session.diseases[-1] if session.diseases else {}
         disease_names = list(old_disease_prob.keys())
 
-        # 获取当前症状列表
-        old_symptoms_names = list(session.IEG[-1].keys()) if session.IEG else []
-        initial_symptoms_names = list(session.IEG[0].keys()) if session.IEG else []
-        drop_symptoms = [d for d in initial_symptoms_names if d not in old_symptoms_names]
+        # 获取当前症状列表：候选疾病涉及的、本症状之前尚未回答的症状（即上一轮计算 IEG 的症状）
+        inc = self.incidence
+        answered = set(session.ans_to_symptom) - {symptom}
+        old_symptoms_names = [inc.symptom_names[i] for i in inc.symptoms_of(inc.disease_index(disease_names))
+                              if inc.symptom_names[i] not in answered]
 
         # 归一化当前疾病概率
         p_l = self._safe_normalize(np.array(list(old_disease_prob.values()), dtype=float))
 
         # 获取症状概率
-        rho_k_dict = SymptomProb.get_prob(old_symptoms_names) if old_symptoms_names else {}
+        rho_k_dict = self.priors.symptom_prob_dict(old_symptoms_names) if old_symptoms_names else {}
         total_rho = max(np.sum(list(rho_k_dict.values())), self.epsilon)
         rho_k = rho_k_dict.get(symptom, 0.0) / total_rho
 
-        # 构建疾病-症状关系矩阵
-        sd_relation = RelationDiseaseSymptom.sd_relation(disease_names)
-        sd_matrix, _, _ = self._sd_matrix(sd_relation, drop_symptoms=drop_symptoms)
-
-        # 找到目标症状的列
+        # 从全局关联矩阵中按名称切出目标症状的列
         p_k_l = np.ones(len(disease_names), dtype=float)
         if symptom in old_symptoms_names:
-            symptom_idx = old_symptoms_names.index(symptom)
-            p_k_l = sd_matrix[:, symptom_idx]
+            p_k_l = inc.submatrix(inc.disease_index(disease_names), inc.symptom_index([symptom]))[:, 0]
+
+        new_probs = self.bayes_update(p_l, p_k_l, rho_k, symptom_response)
+        return {d_name: float(new_probs[i]) for i, d_name in enumerate(disease_names)}
 
+    def bayes_update(self,
+                     p_l: np.ndarray,
+                     p_k_l: np.ndarray,
+                     rho_k: float,
+                     symptom_response: bool) -> np.ndarray:
+        """
+        根据单个症状的回答更新疾病概率，O(疾病数)
+        :param p_l: 归一化的疾病概率
+        :param p_k_l: 该症状在各疾病下的出现情况
+        :param rho_k: 该症状的归一化概率
+        :param symptom_response: 患者是否出现该症状
+        :return: 更新并归一化后的疾病概率
+        """
         # 计算更新后的概率
         rho_k = np.clip(rho_k, self.epsilon, 1.0 - self.epsilon)
         if symptom_response:
@@ -161,9 +242,7 @@ class EntropyCalculator:
         new_probs = np.clip(new_probs, min_prob, None)
 
         # 重新归一化
-        new_probs = self._safe_normalize(new_probs)
-
-        return {d_name: float(new_probs[i]) for i, d_name in enumerate(disease_names)}
+        return self._safe_normalize(new_probs)
 
     def _safe_normalize(self, arr: np.array, axis=None) -> np.array:
         """
@@ -180,10 +259,6 @@ class EntropyCalculator:
         sums = np.where(sums <= 0, 1.0, sums)  # 防止除零
         return arr / sums
 
-    def _get_symptoms(self, sd_relation: Dict[str, List[str]]) -> List[str]:
-        """获取所有症状列表"""
-        return list({s for symptoms in sd_relation.values() for s in symptoms})
-
     def _get_diseases(self, sd_relation: Dict[str, List[str]]) -> List[str]:
         """获取所有疾病列表"""
         return list(sd_relation.keys())
@@ -192,20 +267,18 @@ class EntropyCalculator:
                    sd_relation: Dict[str, List[str]],
                    drop_symptoms: List[str] = None) -> Tuple[np.ndarray, List[str], List[str]]:
         """
-        构建疾病-症状关系矩阵（改进版）
+        从全局关联矩阵切出当前疾病的疾病-症状矩阵
+        :param sd_relation: 疾病-症状关系，只使用其中的疾病名称
+        :param drop_symptoms: 需要排除的症状
         """
-        all_symptoms = [s for s in self._get_symptoms(sd_relation)
-                        if not drop_symptoms or s not in drop_symptoms]
+        inc = self.incidence
         all_diseases = self._get_diseases(sd_relation)
+        d_idx = inc.disease_index(all_diseases)
 
-        # 构建症状到索引的映射
-        symptom_to_idx = {s: idx for idx, s in enumerate(all_symptoms)}
-
-        # 初始化并填充矩阵
-        sd_matrix = np.zeros((len(all_diseases), len(all_symptoms)), dtype=int)
-        for i, (disease, symptoms) in enumerate(sd_relation.items()):
-            for s in symptoms:
-                if s in symptom_to_idx:
-                    sd_matrix[i, symptom_to_idx[s]] = 1
+        s_idx = inc.symptoms_of(d_idx)
+        if drop_symptoms:
+            s_idx = s_idx[~np.isin(s_idx, inc.symptom_index(drop_symptoms))]
 
+        sd_matrix = inc.submatrix(d_idx, s_idx)
+        all_symptoms = [inc.symptom_names[i] for i in s_idx]
         return sd_matrix, all_diseases, all_symptoms
@@ -0,0 +1,120 @@
+"""
+疾病名称模糊匹配索引
+_fuzzy_search 使用 fuzz.ratio / partial_ratio / token_sort_ratio 三者最大值，
+三者都不超过由 "字符多重集交集大小" C 推出的上界：
+    ratio           <= 2C / (len(q) + len(n))
+    partial_ratio   <= 2C / (min(len(q), len(n)) + C)
+    token_sort_ratio 同 ratio，但在 full_process + 排序后的字符串上计算
+用字符倒排索引一次性求出所有名称的 C，只对上界可能达到阈值的候选精确打分，
+因此结果与线性扫描完全一致。
+"""
+
+from collections import Counter
+from typing import List, Optional, Sequence
+
+import numpy as np
+from fuzzywuzzy import utils as fuzz_utils
+
+
+def sort_tokens(text: str) -> str:
+    """与 fuzz.token_sort_ratio 相同的预处理：清洗、分词、排序"""
+    processed = fuzz_utils.full_process(text, force_ascii=True)
+    return " ".join(sorted(processed.split())).strip()
+
+
+class CharIndex:
+    """字符倒排索引：字符 -> (字符串下标, 出现次数)，CSR 存储"""
+
+    def __init__(self, texts: Sequence[str]):
+        self.lengths = np.array([len(t) for t in texts], dtype=np.int32)
+        self.size = len(texts)
+
+        postings = {}
+        for i, text in enumerate(texts):
+            for ch, cnt in Counter(text).items():
+                postings.setdefault(ch, []).append((i, cnt))
+
+        self.vocab = {ch: k for k, ch in enumerate(postings)}
+        self.indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(p) for p in postings.values()])
+        flat = [item for p in postings.values() for item in p]
+        self.rows = np.array([i for i, _ in flat], dtype=np.int32)
+        self.counts = np.array([c for _, c in flat], dtype=np.int32)
+
+    def overlap(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        每个查询与每个字符串的字符多重集交集大小，所有查询一次向量化计算
+        :param texts: 查询列表
+        :return: (len(texts), size) 矩阵
+        """
+        owners, chars, counts = [], [], []
+        for qi, text in enumerate(texts):
+            for ch, cnt in Counter(text).items():
+                k = self.vocab.get(ch)
+                if k is not None:
+                    owners.append(qi)
+                    chars.append(k)
+                    counts.append(cnt)
+
+        common = np.zeros((len(texts), self.size), dtype=np.int32)
+        if not chars:
+            return common
+
+        # 把每个 (查询, 字符) 对应的倒排区间展开成一维下标
+        chars = np.array(chars)
+        lo = self.indptr[chars]
+        lens = self.indptr[chars + 1] - lo
+        seg = np.repeat(np.arange(len(chars)), lens)
+        pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens) + lo[seg]
+
+        contrib = np.minimum(self.counts[pos], np.array(counts)[seg])
+        flat = np.array(owners)[seg] * self.size + self.rows[pos]
+        common.ravel()[:] = np.bincount(flat, weights=contrib, minlength=common.size)
+        return common
+
+
+class FuzzyNameIndex:
+    """疾病名称候选索引，names 的顺序即知识图谱的遍历顺序"""
+
+    def __init__(self, names: Sequence[str]):
+        self.names: List[str] = list(names)
+        self.lowered = [n.lower() for n in self.names]
+        self.raw = CharIndex(self.lowered)
+        self.tokens = CharIndex([sort_tokens(n) for n in self.lowered])
+
+    def upper_bound(self, queries: Sequence[str]) -> np.ndarray:
+        """
+        三种打分的上界（0~1）
+        :param queries: 已 lower().strip() 的查询列表
+        :return: (len(queries), len(names)) 矩阵
+        """
+        lq = np.array([len(q) for q in queries], dtype=float)[:, None]
+        common = self.raw.overlap(queries).astype(float)
+        lengths = self.raw.lengths[None, :]
+
+        q_tokens = [sort_tokens(q) for q in queries]
+        lt = np.array([len(t) for t in q_tokens], dtype=float)[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ub_ratio = 2 * common / (lq + lengths)
+            ub_partial = 2 * common / (np.minimum(lq, lengths) + common)
+            ub_token = 2 * self.tokens.overlap(q_tokens) / (lt + self.tokens.lengths[None, :])
+        return np.nan_to_num(np.maximum(np.maximum(ub_ratio, ub_partial), ub_token))
+
+    def candidates(self, queries: Sequence[str], threshold: int) -> List[Optional[np.ndarray]]:
+        """
+        每个查询可能达到阈值的名称下标（升序）
+        :param queries: 已 lower().strip() 的查询列表
+        :param threshold: 相似度阈值(0-100)
+        :return: 下标数组列表；无法剪枝的查询（空查询等边界情况）对应 None，由调用方全量打分
+        """
+        prunable = [bool(q) and bool(sort_tokens(q)) and threshold > 0 for q in queries]
+        result: List[Optional[np.ndarray]] = [None] * len(queries)
+        rows = [i for i, ok in enumerate(prunable) if ok]
+        if not rows:
+            return result
+
+        # fuzz 的分数经过四舍五入，round(100r) >= threshold 等价于 100r >= threshold - 0.5
+        mask = 100 * self.upper_bound([queries[i] for i in rows]) >= threshold - 0.5 - 1e-9
+        for i, row_mask in zip(rows, mask):
+            result[i] = np.flatnonzero(row_mask)
+        return result
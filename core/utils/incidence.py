@@ -0,0 +1,158 @@
+import threading
+from typing import Dict, List, Iterable, Optional
+
+import numpy as np
+
+from .kb_version import RELATION, bump_kb_version, kb_version
+
+
+class IncidenceMatrix:
+    """
+    全局疾病-症状关联矩阵（CSR 存储，行为疾病，列为症状）
+    疾病、症状均有稳定的整数 id，会话内用到的子矩阵通过下标数组切片得到
+    """
+
+    def __init__(self, sd_relation: Dict[str, List[str]], version: int = 0):
+        """
+        :param sd_relation: 疾病-症状关系 {'D1':['S1','S2'], ...}
+        :param version: 版本号，每次重新加载递增，供依赖此矩阵的缓存判断是否失效
+        """
+        self.version = version
+        self.disease_names: List[str] = list(sd_relation)
+        self.disease_ids: Dict[str, int] = {d: i for i, d in enumerate(self.disease_names)}
+        self.symptom_names: List[str] = []
+        self.symptom_ids: Dict[str, int] = {}
+
+        indptr, indices = [0], []
+        for symptoms in sd_relation.values():
+            for s in dict.fromkeys(symptoms or []):  # 去重且保持顺序
+                if s not in self.symptom_ids:
+                    self.symptom_ids[s] = len(self.symptom_names)
+                    self.symptom_names.append(s)
+                indices.append(self.symptom_ids[s])
+            indptr.append(len(indices))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int32)
+
+    @classmethod
+    def from_db(cls, version: int = 0) -> 'IncidenceMatrix':
+        """从 RelationDiseaseSymptom 表构建"""
+        from core.models import RelationDiseaseSymptom
+
+        rows = RelationDiseaseSymptom.objects.values_list('disease_name', 'symptom_list')
+        return cls({disease: symptoms for disease, symptoms in rows}, version=version)
+
+    @classmethod
+    def from_arrays(cls, disease_names: List[str], symptom_names: List[str],
+                    indptr: np.ndarray, indices: np.ndarray, version: int = 0) -> 'IncidenceMatrix':
+        """由已有的 CSR 数组构建（不复制数组，如共享内存中的数组）"""
+        self = cls.__new__(cls)
+        self.version = version
+        self.disease_names = list(disease_names)
+        self.disease_ids = {d: i for i, d in enumerate(self.disease_names)}
+        self.symptom_names = list(symptom_names)
+        self.symptom_ids = {s: i for i, s in enumerate(self.symptom_names)}
+        self.indptr = indptr
+        self.indices = indices
+        return self
+
+    @classmethod
+    def from_knowledge_graph(cls, kg, version: int = 0) -> 'IncidenceMatrix':
+        """从知识图谱构建"""
+        return cls(kg.symptom_disease_relation(kg.all_disease()), version=version)
+
+    @property
+    def shape(self):
+        return len(self.disease_names), len(self.symptom_names)
+
+    def disease_index(self, names: Iterable[str]) -> np.ndarray:
+        """疾病名称 -> id，未知疾病为 -1"""
+        return np.array([self.disease_ids.get(n, -1) for n in names], dtype=np.int64)
+
+    def symptom_index(self, names: Iterable[str]) -> np.ndarray:
+        """症状名称 -> id，未知症状为 -1"""
+        return np.array([self.symptom_ids.get(n, -1) for n in names], dtype=np.int64)
+
+    def _expand(self, d_idx: np.ndarray):
+        """展开给定行（均为有效 id）的非零元，返回 (所在行的位置, 症状 id)"""
+        lo = self.indptr[d_idx]
+        lens = self.indptr[d_idx + 1] - lo
+        seg = np.repeat(np.arange(len(d_idx)), lens)
+        pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens) + lo[seg]
+        return seg, self.indices[pos]
+
+    def symptoms_of(self, d_idx: np.ndarray) -> np.ndarray:
+        """给定疾病涉及的全部症状 id（升序去重）"""
+        d_idx = np.asarray(d_idx, dtype=np.int64)
+        _, cols = self._expand(d_idx[d_idx >= 0])
+        return np.unique(cols)
+
+    def submatrix(self, d_idx: np.ndarray, s_idx: np.ndarray) -> np.ndarray:
+        """
+        切出稠密子矩阵
+        :param d_idx: 疾病 id 数组（-1 对应全零行）
+        :param s_idx: 症状 id 数组（-1 对应全零列）
+        :return: (len(d_idx), len(s_idx)) 的 0/1 矩阵
+        """
+        d_idx = np.asarray(d_idx, dtype=np.int64)
+        s_idx = np.asarray(s_idx, dtype=np.int64)
+        matrix = np.zeros((len(d_idx), len(s_idx)), dtype=int)
+
+        col_of = np.full(len(self.symptom_names) + 1, -1, dtype=np.int64)  # 末位对应未知症状
+        col_of[s_idx] = np.arange(len(s_idx))
+        col_of[-1] = -1
+
+        rows = np.flatnonzero(d_idx >= 0)
+        seg, cols = self._expand(d_idx[rows])
+        cols = col_of[cols]
+        keep = cols >= 0
+        matrix[rows[seg[keep]], cols[keep]] = 1
+        return matrix
+
+    def sd_relation(self, disease_names: Iterable[str]) -> Dict[str, List[str]]:
+        """与 RelationDiseaseSymptom.sd_relation 相同格式的疾病-症状字典（只包含已知疾病）"""
+        result = {}
+        for d in disease_names:
+            i = self.disease_ids.get(d)
+            if i is not None:
+                result[d] = [self.symptom_names[s] for s in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+        return result
+
+
+# ====================== 进程级共享实例 ======================
+_incidence: Optional[IncidenceMatrix] = None
+_incidence_lock = threading.Lock()
+
+
+def get_incidence_matrix(reload: bool = False) -> IncidenceMatrix:
+    """
+    获取进程内共享的疾病-症状关联矩阵（首次使用时从数据库构建）
+    数据库中记录的关联表版本变化后（包括其他进程修改）自动重建，矩阵的 version 即该版本号
+    :param reload: 是否先把关联表标记为已修改（所有进程都会重建）
+    """
+    global _incidence
+    if reload:
+        invalidate_incidence_matrix()
+    version = kb_version(RELATION)
+    incidence = _incidence
+    if incidence is not None and incidence.version == version:
+        return incidence
+
+    with _incidence_lock:
+        if _incidence is None or _incidence.version != version:
+            _incidence = IncidenceMatrix.from_db(version=version)
+        return _incidence
+
+
+def invalidate_incidence_matrix(*args, **kwargs):
+    """
+    标记关联表已修改（递增数据库中的版本号），各进程下次使用时重建
+    参数兼容 Django 信号接收函数
+    """
+    bump_kb_version(RELATION)
+
+
+def reload_incidence_matrix() -> IncidenceMatrix:
+    """关联表数据更新后强制重建"""
+    return get_incidence_matrix(reload=True)
@@ -0,0 +1,128 @@
+import csv
+import time
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.db import connection
+
+PROB_QUANTUM = Decimal('1e-10')  # DiseaseProb / SymptomProb 的 probability 为 DECIMAL(20, 10)
+
+
+def read_prob_csv(path: str) -> Iterator[Tuple[str, Decimal]]:
+    """逐行读取 名称,概率 格式的 CSV（无表头），跳过空行"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            yield row[0].strip(), Decimal(row[1].strip()).quantize(PROB_QUANTUM)
+
+
+def relation_rows(kg) -> Iterator[Tuple[str, List[str]]]:
+    """逐个疾病读取知识图谱的疾病-症状关系 (疾病名称, 症状列表)，使用快照时按需解码"""
+    for d in kg.all_disease():
+        info = kg.info[d]
+        yield info.name.strip(), list(info.symptom) if isinstance(info.symptom, (list, tuple)) else []
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ensure_table(model) -> bool:
+    """表不存在时按模型建表（用于本地 SQLite 等未手工建表的库），返回是否新建"""
+    if model._meta.db_table in connection.introspection.table_names():
+        return False
+    with connection.schema_editor() as editor:
+        editor.create_model(model)
+    return True
+
+
+def ensure_unique_constraints(model) -> List[str]:
+    """
+    为已存在的表补建模型中声明的唯一约束（未托管的表不经过迁移，需要由加载命令创建）
+    同一名称存在多行时无法建立唯一约束，需先用 sync_table(replace=True) 去重
+    :return: 新建的约束名称
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(cursor, table)
+    unique_columns = {tuple(c['columns']) for c in existing.values() if c['unique']}
+
+    created = []
+    for constraint in model._meta.constraints:
+        columns = tuple(model._meta.get_field(f).column for f in getattr(constraint, 'fields', ()))
+        if not columns or columns in unique_columns:
+            continue
+        with connection.schema_editor() as editor:
+            editor.add_constraint(model, constraint)
+        created.append(constraint.name)
+    return created
+
+
+def sync_table(model,
+               key_field: str,
+               value_field: str,
+               rows: Iterable[Tuple[str, Any]],
+               chunk_size: int = 1000,
+               replace: bool = False) -> Dict[str, float]:
+    """
+    按名称把数据同步到表中：新名称批量插入，值变化的批量更新，未变化的跳过，因此重复执行结果不变
+    调用方负责事务
+    :param model: 目标模型
+    :param key_field: 名称列，如 'disease_name'
+    :param value_field: 值列，如 'probability'
+    :param rows: [(名称, 值), ...]，可为生成器；同名以最后一行为准
+    :param chunk_size: 每批处理的行数
+    :param replace: 是否删除数据源中没有的行（含重复名称的多余行）
+    :return: {'rows', 'created', 'updated', 'unchanged', 'deleted', 'seconds', 'rows_per_sec'}
+    """
+    start = time.perf_counter()
+    stats = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    kept = set()  # 已同步的主键
+
+    for chunk in _chunks(rows, chunk_size):
+        stats['rows'] += len(chunk)
+        values = dict(chunk)
+        existing = {}
+        for obj in model.objects.filter(**{f'{key_field}__in': list(values)}).only('pk', key_field, value_field):
+            existing.setdefault(getattr(obj, key_field), obj)
+
+        to_create, to_update = [], []
+        for name, value in values.items():
+            obj = existing.get(name)
+            if obj is None:
+                to_create.append(model(**{key_field: name, value_field: value}))
+            elif getattr(obj, value_field) != value:
+                setattr(obj, value_field, value)
+                to_update.append(obj)
+            else:
+                stats['unchanged'] += 1
+            if obj is not None:
+                kept.add(obj.pk)
+
+        created = model.objects.bulk_create(to_create, batch_size=chunk_size)
+        if replace and created and created[0].pk is None:  # 不返回主键的数据库重新查询
+            kept.update(model.objects.filter(**{f'{key_field}__in': [getattr(o, key_field) for o in created]})
+                        .values_list('pk', flat=True))
+        else:
+            kept.update(o.pk for o in created)
+        if to_update:
+            model.objects.bulk_update(to_update, [value_field], batch_size=chunk_size)
+        stats['created'] += len(to_create)
+        stats['updated'] += len(to_update)
+        stats['rows'] -= len(chunk) - len(values)  # 同一批内的重复名称只计一次
+
+    if replace:
+        stale = [pk for pk in model.objects.values_list('pk', flat=True).iterator() if pk not in kept]
+        for chunk in _chunks(stale, chunk_size):
+            stats['deleted'] += model.objects.filter(pk__in=chunk).delete()[0]
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
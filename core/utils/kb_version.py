@@ -0,0 +1,51 @@
+"""
+知识库数据版本（关联表 / 先验概率表）
+版本号存于数据库 kb_version 表，所有进程可见：任何进程（如 manage.py load_kb）修改数据后递增，
+各进程取用共享的关联矩阵、先验概率表时读取版本号（每 settings.KB_VERSION_CHECK_INTERVAL 秒至多一次查询），
+与已加载的版本不同即重新加载
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+RELATION = 'relation'
+PRIORS = 'priors'
+
+_versions: Dict[str, int] = {}
+_checked_at: Optional[float] = None
+_lock = threading.Lock()
+
+
+def kb_version(name: str) -> int:
+    """数据的当前版本号（从未修改过为 0）"""
+    global _versions, _checked_at
+    from core.models import KnowledgeBaseVersion
+
+    versions, now = _versions, time.monotonic()
+    if _checked_at is None or now - _checked_at >= settings.KB_VERSION_CHECK_INTERVAL:
+        versions = KnowledgeBaseVersion.current()
+        with _lock:
+            _versions, _checked_at = versions, now
+    return versions.get(name, 0)
+
+
+def expire_kb_versions():
+    """下次取用时重新读取版本号"""
+    global _checked_at
+    with _lock:
+        _checked_at = None
+
+
+def bump_kb_version(*names: str):
+    """
+    数据修改后递增版本号（在调用方的事务中执行，提交后其他进程可见）
+    :param names: RELATION / PRIORS
+    """
+    from core.models import KnowledgeBaseVersion
+
+    KnowledgeBaseVersion.bump(*names)
+    expire_kb_versions()
+    transaction.on_commit(expire_kb_versions)
@@ -0,0 +1,199 @@
+"""
+知识图谱二进制快照（列式存储）
+文件布局：
+    MAGIC(8 字节) | 头部长度(uint32) | 头部 JSON | 各数据段（8 字节对齐）
+数据段：
+    strings.offsets / strings.data  -- 去重后的字符串表（utf-8）
+    <标量字段>                        -- 每个疾病一个字符串 id (uint32)
+    <列表字段>.offsets / .values      -- 每个疾病的字符串 id 区间 (uint32)
+    name_order                       -- 按疾病名称排序后的行号，用于二分查找
+"""
+
+import os
+import json
+import mmap
+import struct
+from dataclasses import fields
+from typing import Dict, List, Iterator, Iterable
+from collections.abc import Mapping
+
+import numpy as np
+
+MAGIC = b'KGSNAP1\x00'
+_DTYPE = np.dtype('<u4')
+_ALIGN = 8
+
+
+def _list_fields(cls) -> List[str]:
+    """DiseaseInfo 中的列表字段"""
+    return [f.name for f in fields(cls) if f.default_factory is list]
+
+
+def _scalar_fields(cls) -> List[str]:
+    """DiseaseInfo 中的字符串字段"""
+    return [f.name for f in fields(cls) if f.default_factory is not list]
+
+
+def snapshot_path_for(data_path: str) -> str:
+    """数据文件对应的默认快照路径，如 data/medical.json -> data/medical.kgsnap"""
+    return os.path.splitext(data_path)[0] + '.kgsnap'
+
+
+def build_snapshot(diseases: Iterable, snapshot_path: str) -> int:
+    """
+    将疾病信息编译为列式快照文件
+    :param diseases: DiseaseInfo 可迭代对象
+    :param snapshot_path: 输出路径
+    :return: 写入的疾病数量
+    """
+    from .knowledge_graph import DiseaseInfo
+
+    diseases = list(diseases)
+    scalar_fields = _scalar_fields(DiseaseInfo)
+    list_fields = _list_fields(DiseaseInfo)
+
+    # 1. 字符串驻留
+    string_ids: Dict[str, int] = {}
+
+    def intern(s) -> int:
+        s = '' if s is None else str(s)
+        if s not in string_ids:
+            string_ids[s] = len(string_ids)
+        return string_ids[s]
+
+    sections: Dict[str, np.ndarray] = {}
+    for name in scalar_fields:
+        sections[name] = np.array([intern(getattr(d, name)) for d in diseases], dtype=_DTYPE)
+    for name in list_fields:
+        offsets, values = [0], []
+        for d in diseases:
+            items = getattr(d, name) or []
+            values.extend(intern(item) for item in items)
+            offsets.append(len(values))
+        sections[f'{name}.offsets'] = np.array(offsets, dtype=_DTYPE)
+        sections[f'{name}.values'] = np.array(values, dtype=_DTYPE)
+
+    names = [d.name for d in diseases]
+    sections['name_order'] = np.array(sorted(range(len(names)), key=names.__getitem__), dtype=_DTYPE)
+
+    encoded = [s.encode('utf-8') for s in string_ids]
+    str_offsets = np.zeros(len(encoded) + 1, dtype=_DTYPE)
+    np.cumsum([len(b) for b in encoded], out=str_offsets[1:])
+    sections['strings.offsets'] = str_offsets
+    str_data = b''.join(encoded)
+
+    # 2. 计算各段偏移量并写入
+    payload = [(name, arr.tobytes()) for name, arr in sections.items()] + [('strings.data', str_data)]
+    layout, cursor = {}, 0
+    for name, raw in payload:
+        layout[name] = [cursor, len(raw)]
+        cursor += len(raw) + (-len(raw)) % _ALIGN
+
+    header = json.dumps({'count': len(diseases), 'sections': layout}).encode('utf-8')
+    base = len(MAGIC) + 4 + len(header)
+    base += (-base) % _ALIGN
+
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(b'\x00' * (base - f.tell()))
+        for name, raw in payload:
+            f.write(raw)
+            f.write(b'\x00' * ((-len(raw)) % _ALIGN))
+    os.replace(tmp_path, snapshot_path)  # 原子替换，避免其他进程读到半个文件
+    return len(diseases)
+
+
+class KGSnapshot:
+    """只读快照，数据通过 mmap 按需解码，多个 fork 出的 worker 共享同一份页缓存"""
+
+    def __init__(self, snapshot_path: str):
+        from .knowledge_graph import DiseaseInfo
+
+        self.path = snapshot_path
+        with open(snapshot_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"不是有效的知识图谱快照: {snapshot_path}")
+        (header_len,) = struct.unpack_from('<I', self._mm, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(self._mm[header_start:header_start + header_len])
+        base = header_start + header_len
+        base += (-base) % _ALIGN
+
+        self.count: int = header['count']
+        self._layout = {name: (base + start, length) for name, (start, length) in header['sections'].items()}
+        self._cls = DiseaseInfo
+        self._scalar_fields = _scalar_fields(DiseaseInfo)
+        self._list_fields = _list_fields(DiseaseInfo)
+
+        self._arrays = {
+            name: self._array(name) for name in self._layout if name != 'strings.data'
+        }
+        self._str_offsets = self._arrays['strings.offsets']
+        self._str_base = self._layout['strings.data'][0]
+
+    def _array(self, name: str) -> np.ndarray:
+        """零拷贝地把数据段映射为 numpy 数组"""
+        start, length = self._layout[name]
+        return np.frombuffer(self._mm, dtype=_DTYPE, count=length // _DTYPE.itemsize, offset=start)
+
+    def string(self, string_id: int) -> str:
+        """按 id 解码字符串"""
+        start = self._str_base + int(self._str_offsets[string_id])
+        end = self._str_base + int(self._str_offsets[string_id + 1])
+        return self._mm[start:end].decode('utf-8')
+
+    def field(self, row: int, name: str):
+        """解码第 row 个疾病的单个字段"""
+        if name in self._list_fields:
+            offsets, values = self._arrays[f'{name}.offsets'], self._arrays[f'{name}.values']
+            return [self.string(i) for i in values[offsets[row]:offsets[row + 1]]]
+        return self.string(self._arrays[name][row])
+
+    def name(self, row: int) -> str:
+        return self.string(self._arrays['name'][row])
+
+    def disease(self, row: int):
+        """解码第 row 个疾病为 DiseaseInfo"""
+        return self._cls(**{name: self.field(row, name) for name in self._scalar_fields + self._list_fields})
+
+    def find(self, name: str) -> int:
+        """二分查找疾病名称对应的行号，不存在时返回 -1"""
+        order = self._arrays['name_order']
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name(order[mid]) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.name(order[lo]) == name:
+            return int(order[lo])
+        return -1
+
+
+class SnapshotDiseaseMap(Mapping):
+    """与 Dict[str, DiseaseInfo] 接口一致的只读映射，访问时才解码"""
+
+    def __init__(self, snapshot: KGSnapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, name: str):
+        row = self.snapshot.find(name)
+        if row < 0:
+            raise KeyError(name)
+        return self.snapshot.disease(row)
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.snapshot.find(name) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(self.snapshot.count):
+            yield self.snapshot.name(row)
+
+    def __len__(self) -> int:
+        return self.snapshot.count
@@ -1,10 +1,15 @@
 import os
 import json
+import threading
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Mapping
 from dataclasses import dataclass, field
 from fuzzywuzzy import fuzz
 
+from .fuzzy_index import FuzzyNameIndex
+from .symptom_index import SymptomDiseaseIndex
+from .kg_snapshot import KGSnapshot, SnapshotDiseaseMap, build_snapshot, snapshot_path_for
+
 
 @dataclass
 class DiseaseInfo:
@@ -54,15 +59,47 @@ class DiseaseInfo:
         return res
 
 
+DEFAULT_DATA_PATH = os.path.join(Path(__file__).parent.parent.parent, "data/medical.json")
+
+
 class KnowledgeGraph:
     """疾病数据库类，用于加载和查询疾病信息"""
 
-    def __init__(self, data_path: str = os.path.join(Path(__file__).parent.parent.parent, "data/medical.json")):
-        self.info: Dict[str, DiseaseInfo] = {}
-        self.load_from_json(data_path)
+    def __init__(self, data_path: str = DEFAULT_DATA_PATH, use_snapshot: bool = True):
+        """
+        :param data_path: medical.json 路径
+        :param use_snapshot: 存在不旧于 JSON 的快照文件时，优先通过 mmap 加载快照
+        """
+        self.data_path = data_path
+        self.snapshot: Optional[KGSnapshot] = None
+        self.info: Mapping[str, DiseaseInfo] = {}
+        self._name_index: Optional[FuzzyNameIndex] = None
+        self._symptom_index: Optional[SymptomDiseaseIndex] = None
+
+        snapshot_path = snapshot_path_for(data_path)
+        if use_snapshot and _is_fresh_snapshot(snapshot_path, data_path):
+            self.load_from_snapshot(snapshot_path)
+        else:
+            self.load_from_json(data_path)
+
+    def load_from_snapshot(self, snapshot_path: str):
+        """从二进制快照加载疾病数据（字段按需解码）"""
+        self.snapshot = KGSnapshot(snapshot_path)
+        self.info = SnapshotDiseaseMap(self.snapshot)
+        self._name_index = None
+        self._symptom_index = None
+
+    def build_snapshot(self, snapshot_path: Optional[str] = None) -> str:
+        """将当前疾病数据编译为二进制快照，返回快照路径"""
+        snapshot_path = snapshot_path or snapshot_path_for(self.data_path)
+        build_snapshot(self.info.values(), snapshot_path)
+        return snapshot_path
 
     def load_from_json(self, file_path: str):
         """从JSON文件加载疾病数据"""
+        self.info = {}
+        self._name_index = None
+        self._symptom_index = None
         with open(file_path, 'r', encoding='utf-8') as f:
             for line in f:
                 if line.strip():
@@ -101,17 +138,42 @@ class KnowledgeGraph:
                     # 添加到字典
                     self.info[disease.name] = disease
 
+    @property
+    def name_index(self) -> FuzzyNameIndex:
+        """疾病名称模糊匹配索引（首次使用时构建）"""
+        if self._name_index is None:
+            self._name_index = FuzzyNameIndex(self.info.keys())
+        return self._name_index
+
+    @property
+    def symptom_index(self) -> SymptomDiseaseIndex:
+        """症状 -> 疾病倒排索引（首次使用时构建）"""
+        if self._symptom_index is None:
+            self._symptom_index = SymptomDiseaseIndex.from_knowledge_graph(self)
+        return self._symptom_index
+
     def _fuzzy_search(self, query: str, threshold: int = 75) -> List[Dict]:
         """
-        模糊搜索疾病名称
+        模糊搜索疾病名称（先用索引筛选候选，再精确打分）
         :param query: 查询字符串
         :param threshold: 相似度阈值(0-100)
         :return: 包含匹配结果的列表，按相似度排序
         """
-        results = []
         query = query.lower().strip()
+        index = self.name_index
+        rows = index.candidates([query], threshold)[0]
+        names = index.names if rows is None else [index.names[i] for i in rows]
+        return self._score_names(query, names, threshold)
+
+    def _fuzzy_search_scan(self, query: str, threshold: int = 75) -> List[Dict]:
+        """模糊搜索疾病名称（对所有疾病逐个打分，用作对照基准）"""
+        return self._score_names(query.lower().strip(), self.info.keys(), threshold)
 
-        for name, disease in self.info.items():
+    @staticmethod
+    def _score_names(query: str, names, threshold: int) -> List[Dict]:
+        """对给定疾病名称逐个打分，返回达到阈值的结果，按相似度降序"""
+        results = []
+        for name in names:
             # 使用多种模糊匹配算法
             ratio = fuzz.ratio(query, name.lower())
             partial_ratio = fuzz.partial_ratio(query, name.lower())
@@ -129,12 +191,33 @@ class KnowledgeGraph:
         # 按相似度降序排序
         return sorted(results, key=lambda x: x['match_score'], reverse=True)
 
+    def search_many(self, query_list: List[str], threshold: int = 90,
+                    limit: Optional[int] = None) -> Dict[str, List[Dict]]:
+        """
+        批量模糊搜索：所有查询统一归一化、去重，一次性计算 查询×疾病 的得分上界矩阵，
+        只对可能达到阈值的候选精确打分
+        :param query_list: 查询字符串列表
+        :param threshold: 相似度阈值(0-100)
+        :param limit: 每个查询最多返回的结果数，None 表示不限制
+        :return: {查询: [{'disease': ..., 'match_score': ...}, ...]}，与 _fuzzy_search 的结果一致
+        """
+        normalized = {query: query.lower().strip() for query in query_list}
+        unique = list(dict.fromkeys(normalized.values()))
+
+        index = self.name_index
+        scored = {}
+        for query, rows in zip(unique, index.candidates(unique, threshold)):
+            names = index.names if rows is None else [index.names[i] for i in rows]
+            scored[query] = self._score_names(query, names, threshold)[:limit]
+
+        return {query: list(scored[norm]) for query, norm in normalized.items()}
+
     def search_diseases(self, query_list: List[str], threshold: int = 90):
         """模糊搜索"""
         matches_diseases = set()
+        matches = self.search_many(query_list, threshold)
         for query in query_list:
-            results = self._fuzzy_search(query, threshold)
-            for result in results:
+            for result in matches[query]:
                 if result['disease'] not in matches_diseases:
                     matches_diseases.add(result['disease'])
                     break
@@ -171,8 +254,59 @@ class KnowledgeGraph:
         return self.info.keys()
 
 
+def _is_fresh_snapshot(snapshot_path: str, data_path: str) -> bool:
+    """快照存在且不早于 JSON 数据文件（JSON 不存在时只要快照存在即可）"""
+    if not os.path.exists(snapshot_path):
+        return False
+    if not os.path.exists(data_path):
+        return True
+    return os.path.getmtime(snapshot_path) >= os.path.getmtime(data_path)
+
+
+def _source_mtime(data_path: str) -> float:
+    """数据源（JSON 及其快照）的最新修改时间"""
+    paths = [p for p in (data_path, snapshot_path_for(data_path)) if os.path.exists(p)]
+    if not paths:
+        raise FileNotFoundError(data_path)
+    return max(os.path.getmtime(p) for p in paths)
+
+
+# ====================== 进程级共享实例 ======================
+_kg_registry: Dict[str, KnowledgeGraph] = {}  # {数据文件路径: 知识图谱}
+_kg_mtime: Dict[str, float] = {}  # {数据文件路径: 加载时的文件修改时间}
+_kg_lock = threading.Lock()
+
+
+def get_knowledge_graph(data_path: str = DEFAULT_DATA_PATH, reload: bool = False) -> KnowledgeGraph:
+    """
+    获取进程内共享的知识图谱（惰性加载）
+    首次调用时解析数据文件，之后直接复用；数据文件或快照修改时间变化时自动重新加载
+    :param data_path: 数据文件路径
+    :param reload: 是否强制重新加载
+    :return: KnowledgeGraph 实例
+    """
+    mtime = _source_mtime(data_path)
+    kg = _kg_registry.get(data_path)
+    if kg is not None and not reload and _kg_mtime.get(data_path) == mtime:
+        return kg
+
+    with _kg_lock:
+        # 加锁后再检查一次，避免多个线程重复解析
+        kg = _kg_registry.get(data_path)
+        if kg is None or reload or _kg_mtime.get(data_path) != mtime:
+            kg = KnowledgeGraph(data_path)
+            _kg_registry[data_path] = kg
+            _kg_mtime[data_path] = mtime
+        return kg
+
+
+def reload_knowledge_graph(data_path: str = DEFAULT_DATA_PATH) -> KnowledgeGraph:
+    """强制重新加载共享知识图谱"""
+    return get_knowledge_graph(data_path, reload=True)
+
+
 if __name__ == '__main__':
-    kg = KnowledgeGraph()
+    kg = get_knowledge_graph()
 
     d = ['运动性晕厥', '低血糖', '中暑', '贫血', '体位性低血压', '过度换气综合征', '心肌缺血', '脑供血不足', '脱水',
          '心律失常']
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+DEFAULT_TEMPERATURE = 1.0  # 请求未指定 temperature 时接口的默认值
+
+
+class MemoryCache:
+    """进程内 LRU 缓存，条目带过期时间"""
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """磁盘缓存（SQLite 单表），多进程可共享同一文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < time.time():
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires) VALUES (?, ?, ?)", (key, value, expires)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMCache:
+    """
+    大模型响应缓存
+    键为 模型+消息+参数 的哈希，先查内存层，未命中再查磁盘层（命中后回填内存层）；
+    temperature 高于 max_temperature 的请求视为非确定性输出，不读也不写缓存；
+    未指定 temperature 的请求按接口默认值计，默认上限与之相同，因此可以缓存（“重新生成”由调用方跳过读取，见 AIGenerator）
+    """
+
+    def __init__(self,
+                 tiers: List,
+                 ttl: Optional[float] = None,
+                 max_temperature: float = DEFAULT_TEMPERATURE):
+        """
+        :param tiers: 缓存层（由快到慢），每层需实现 get(key) / set(key, value, ttl)
+        :param ttl: 过期时间（秒），None 为不过期
+        :param max_temperature: 可缓存请求的最高 temperature
+        """
+        self.tiers = list(tiers)
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'bypass': 0, **{f'tier{i}_hits': 0 for i in range(len(self.tiers))}}
+
+    def key(self, request: Dict) -> Optional[str]:
+        """请求对应的缓存键；不可缓存（temperature 过高）时返回 None"""
+        temperature = request.get('temperature', DEFAULT_TEMPERATURE)
+        if temperature is None:
+            temperature = DEFAULT_TEMPERATURE
+        if temperature > self.max_temperature:
+            self._count('bypass')
+            return None
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(key, value, self.ttl)
+                self._count('hits', f'tier{i}_hits')
+                return value
+        self._count('misses')
+        return None
+
+    def set(self, key: str, value: str):
+        for tier in self.tiers:
+            tier.set(key, value, self.ttl)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def _count(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._stats[name] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计：hits / misses / bypass / 各层命中次数 / hit_rate"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# ====================== 进程级共享实例 ======================
+_cache: Optional[LLMCache] = None
+_cache_key: Optional[tuple] = None
+_cache_lock = threading.Lock()
+
+
+def _cache_config() -> tuple:
+    return (
+        settings.LLM_CACHE_ENABLED, settings.LLM_CACHE_SIZE, settings.LLM_CACHE_TTL,
+        settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_TEMPERATURE
+    )
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """获取进程内共享的响应缓存（配置变化时重建），未启用时返回 None"""
+    global _cache, _cache_key
+    key = _cache_config()
+    if _cache_key == key:
+        return _cache
+
+    with _cache_lock:
+        if _cache_key != key:
+            enabled, size, ttl, path, max_temperature = key
+            cache = None
+            if enabled:
+                tiers = [MemoryCache(size)]
+                if path:
+                    tiers.append(SQLiteCache(path))
+                cache = LLMCache(tiers, ttl=ttl, max_temperature=max_temperature)
+            _cache, _cache_key = cache, key
+        return _cache
@@ -0,0 +1,239 @@
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Iterable, Optional
+
+import numpy as np
+
+from core.models import DiagnosisSession
+from .entropy_calculator import EntropyCalculator
+
+
+class SessionPosterior:
+    """
+    单个会话的增量贝叶斯状态
+    缓存疾病概率向量、症状是否已回答的掩码，以及与疾病概率无关的对数似然项。
+    行归一化的关联矩阵每行只有 0 和 1/(该行剩余症状数) 两种取值，因此只需缓存每行的剩余症状数，
+    回答一个症状时以 O(疾病数) 更新它和疾病概率，之后对剩余症状做一次广播计算 IEG，
+    无需重新查询数据库或重建矩阵
+    """
+
+    def __init__(self,
+                 ec: EntropyCalculator,
+                 disease_names: List[str],
+                 disease_prob: Dict[str, Optional[float]],
+                 answered: Iterable[str] = (),
+                 turn: int = 0,
+                 discarded_mass: float = 0.0):
+        """
+        :param ec: 熵计算工具
+        :param disease_names: 候选疾病
+        :param disease_prob: 当前疾病概率（未归一化亦可）
+        :param answered: 已回答的症状
+        :param turn: 当前状态对应的 session.diseases 长度
+        :param discarded_mass: 会话此前剪枝已丢弃的概率质量
+        """
+        self.ec = ec
+        self.turn = turn
+        self.discarded_mass = discarded_mass
+        self.data_version = ec.data_version
+        inc = ec.incidence
+        self.disease_names = list(disease_names)
+        d_idx = inc.disease_index(self.disease_names)
+
+        # 症状全集即首轮 IEG 的症状
+        s_idx = inc.symptoms_of(d_idx)
+        self.symptom_names = [inc.symptom_names[i] for i in s_idx]
+        self.symptom_col = {s: col for col, s in enumerate(self.symptom_names)}
+
+        # 与疾病概率无关的部分，整个会话只计算一次
+        self.matrix = inc.submatrix(d_idx, s_idx).astype(float)  # 0/1，用于概率更新
+        self.present = self.matrix > 0
+        self.log_zero = np.log(ec.epsilon)  # log(0 + eps)
+        self.log_one = np.log(1.0 + ec.epsilon)  # log(1 - 0 + eps)
+
+        self.rho = ec.priors.symptom_prob(s_idx)
+
+        self.active = np.ones(len(self.symptom_names), dtype=bool)
+        for s in answered:
+            if s in self.symptom_col:
+                self.active[self.symptom_col[s]] = False
+        self.total_rho = float(np.nansum(self.rho[self.active]))
+        self.row_active = self.matrix[:, self.active].sum(axis=1)  # 每个疾病剩余的症状数
+
+        self.p_l = self._normalize_prob(disease_prob)
+
+    @classmethod
+    def from_priors(cls, ec: EntropyCalculator, disease_names: List[str]) -> 'SessionPosterior':
+        """新会话：使用 DiseaseProb 的先验概率，对应首轮保存后的 session.diseases[0]"""
+        return cls(ec, disease_names, ec.priors.disease_prob_dict(disease_names), turn=1)
+
+    @classmethod
+    def from_session(cls, ec: EntropyCalculator, session: DiagnosisSession,
+                     pending_symptom: Optional[str] = None) -> 'SessionPosterior':
+        """
+        从已保存的会话重建状态
+        :param pending_symptom: 本轮刚记录、尚未参与概率更新的症状
+        """
+        disease_prob = session.diseases[-1]
+        answered = [s for s in session.ans_to_symptom if s != pending_symptom]
+        return cls(ec, list(disease_prob), disease_prob, answered=answered, turn=len(session.diseases),
+                   discarded_mass=session.discarded_mass)
+
+    def _normalize_prob(self, disease_prob: Dict[str, Optional[float]]) -> np.ndarray:
+        """与 get_disease_prob 一致的归一化：缺失或负值按 0 处理"""
+        p_l = np.array([max(disease_prob.get(d) or 0.0, 0.0) for d in self.disease_names], dtype=float)
+        p_l = p_l / max(np.sum(p_l), self.ec.epsilon)
+        return self.ec._safe_normalize(p_l)
+
+    def fork(self) -> 'SessionPosterior':
+        """复制会随回答变化的部分（关联矩阵、症状概率等只读数据共享），用于推测执行"""
+        other = copy.copy(self)
+        other.active = self.active.copy()
+        other.row_active = self.row_active.copy()
+        other.p_l = self.p_l.copy()
+        return other
+
+    @property
+    def answered(self) -> set:
+        return {s for s, active in zip(self.symptom_names, self.active) if not active}
+
+    def disease_prob(self) -> Dict[str, float]:
+        return {d: float(p) for d, p in zip(self.disease_names, self.p_l)}
+
+    def ieg(self) -> Dict[str, float]:
+        """对尚未回答的症状计算 IEG，结果与 EntropyCalculator.calculate_ieg 一致"""
+        cols = np.flatnonzero(self.active)
+        if cols.size == 0:
+            return {}
+
+        ec = self.ec
+        p_l = self.p_l
+
+        # 行归一化后非零元为 1/剩余症状数，对应的对数项按行取值
+        inv = 1.0 / np.maximum(self.row_active, 1.0)
+        present = self.present[:, cols]
+        log_p_k_l = np.where(present, np.log(inv + ec.epsilon)[:, None], self.log_zero)
+        log_pn_k_l = np.where(present, np.log(1.0 - inv + ec.epsilon)[:, None], self.log_one)
+
+        H_0 = -np.sum(p_l * np.log(p_l + ec.epsilon))
+        H_cond = ec.cond_entropy_from_logs(
+            self.rho[cols] / max(self.total_rho, ec.epsilon),
+            log_p_l=np.log(p_l + ec.epsilon),
+            log_p_k_l=log_p_k_l,
+            log_pn_k_l=log_pn_k_l
+        )
+        ieg = np.abs((H_0 - H_cond) / max(H_0, ec.epsilon))
+        ieg = np.nan_to_num(ieg, nan=0.0, posinf=0.0, neginf=0.0)
+        return {self.symptom_names[c]: float(v) for c, v in zip(cols, ieg)}
+
+    def answer(self, symptom: str, symptom_response: bool):
+        """
+        记录一个症状的回答：先把该症状移出候选并计算本轮 IEG（沿用更新前的疾病概率），
+        再对疾病概率做一次贝叶斯更新
+        :return: (本轮 IEG, 更新后的疾病概率)
+        """
+        ec = self.ec
+        col = self.symptom_col.get(symptom)
+
+        # 概率更新使用回答前的症状集合归一化症状概率
+        rho_total_before = max(self.total_rho, ec.epsilon)
+        if col is not None and self.active[col]:
+            self.active[col] = False
+            self.row_active -= self.matrix[:, col]
+            if not np.isnan(self.rho[col]):
+                self.total_rho -= self.rho[col]
+
+        ieg = self.ieg()
+
+        if col is not None:
+            rho_k = 0.0 if np.isnan(self.rho[col]) else self.rho[col] / rho_total_before
+            p_k_l = self.matrix[:, col]
+        else:
+            rho_k = 0.0
+            p_k_l = np.ones(len(self.disease_names), dtype=float)
+        self.p_l = ec.bayes_update(self.p_l, p_k_l, rho_k, symptom_response)
+        self.turn += 1
+
+        return ieg, self.disease_prob()
+
+    def prune(self, max_mass: float, min_diseases: int = 1) -> Dict[str, float]:
+        """
+        剪枝：按概率从小到大丢弃疾病，整个会话累计丢弃的概率质量不超过 max_mass，
+        症状全集随之缩小为剩余疾病涉及的症状（与按剩余疾病重建的状态一致），之后每轮的计算量随之减少
+        :param max_mass: 会话允许丢弃的概率质量，0 为不剪枝
+        :param min_diseases: 至少保留的疾病数
+        :return: 本次丢弃的疾病及其丢弃前的概率
+        """
+        n = len(self.disease_names)
+        budget = max_mass - self.discarded_mass
+        if budget <= 0 or n <= max(min_diseases, 1):
+            return {}
+
+        order = np.argsort(self.p_l, kind='stable')
+        mass = np.cumsum(self.p_l[order])
+        k = min(int(np.searchsorted(mass, budget, side='right')), n - max(min_diseases, 1))
+        if k <= 0:
+            return {}
+
+        drop, keep = order[:k], np.sort(order[k:])
+        pruned = {self.disease_names[i]: float(self.p_l[i]) for i in drop}
+        self.discarded_mass += float(mass[k - 1])
+
+        # 只属于被丢弃疾病的症状移出全集；保留疾病的剩余症状数不变
+        cols = np.flatnonzero(self.present[keep].any(axis=0))
+        self.disease_names = [self.disease_names[i] for i in keep]
+        self.symptom_names = [self.symptom_names[c] for c in cols]
+        self.symptom_col = {s: col for col, s in enumerate(self.symptom_names)}
+        self.matrix = self.matrix[np.ix_(keep, cols)]
+        self.present = self.matrix > 0
+        self.rho = self.rho[cols]
+        self.active = self.active[cols]
+        self.total_rho = float(np.nansum(self.rho[self.active]))
+        self.row_active = self.row_active[keep]
+        self.p_l = self.ec._safe_normalize(self.p_l[keep])
+        return pruned
+
+
+class PosteriorCache:
+    """进程内的会话状态缓存（LRU），状态与数据库不一致时由调用方重建"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[str, SessionPosterior]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session: DiagnosisSession, pending_symptom: Optional[str] = None,
+            data_version=None) -> Optional[SessionPosterior]:
+        """
+        取出与会话当前状态一致的缓存，不一致时丢弃并返回 None
+        :param data_version: 当前的 (关联矩阵版本, 先验概率表版本)，与缓存不同则视为过期
+        """
+        key = str(session.session_id)
+        with self._lock:
+            state = self._data.pop(key, None)
+        if state is None:
+            return None
+
+        expected = {s for s in session.ans_to_symptom if s != pending_symptom and s in state.symptom_col}
+        last = session.diseases[-1] if session.diseases else {}
+        if state.turn != len(session.diseases) or state.answered != expected \
+                or state.disease_names != list(last):
+            return None
+        if data_version is not None and state.data_version != data_version:
+            return None
+        return state
+
+    def put(self, session_id, state: SessionPosterior):
+        with self._lock:
+            self._data[str(session_id)] = state
+            self._data.move_to_end(str(session_id))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._data.pop(str(session_id), None)
+
+
+posterior_cache = PosteriorCache()
@@ -0,0 +1,147 @@
+import threading
+from typing import Dict, List, Iterable, Optional, Tuple
+
+import numpy as np
+
+from .incidence import IncidenceMatrix, get_incidence_matrix
+from .kb_version import PRIORS, bump_kb_version, kb_version
+
+
+class PriorTables:
+    """
+    DiseaseProb / SymptomProb 的内存副本
+    概率按关联矩阵的疾病、症状 id 存入 float 数组，先验查询变为数组下标取值；
+    数组末位为 nan，使 id 为 -1（未知名称）的取值自然为缺失
+    """
+
+    def __init__(self,
+                 incidence: IncidenceMatrix,
+                 disease_rows: Iterable[Tuple[str, float]],
+                 symptom_rows: Iterable[Tuple[str, float]],
+                 version: int = 0):
+        """
+        :param incidence: 提供 id 映射的关联矩阵
+        :param disease_rows: [(疾病名称, 概率), ...]
+        :param symptom_rows: [(症状名称, 概率), ...]
+        :param version: 版本号，表数据重新加载时递增
+        """
+        self.version = version
+        self.incidence_version = incidence.version
+        self.incidence = incidence
+        self.disease, self._disease_extra = self._build(disease_rows, incidence.disease_ids)
+        self.symptom, self._symptom_extra = self._build(symptom_rows, incidence.symptom_ids)
+
+    @staticmethod
+    def _build(rows, ids: Dict[str, int]):
+        values = np.full(len(ids) + 1, np.nan)
+        extra = {}  # 不在关联矩阵中的名称
+        for name, prob in rows:
+            prob = float(prob) if prob is not None else np.nan
+            if name in ids:
+                values[ids[name]] = prob
+            else:
+                extra[name] = prob
+        return values, extra
+
+    @classmethod
+    def from_db(cls, incidence: IncidenceMatrix, version: int = 0) -> 'PriorTables':
+        """从 DiseaseProb / SymptomProb 表加载"""
+        from core.models import DiseaseProb, SymptomProb
+
+        return cls(
+            incidence,
+            DiseaseProb.objects.values_list('disease_name', 'probability').iterator(),
+            SymptomProb.objects.values_list('symptom_name', 'probability').iterator(),
+            version=version
+        )
+
+    @classmethod
+    def from_arrays(cls, incidence: IncidenceMatrix, disease: np.ndarray, symptom: np.ndarray,
+                    disease_extra: Optional[Dict[str, float]] = None,
+                    symptom_extra: Optional[Dict[str, float]] = None, version: int = 0) -> 'PriorTables':
+        """由已按 id 排列的概率数组构建（不复制数组，末位需为 nan）"""
+        self = cls.__new__(cls)
+        self.version = version
+        self.incidence_version = incidence.version
+        self.incidence = incidence
+        self.disease, self._disease_extra = disease, dict(disease_extra or {})
+        self.symptom, self._symptom_extra = symptom, dict(symptom_extra or {})
+        return self
+
+    def with_overrides(self,
+                       disease_rows: Iterable[Tuple[str, float]] = (),
+                       symptom_rows: Iterable[Tuple[str, float]] = ()) -> 'PriorTables':
+        """复制一份并替换部分概率（用于比较调整后的先验）"""
+        disease, disease_extra = self.disease.copy(), dict(self._disease_extra)
+        symptom, symptom_extra = self.symptom.copy(), dict(self._symptom_extra)
+        for values, extra, ids, rows in ((disease, disease_extra, self.incidence.disease_ids, disease_rows),
+                                         (symptom, symptom_extra, self.incidence.symptom_ids, symptom_rows)):
+            for name, prob in rows:
+                prob = float(prob) if prob is not None else np.nan
+                if name in ids:
+                    values[ids[name]] = prob
+                else:
+                    extra[name] = prob
+        return PriorTables.from_arrays(self.incidence, disease, symptom, disease_extra, symptom_extra,
+                                       version=self.version)
+
+    def disease_prob(self, d_idx: np.ndarray) -> np.ndarray:
+        """按疾病 id 取先验概率，缺失为 nan"""
+        return self.disease[d_idx]
+
+    def symptom_prob(self, s_idx: np.ndarray) -> np.ndarray:
+        """按症状 id 取先验概率，缺失为 nan"""
+        return self.symptom[s_idx]
+
+    @staticmethod
+    def _as_dict(names: List[str], values: np.ndarray, extra: Dict[str, float]) -> Dict[str, Optional[float]]:
+        result = {}
+        for name, v in zip(names, values):
+            if np.isnan(v):
+                v = extra.get(name, np.nan)
+            result[name] = None if np.isnan(v) else float(v)
+        return result
+
+    def disease_prob_dict(self, disease_names: Iterable[str]) -> Dict[str, Optional[float]]:
+        """与 DiseaseProb.get_prob 相同格式：{'疾病': 概率}，不存在的为 None"""
+        names = list(disease_names)
+        return self._as_dict(names, self.disease_prob(self.incidence.disease_index(names)), self._disease_extra)
+
+    def symptom_prob_dict(self, symptom_names: Iterable[str]) -> Dict[str, Optional[float]]:
+        """与 SymptomProb.get_prob 相同格式：{'病征': 概率}，不存在的为 None"""
+        names = list(symptom_names)
+        return self._as_dict(names, self.symptom_prob(self.incidence.symptom_index(names)), self._symptom_extra)
+
+
+# ====================== 进程级共享实例 ======================
+_priors: Optional[PriorTables] = None
+_priors_lock = threading.Lock()
+
+
+def get_prior_tables() -> PriorTables:
+    """
+    获取进程内共享的先验概率表
+    关联矩阵重建，或数据库中记录的先验表版本变化后（包括其他进程修改）自动重新加载
+    """
+    global _priors
+    incidence = get_incidence_matrix()
+    version = kb_version(PRIORS)
+    priors = _priors
+    if priors is not None and priors.version == version and priors.incidence_version == incidence.version:
+        return priors
+
+    with _priors_lock:
+        priors = _priors
+        if priors is None or priors.version != version or priors.incidence_version != incidence.version:
+            _priors = priors = PriorTables.from_db(incidence, version=version)
+        return priors
+
+
+def invalidate_prior_tables(*args, **kwargs) -> int:
+    """
+    标记先验概率表失效（递增数据库中的版本号），各进程下次使用时重新读取
+    参数兼容 Django 信号接收函数
+    :return: 新的版本号
+    """
+    bump_kb_version(PRIORS)
+    return kb_version(PRIORS)
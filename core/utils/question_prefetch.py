@@ -0,0 +1,74 @@
+import heapq
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+
+
+class QuestionPrefetcher:
+    """
+    问题预取：IEG 算出后，在后台线程为排名靠前的症状提前生成问题，
+    结果以 (疾病名称串, 症状) 为键缓存为 Future，下一轮命中时直接取用（未完成时等待其完成）
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[Tuple[str, str], Future]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=settings.PIM_PREFETCH_WORKERS, thread_name_prefix='question-prefetch'
+                    )
+        return self._executor
+
+    @staticmethod
+    def top_symptoms(IEG: Dict[str, float], k: int, exclude: Iterable[str] = ()) -> list:
+        """IEG 最大的 k 个症状（不含 exclude）"""
+        exclude = set(exclude)
+        return heapq.nlargest(k, (s for s in IEG if s not in exclude), key=IEG.get)
+
+    def prefetch(self, generate: Callable[[str, str], str], d_name: str, symptoms: Iterable[str]):
+        """
+        后台生成问题
+        :param generate: generate(d_name, symptom) -> 问题
+        :param d_name: 疾病名称串（与生成问题的提示词一致）
+        :param symptoms: 待预取的症状
+        """
+        for symptom in symptoms:
+            key = (d_name, symptom)
+            with self._lock:
+                if key in self._data:
+                    continue
+                self._data[key] = future = Future()
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            self.executor.submit(self._run, future, generate, d_name, symptom)
+
+    @staticmethod
+    def _run(future: Future, generate, d_name: str, symptom: str):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(generate(d_name, symptom))
+        except Exception as e:
+            future.set_exception(e)
+
+    def pop(self, d_name: str, symptom: str) -> Optional[Future]:
+        """取出预取结果（可能仍在生成中），没有预取过则返回 None"""
+        with self._lock:
+            return self._data.pop((d_name, symptom), None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+question_prefetcher = QuestionPrefetcher()
@@ -0,0 +1,91 @@
+from multiprocessing import shared_memory
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .incidence import IncidenceMatrix
+from .prior_tables import PriorTables
+
+# 数组名 -> (共享内存块名称, 形状, dtype)
+ArraySpec = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+
+class SharedArrays:
+    """
+    把只读的 numpy 数组放入共享内存，子进程按 spec 挂载后直接读取，不逐个进程复制
+    创建方负责 close() 和 unlink()，挂载方只需 close()
+    """
+
+    def __init__(self, blocks: Dict[str, shared_memory.SharedMemory], arrays: Dict[str, np.ndarray], owner: bool):
+        self._blocks = blocks
+        self.arrays = arrays
+        self.owner = owner
+
+    @classmethod
+    def create(cls, arrays: Dict[str, np.ndarray]) -> 'SharedArrays':
+        blocks, views = {}, {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            view[...] = array
+            blocks[name], views[name] = block, view
+        return cls(blocks, views, owner=True)
+
+    @classmethod
+    def attach(cls, spec: ArraySpec) -> 'SharedArrays':
+        blocks, views = {}, {}
+        for name, (block_name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            view.flags.writeable = False
+            blocks[name], views[name] = block, view
+        return cls(blocks, views, owner=False)
+
+    @property
+    def spec(self) -> ArraySpec:
+        return {name: (self._blocks[name].name, view.shape, view.dtype.str) for name, view in self.arrays.items()}
+
+    def close(self):
+        self.arrays = {}
+        for block in self._blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self._blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def share_knowledge(incidence: IncidenceMatrix, priors: PriorTables) -> Tuple[SharedArrays, dict]:
+    """
+    把关联矩阵与先验概率表的数组放入共享内存
+    :return: (共享数组, 子进程重建所需的参数)；名称等非数组数据随参数传递
+    """
+    shared = SharedArrays.create({
+        'indptr': incidence.indptr, 'indices': incidence.indices,
+        'disease': priors.disease, 'symptom': priors.symptom,
+    })
+    meta = {
+        'spec': shared.spec,
+        'disease_names': incidence.disease_names,
+        'symptom_names': incidence.symptom_names,
+        'disease_extra': priors._disease_extra,
+        'symptom_extra': priors._symptom_extra,
+    }
+    return shared, meta
+
+
+def attach_knowledge(meta: dict) -> Tuple[SharedArrays, IncidenceMatrix, PriorTables]:
+    """子进程中按 share_knowledge 的参数挂载共享数组并重建关联矩阵与先验概率表（不复制数组）"""
+    shared = SharedArrays.attach(meta['spec'])
+    arrays = shared.arrays
+    incidence = IncidenceMatrix.from_arrays(meta['disease_names'], meta['symptom_names'],
+                                            arrays['indptr'], arrays['indices'])
+    priors = PriorTables.from_arrays(incidence, arrays['disease'], arrays['symptom'],
+                                     meta['disease_extra'], meta['symptom_extra'])
+    return shared, incidence, priors
@@ -0,0 +1,139 @@
+"""
+症状 -> 疾病倒排索引
+患者描述中的症状名称用 Aho-Corasick 自动机一次扫描全部找出（与症状数无关，只与描述长度有关），
+再按倒排表对包含这些症状的疾病打分：
+    score(d) = sum(idf(s) for s in 匹配症状 ∩ d的症状) / sqrt(d的症状数)
+idf(s) = log(1 + 疾病总数 / 含 s 的疾病数)，越少见的症状权重越高；除以症状数的平方根，避免症状多的疾病总是排在前面
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+# 紧接在症状前面时视为否定（如“没有发热”“无咳嗽”），该症状不计入
+NEGATIONS = ('没有', '没', '无', '不', '未', '否认')
+
+
+class SymptomMatcher:
+    """多模式子串匹配（Aho-Corasick），逐字符扫描一次找出文本中出现的全部症状名称"""
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for pid, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(pid)
+
+        # 按层构建失配指针，并把失配链上的输出合并到当前节点
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        找出文本中出现的全部模式
+        :return: [(起始位置, 结束位置, 模式下标), ...]，按结束位置排序
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        found = []
+        for end, ch in enumerate(text, 1):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in out[node]:
+                found.append((end - len(self.patterns[pid]), end, pid))
+        return found
+
+
+class SymptomDiseaseIndex:
+    """症状 -> 疾病倒排索引（CSR 存储），diseases 的顺序即知识图谱的遍历顺序"""
+
+    def __init__(self, relation: Iterable[Tuple[str, Sequence[str]]]):
+        """
+        :param relation: [(疾病名称, 症状列表), ...]
+        """
+        self.disease_names: List[str] = []
+        postings: Dict[str, List[int]] = {}
+        sizes = []
+        for d, (name, symptoms) in enumerate(relation):
+            self.disease_names.append(name)
+            symptoms = list(dict.fromkeys(s.strip() for s in symptoms or () if s and s.strip()))
+            sizes.append(len(symptoms))
+            for s in symptoms:
+                postings.setdefault(s, []).append(d)
+
+        self.symptom_names: List[str] = list(postings)
+        self.symptom_id = {s: i for i, s in enumerate(self.symptom_names)}
+        self.indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(p) for p in postings.values()])
+        self.indices = np.array([d for p in postings.values() for d in p], dtype=np.int64)
+
+        df = np.diff(self.indptr).astype(float)
+        self.idf = np.log1p(len(self.disease_names) / np.maximum(df, 1.0))
+        self.norm = np.sqrt(np.maximum(np.array(sizes, dtype=float), 1.0))
+        self.matcher = SymptomMatcher(self.symptom_names)
+
+    @classmethod
+    def from_knowledge_graph(cls, kg) -> 'SymptomDiseaseIndex':
+        return cls((d.name, d.symptom) for d in kg.info.values())
+
+    def match(self, text: str) -> List[str]:
+        """
+        描述中提到的症状（按出现顺序去重）；被更长的匹配包含的短症状和紧跟否定词的症状不计入
+        """
+        found = self.matcher.find(text or '')
+        symptoms = []
+        for start, end, pid in found:
+            if any(s <= start and end <= e and (s, e) != (start, end) for s, e, _ in found):
+                continue
+            if text[:start].endswith(NEGATIONS):
+                continue
+            symptoms.append(self.symptom_names[pid])
+        return list(dict.fromkeys(symptoms))
+
+    def rank(self, symptoms: Sequence[str], k: int) -> List[Tuple[str, float]]:
+        """
+        按匹配症状给疾病打分，取前 k 个（同分按知识图谱顺序）
+        :return: [(疾病, 得分), ...]
+        """
+        ids = np.array([self.symptom_id[s] for s in symptoms if s in self.symptom_id], dtype=np.int64)
+        if k <= 0 or ids.size == 0:
+            return []
+
+        lo, hi = self.indptr[ids], self.indptr[ids + 1]
+        lens = hi - lo
+        seg = np.repeat(np.arange(ids.size), lens)
+        pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens) + lo[seg]
+        scores = np.bincount(self.indices[pos], weights=self.idf[ids][seg],
+                             minlength=len(self.disease_names)) / self.norm
+
+        hits = np.flatnonzero(scores > 0)
+        order = hits[np.lexsort((hits, -scores[hits]))][:k]
+        return [(self.disease_names[d], float(scores[d])) for d in order]
+
+    def suggest(self, text: str, k: int) -> List[Tuple[str, float]]:
+        """由患者描述直接给出前 k 个候选疾病"""
+        return self.rank(self.match(text), k)
@@ -1,31 +1,47 @@
 # 医生端接口（CDG）
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404
 from django.http import JsonResponse
 from core.models import DiagnosisSession, SOAPNote
 from core.services import CDGService
+from core.views.streaming import wants_event_stream, event_stream_response
 
 
-def note_generate(request, session_id):
-    session = get_object_or_404(DiagnosisSession, session_id=session_id)
-    note, created = SOAPNote.objects.get_or_create(
+async def note_generate(request, session_id):
+    session = await aget_object_or_404(DiagnosisSession.objects.with_turns(), session_id=session_id)
+    note, created = await SOAPNote.objects.aget_or_create(
         session=session,
         defaults={'initial': '', 'soap': '', 'final': ''}
     )
 
     if request.method == 'POST':
         step = request.POST.get('step')
-        cdg_service = CDGService(session)  # 封装了各类方法
+        regenerate = step in ('initial', 'soap', 'final') and bool(getattr(note, step))  # 已有内容即“重新生成”
+        cdg_service = await sync_to_async(CDGService)(session, refresh=regenerate)  # 封装了各类方法
+
+        if step in ('soap', 'final') and wants_event_stream(request):
+            # 流式返回，生成完成后保存
+            if step == 'soap':
+                chunks = cdg_service.astream_soap()
+            else:
+                chunks = cdg_service.astream_final(disease=note.disease_name)
+
+            async def save(text):
+                setattr(note, step, text)
+                await note.asave()
+
+            return event_stream_response(chunks, save)
 
         if step == 'initial':
             # 1. 初次生成
-            note.disease_name, note.initial = cdg_service.generate_initial()
+            note.disease_name, note.initial = await cdg_service.agenerate_initial()
         elif step == 'soap':
             # 2. soap 格式
-            note.soap = cdg_service.generate_soap()
+            note.soap = await cdg_service.agenerate_soap()
         elif step == 'final':
             # 3. 根据疾病补充信息
-            note.final = final_note = cdg_service.generate_final(disease=note.disease_name)
-        note.save()
+            note.final = final_note = await cdg_service.agenerate_final(disease=note.disease_name)
+        await note.asave()
         return JsonResponse({'status': 'success', 'content': getattr(note, step)})
 
     context = {
@@ -1,23 +1,70 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
 from django.shortcuts import render, get_object_or_404
 from core.models import DiagnosisSession, SOAPNote, PSGReport
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _encode_cursor(session: DiagnosisSession) -> str:
+    """游标：最后更新时间（微秒时间戳）-主键"""
+    return f"{(session.updated_at - _EPOCH) // timedelta(microseconds=1)}-{session.pk}"
+
+
+def _decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """解析游标；格式错误或超出范围（如篡改的超大数字）时返回 None，即回到第一页"""
+    try:
+        micros, pk = cursor.split('-')
+        pk = int(pk)
+        if not 0 < pk < 2 ** 63:
+            return None
+        return _EPOCH + timedelta(microseconds=int(micros)), pk
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def session_page(cursor: Optional[str] = None,
+                 size: Optional[int] = None) -> Tuple[List[DiagnosisSession], Optional[str]]:
+    """
+    按最后更新时间倒序取一页会话摘要（只读取摘要列，不读取各轮记录）
+    :param cursor: 上一页返回的游标，None 为第一页
+    :param size: 每页条数，默认 settings.HISTORY_PAGE_SIZE
+    :return: (本页会话, 下一页游标)，没有下一页时游标为 None
+    """
+    size = size or settings.HISTORY_PAGE_SIZE
+    sessions = DiagnosisSession.objects.summaries()
+    position = _decode_cursor(cursor) if cursor else None
+    if position is not None:
+        updated_at, pk = position
+        sessions = sessions.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, pk__lt=pk))
+
+    page = list(sessions[:size + 1])
+    next_cursor = _encode_cursor(page[size - 1]) if len(page) > size else None
+    return page[:size], next_cursor
+
 
 def history_list(request):
-    """展示所有历史会话"""
-    sessions = DiagnosisSession.objects.all().order_by('-updated_at')
-    return render(request, 'history.html', {'sessions': sessions})
+    """展示历史会话（分页）"""
+    sessions, next_cursor = session_page(request.GET.get('cursor'))
+    return render(request, 'history.html', {'sessions': sessions, 'next_cursor': next_cursor})
 
 
 def history_detail(request, session_id):
     """展示单个会话的详细记录"""
-    session = get_object_or_404(DiagnosisSession, session_id=session_id)
+    session = get_object_or_404(DiagnosisSession.objects.with_turns(), session_id=session_id)
     soap_note = SOAPNote.objects.filter(session=session).first()  # 修改为允许空值
     report = PSGReport.objects.filter(session=session).first()  # 修改为允许空值
+    sessions, next_cursor = session_page(request.GET.get('cursor'))
 
     context = {
         'session': session,
         'soap_note': soap_note,
         'report': report,
-        'sessions': DiagnosisSession.objects.all().order_by('-updated_at')
+        'sessions': sessions,
+        'next_cursor': next_cursor,
+        'current_id': session.session_id,
     }
     return render(request, 'history_detail.html', context)
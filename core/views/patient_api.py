@@ -1,4 +1,6 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.conf import settings
 from django.http import JsonResponse
 from core.models import DiagnosisSession
 from core.services import PIMService
@@ -16,9 +18,9 @@ def start_chat(request):
     return redirect('patient_chat', session_id=new_session.session_id)
 
 
-def patient_chat(request, session_id):
-    """聊天页面视图"""
-    session = get_object_or_404(DiagnosisSession, session_id=session_id)
+async def patient_chat(request, session_id):
+    """聊天页面视图（异步：等待大模型时不占用工作线程）"""
+    session = await aget_object_or_404(DiagnosisSession.objects.with_turns(), session_id=session_id)
 
     if request.method == 'POST':
         # 获取患者输入
@@ -27,60 +29,74 @@ def patient_chat(request, session_id):
             return JsonResponse({'error': '输入不能为空'}, status=400)
 
         # 调用PIM服务处理
-        pim_service = PIMService()
+        pim_service = await sync_to_async(PIMService)()
 
         if not session.patient_response:
             '''第一次问诊'''
-            session_data = pim_service.start_new_session(
+            session_data = await pim_service.astart_new_session(
                 patient_desc=patient_input,
                 session_id=session_id
             )
 
-            # 生成问题
-            ai_response = pim_service.generate_question(session_data['IEG'], session_data['diseases'])
-
-            # 保存初始数据
-            session.append_patient_response(patient_input)
-            session.append_disease(session_data['diseases'])
-            session.append_IEG(session_data['IEG'])
-            session.append_ai_response(ai_response)
+            # 生成问题（没有可问的症状时不提问）
+            ai_response = None
+            if session_data['IEG']:
+                ai_response = await pim_service.agenerate_question(session_data['IEG'], session_data['diseases'])
+
+            # 保存初始数据（一次写入）
+            await sync_to_async(session.apply_turn)(
+                patient_response=patient_input,
+                disease=session_data['diseases'],
+                ieg=session_data['IEG'],
+                ai_response=ai_response
+            )
 
         else:
             '''后续对话'''
 
             # 获取症状回答 True or False
-            ieg = DiagnosisSession.objects.get(session_id=session_id).IEG[-1]
-            symptom_opt = max(ieg)
-            for k in ieg:
-                if ieg[k] > ieg[symptom_opt]:
-                    symptom_opt = k
-            question = DiagnosisSession.objects.get(session_id=session_id).ai_response[-1]
-            symptom_response = pim_service.is_symptom_occurrence(patient_input, symptom_opt, question)  # {'S1': True}
-            session.update_symptom_answer(symptom_opt, symptom_response[symptom_opt])  # 存入症状回答
-
-            session_data = pim_service.next_round(
-                patient_ans=patient_input,
-                session_id=session_id,
-                symptom_response=symptom_response[symptom_opt],
-                symptom=symptom_opt
+            ieg = session.IEG[-1]
+            symptom_opt = max(ieg, key=ieg.get)  # 与 generate_question 选择的症状一致
+            question = session.ai_response[-1]
+            if settings.PIM_SPECULATIVE:
+                # 分类与下一问题生成并发进行
+                symptom_response, session_data, ai_response = await pim_service.anext_round_speculative(
+                    session, patient_input, symptom_opt, question
+                )
+            else:
+                symptom_response = await pim_service.ais_symptom_occurrence(patient_input, symptom_opt, question)  # {'S1': True}
+
+                session_data = await sync_to_async(pim_service.next_round)(
+                    patient_ans=patient_input,
+                    session_id=session_id,
+                    symptom_response=symptom_response[symptom_opt],
+                    symptom=symptom_opt,
+                    session=session
+                )
+
+                # 获取下一个问题（剪枝等原因导致没有可问的症状时不提问）
+                ai_response = None
+                if session_data['IEG']:
+                    ai_response = await pim_service.agenerate_question(session_data['IEG'], session_data['diseases'])
+
+            # 保存数据：症状回答与本轮记录一次写入
+            await sync_to_async(session.apply_turn)(
+                patient_response=patient_input,
+                disease=session_data['diseases'],
+                ieg=session_data['IEG'],
+                ai_response=ai_response,
+                symptom_answer=(symptom_opt, symptom_response[symptom_opt]),
+                pruned=session_data['pruned']
             )
 
-            # 获取下一个问题
-            ai_response = pim_service.generate_question(session_data['IEG'], session_data['diseases'])
-
-            # 保存数据
-            session.append_patient_response(patient_input)
-            session.append_disease(session_data['diseases'])
-            session.append_IEG(session_data['IEG'])
-            session.append_ai_response(ai_response)
-
             # 刷新session对象
             # session.refresh_from_db()
 
             # 返回JSON响应
             # return JsonResponse({'session': session})
 
-        if pim_service.should_stop(session_id=session_id):
+        # 没有可问的症状时直接结束；本轮已写入 session 的内存记录，无需重新读取
+        if not session_data['IEG'] or await sync_to_async(pim_service.should_stop)(session=session):
             return redirect('report_generate', session_id=session_id)
 
     # GET请求显示聊天页面
@@ -1,23 +1,34 @@
 # 患者报告接口（PSG）
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404
 from django.http import JsonResponse
 from core.models import DiagnosisSession, SOAPNote, PSGReport
 from core.services import PSGService
+from core.views.streaming import wants_event_stream, event_stream_response
 
 
-def report_generate(request, session_id):
-    session = get_object_or_404(DiagnosisSession, session_id=session_id)
+async def report_generate(request, session_id):
+    session = await aget_object_or_404(DiagnosisSession.objects.with_turns(), session_id=session_id)
     disease_dict = session.diseases[-1]
     disease_name = max(disease_dict, key=disease_dict.get)
     # note = get_object_or_404(SOAPNote, session_id=session_id)  # 获取 SOAP
-    report, created = PSGReport.objects.get_or_create(
+    report, created = await PSGReport.objects.aget_or_create(
         session=session,
         defaults={'concise': '', 'final': '', 'disease_name': disease_name}
     )
 
     if request.method == "POST":
         step = request.POST.get('step')
-        psg_service = PSGService(session)
+        regenerate = step in ('concise', 'final') and bool(getattr(report, step))  # 已有内容即“重新生成”
+        psg_service = await sync_to_async(PSGService)(session, refresh=regenerate)
+
+        if step == 'final' and wants_event_stream(request):
+            # 流式返回，生成完成后保存
+            async def save(text):
+                report.final = text
+                await report.asave()
+
+            return event_stream_response(psg_service.astream_final(), save)
 
         if step == 'concise':
             # 1. 初次生成易懂报告
@@ -25,8 +36,8 @@ def report_generate(request, session_id):
             pass
         elif step == 'final':
             # 2. 最终
-            report.final = psg_service.generate_final()
-        report.save()
+            report.final = await psg_service.agenerate_final()
+        await report.asave()
         return JsonResponse({'status': 'success', 'content': getattr(report, step)})
 
     context = {
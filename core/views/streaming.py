@@ -0,0 +1,49 @@
+# 流式响应（Server-Sent Events）
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable
+
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+STREAM_ERROR_MESSAGE = "生成失败，请稍后重试"
+
+
+def wants_event_stream(request) -> bool:
+    """前端通过 Accept: text/event-stream 请求流式返回"""
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def _event(data: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def event_stream_response(chunks: AsyncIterator[str],
+                          on_complete: Callable[[str], Awaitable[None]]) -> StreamingHttpResponse:
+    """
+    把模型的流式输出转为 SSE 响应
+    每段文本发送 data: {"delta": ...}；生成完成后先调用 on_complete(完整文本) 保存，再发送 done 事件；
+    出错时记录日志、发送不含异常详情的 error 事件且不保存（客户端中途断开同样不保存）
+    :param chunks: 文本片段的异步迭代器
+    :param on_complete: 保存完整文本的协程函数
+    """
+
+    async def events():
+        parts = []
+        try:
+            async for delta in chunks:
+                parts.append(delta)
+                yield _event({'delta': delta})
+            await on_complete(''.join(parts))
+        except Exception:
+            logger.exception("流式生成失败")
+            yield _event({'error': STREAM_ERROR_MESSAGE}, event='error')
+            return
+        yield _event({'status': 'success'}, event='done')
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # 关闭反向代理缓冲
+    return response
@@ -10,7 +10,8 @@ CREATE TABLE IF NOT EXISTS disease_prob
     id           INT AUTO_INCREMENT PRIMARY KEY,
     disease_name VARCHAR(255)    NOT NULL,
     probability  DECIMAL(20, 10) NOT NULL,
-    created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uniq_disease_prob_name (disease_name)
 ) ENGINE = InnoDB
   DEFAULT CHARSET = utf8mb4;
 
@@ -10,7 +10,8 @@ CREATE TABLE IF NOT EXISTS relation_disease_symptom
     id           INT AUTO_INCREMENT PRIMARY KEY,
     disease_name VARCHAR(255) NOT NULL,
     symptom_list JSON         NOT NULL,
-    created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uniq_relation_disease_name (disease_name)
 ) ENGINE = InnoDB
   DEFAULT CHARSET = utf8mb4;
 